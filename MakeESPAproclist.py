@@ -7,7 +7,7 @@
 
 # This script creates Landsat scene processing lists for USGS/EROS/ESPA (https://espa.cr.usgs.gov)
 
-import os, sys, glob, datetime, argparse #, ieo
+import os, sys, glob, datetime, argparse, shlex, copy #, ieo
 from osgeo import ogr, osr
 
 try: # This is included as the module may not properly install in Anaconda.
@@ -22,101 +22,110 @@ except:
         print('Error: that is not a valid path for the IEO module. Exiting.')
         sys.exit()
 
-global proclevels, pathrowdict
-
-# Parse command line arguments
-parser = argparse.ArgumentParser('Create ESPA LEDAPS/ LaSRC process list for missing scenes.')
-parser.add_argument('--path', type = int, help = 'WRS-2 Path')
-parser.add_argument('--row', type = int, help = 'WRS-2 Row. If this is specified, then --path must also be specified.')
-parser.add_argument('--maxcc', default = 100, type = int, help = 'Maximum cloud cover in percent')
-parser.add_argument('--maxccland', default = 30, type = int, help = 'Maximum cloud cover over land in percent')
-parser.add_argument('--ccland', default = True, type = bool, help = 'Use land cloud cover, not full scene (Default = True)')
-parser.add_argument('--startdate', type = str, default = '1982/01/01', help = 'Starting date, YYYY/MM/DD')
-parser.add_argument('--enddate', type = str, default = None, help = 'Ending date, YYYY/MM/DD')
-parser.add_argument('--startdoy', type = int, help = 'Starting day of year, 1-366')
-parser.add_argument('--enddoy', type = int, help = 'Ending day of year, 1-366. If less than starting day of year then this will be used to span the new year.')
-parser.add_argument('--startyear', type = int, help = 'Starting year')
-parser.add_argument('--endyear', type = int, help = 'Ending year. If less than starting starting year then these will be swapped.')
-parser.add_argument('--landsat', type = int, help = 'Landsat number (4, 5, 7, or 8 only).')
-parser.add_argument('--sensor', type = str, help = 'Landsat sensor: TM, ETM, ETM_SLC_OFF, OLI, OLI_TIRS, TIRS')
-parser.add_argument('--shp', type = str, default = ieo.landsatshp, help = 'Full path and filename of alternative shapefile.')
-parser.add_argument('-o', '--outdir', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ESPA_processing_lists'), help = 'Output directory')
-parser.add_argument('--ignorelocal', type = bool, default = False, help = 'Ignore presence of local scenes.')
-parser.add_argument('--srdir', type = str, default = ieo.srdir, help = 'Local SR scene directory')
-parser.add_argument('--usesrdir', type = bool, default = True, help = 'Use local index of scenes rather than shapefile stored data')
-parser.add_argument('--allinpath', type = bool, default = True, help = 'Include missing scenes in path, even if they are too cloudy.')
-parser.add_argument('--minsunel', type = float, default = 15.0, help = 'Sun elevation beneath which scenes will be ignored.')
-parser.add_argument('--separate', type = bool, default = False, help = 'Separate output files for Landsats 4-7 and 8.')
-parser.add_argument('--L1GS', type = bool, default = False, help = 'Also get L1GS and L1GT scenes.')
-parser.add_argument('--L1GT', type = bool, default = False, help = 'Also get L1GT scenes but exclude L1GS.')
-parser.add_argument('--ALL', type = bool, default = False, help = 'Get any scene regardless of processing level.')
-args = parser.parse_args()
-
-# type conversions of start and end dates to datetime.datetime objects
-args.startdate = datetime.datetime.strptime(args.startdate,'%Y/%m/%d')
-if args.enddate:
-    args.enddate = datetime.datetime.strptime(args.enddate,'%Y/%m/%d')
-else:
-    args.enddate = datetime.datetime.today()
+import sceneindex
+from orderledger import OrderLedger, sceneidfromproductid
+from ingestledger import IngestLedger
 
-outdir = args.outdir
-infile = args.shp
-today = datetime.datetime.today()
-todaystr = today.strftime('%Y%m%d-%H%M%S')
+global proclevels, pathrowdict
 
-localscenelist = []
+args = None # Set by run()
+aoiscenes = None
+pendingscenes = set() # 16 character IDs of scenes ordered but not yet ingested
+field_names = []
+sensor = ''
+proclevels = ['L1TP']
+pathrowdict = {}
 
-if args.sensor:
-    if 'TM' in args.sensor:
-        sensor='LANDSAT_{}'.format(args.sensor)
-    elif not ('OLI' in args.sensor or 'TIRS' in args.sensor):
-        print('Error: this sensor is not supported. Acceptable sensors are: TM, ETM, ETM_SLC_OFF, OLI, OLI_TIRS, TIRS. Leaving --sensor blank will search for all sensors. Exiting.')
-        exit()
-    else:
-        sensor = args.sensor
-else:
-    sensor = ''
+def getparser():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser('Create ESPA LEDAPS/ LaSRC process list for missing scenes.')
+    parser.add_argument('--path', type = int, help = 'WRS-2 Path')
+    parser.add_argument('--row', type = int, help = 'WRS-2 Row. If this is specified, then --path must also be specified.')
+    parser.add_argument('--maxcc', default = 100, type = int, help = 'Maximum cloud cover in percent')
+    parser.add_argument('--maxccland', default = 30, type = int, help = 'Maximum cloud cover over land in percent')
+    parser.add_argument('--minclear', default = None, type = float, help = 'Minimum clear land percentage calculated from Fmask/ pixel QA at ingest (see clearstats.py). Statistics only exist for ingested scenes, so this only filters scenes listed again with --ignorelocal or --reorder. Scenes without these statistics are not filtered.')
+    parser.add_argument('--ccland', default = True, type = bool, help = 'Use land cloud cover, not full scene (Default = True)')
+    parser.add_argument('--startdate', type = str, default = '1982/01/01', help = 'Starting date, YYYY/MM/DD')
+    parser.add_argument('--enddate', type = str, default = None, help = 'Ending date, YYYY/MM/DD')
+    parser.add_argument('--startdoy', type = int, help = 'Starting day of year, 1-366')
+    parser.add_argument('--enddoy', type = int, help = 'Ending day of year, 1-366. If less than starting day of year then this will be used to span the new year.')
+    parser.add_argument('--startyear', type = int, help = 'Starting year')
+    parser.add_argument('--endyear', type = int, help = 'Ending year. If less than starting starting year then these will be swapped.')
+    parser.add_argument('--landsat', type = int, help = 'Landsat number (4, 5, 7, or 8 only).')
+    parser.add_argument('--sensor', type = str, help = 'Landsat sensor: TM, ETM, ETM_SLC_OFF, OLI, OLI_TIRS, TIRS')
+    parser.add_argument('--shp', type = str, default = ieo.landsatshp, help = 'Full path and filename of alternative shapefile.')
+    parser.add_argument('--aoi', type = str, default = None, help = 'Only include scenes whose footprints intersect the features of this vector file.')
+    parser.add_argument('-o', '--outdir', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ESPA_processing_lists'), help = 'Output directory')
+    parser.add_argument('--ignorelocal', type = bool, default = False, help = 'Ignore presence of local scenes.')
+    parser.add_argument('--srdir', type = str, default = ieo.srdir, help = 'Local SR scene directory')
+    parser.add_argument('--usesrdir', type = bool, default = True, help = 'Use local index of scenes rather than shapefile stored data')
+    parser.add_argument('--allinpath', type = bool, default = True, help = 'Include missing scenes in path, even if they are too cloudy.')
+    parser.add_argument('--minsunel', type = float, default = 15.0, help = 'Sun elevation beneath which scenes will be ignored.')
+    parser.add_argument('--separate', type = bool, default = False, help = 'Separate output files for Landsats 4-7 and 8.')
+    parser.add_argument('--L1GS', type = bool, default = False, help = 'Also get L1GS and L1GT scenes.')
+    parser.add_argument('--L1GT', type = bool, default = False, help = 'Also get L1GT scenes but exclude L1GS.')
+    parser.add_argument('--ALL', type = bool, default = False, help = 'Get any scene regardless of processing level.')
+    parser.add_argument('--orderledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'order_ledger.sqlite'), help = 'SQLite ledger of scenes in previous processing lists.')
+    parser.add_argument('--ledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ingest_ledger.sqlite'), help = 'SQLite ingest ledger.')
+    parser.add_argument('--orderexpiry', type = int, default = 30, help = 'Days after which a previously ordered scene that has not been ingested may be ordered again (0 = never, default = 30).')
+    parser.add_argument('--reorder', action = 'store_true', help = 'Include scenes in previous processing lists that have not yet been ingested.')
+    parser.add_argument('--label', type = str, default = None, help = 'Label included in output file names, e.g. ESPA_<label>_list<date>.txt.')
+    parser.add_argument('--queryfile', type = str, default = None, help = 'File of queries, one per line, each with arguments of this script (e.g. --path 207 --row 23 --startdoy 121 --enddoy 273). Arguments not set in a query are taken from the command line. Lists for all queries are created from a single load of the shapefile, local library, and order ledger, and scenes listed by one query are excluded from later queries.')
+    return parser
 
-if not args.path:
-    path = 0
-else:
-    path = args.path
-if not args.row:
-    row = 0
-else:
-    row = args.row
+# Attribute values used from the scene shapefile. These are cached per process, so that a calling
+# process only re-reads the shapefile after it has been modified.
+featurefields = ['sceneID', 'LandsatPID', 'sunEl', 'SensorID', 'acqDate', 'DT_L1', 'path', 'row', 'CCFull', 'CCLand', 'SR_path', 'ClearFrac']
+shapefilecache = {}
 
-if args.startdoy or args.enddoy:
-    if not (args.startdoy and args.enddoy):
-        print('Error: if used, both --startdoy and --enddoy must be defined. Exiting.')
-        exit()
-    
-if args.usesrdir:
-    dirs = [args.srdir, os.path.join(args.srdir,'L1G')]
-    for d in dirs:
-        flist = glob.glob(os.path.join(d,'L*_ref_{}.dat'.format(ieo.projacronym)))
-        if len(flist) > 0:
-            for f in flist:
-                if os.path.isfile(f):
-                    localscenelist.append(os.path.basename(f)[:16])
+def readfeatures(shapefile):
+    global field_names
+    state = sceneindex.shapefilestate(shapefile)
+    if shapefile in shapefilecache.keys() and shapefilecache[shapefile][0] == state:
+        field_names = shapefilecache[shapefile][2]
+        return shapefilecache[shapefile][1]
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    dataSource = driver.Open(shapefile, 0)
+    layer = dataSource.GetLayer()
+    layer_defn = layer.GetLayerDefn()
+    field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+    fields = [x for x in featurefields if x in field_names]
+    features = []
+    for feature in layer:
+        features.append({x: feature.GetField(x) for x in fields})
+    dataSource = None
+    shapefilecache[shapefile] = [state, features, field_names]
+    return features
 
-proclevels = ['L1TP']
-if args.L1GS:
-    proclevels = ['L1TP', 'L1GT', 'L1GS']
-elif args.L1GT:
-    proclevels = ['L1TP', 'L1GT']
-elif args.ALL:
-    proclevels = ['L1TP', 'L1GT', 'L1GS']
+def loadpathrows():
+    # Rows of each WRS-2 Path, read from ieo.WRS2 once per process
+    if len(pathrowdict) == 0:
+        driver = ogr.GetDriverByName("ESRI Shapefile")
+        dataSource = driver.Open(ieo.WRS2, 0)
+        layer = dataSource.GetLayer()
+        for feature in layer:
+            path = feature.GetField('Path')
+            row = feature.GetField('Row')
+            if not path in pathrowdict.keys():
+                pathrowdict[path] = []
+            if not row in pathrowdict[path]:
+                pathrowdict[path].append(row)
+        dataSource = None
+        for key in pathrowdict.keys():
+            pathrowdict[key].sort()
+    return pathrowdict
 
-def getscenedata(layer, localscenelist):
+def getscenedata(features, localscenelist):
     scenedata = {}
-    for feature in layer:
-        sceneID = feature.GetField("sceneID")
-        ProductID = feature.GetField("LandsatPID")
+    for feature in features:
+        sceneID = feature.get("sceneID")
+        if aoiscenes is not None and not sceneID in aoiscenes:
+            continue
+        ProductID = feature.get("LandsatPID")
         includescene = True
-        sunEl = feature.GetField("sunEl")
-        sensor = feature.GetField("SensorID")
-        acqDateval = feature.GetField("acqDate")
+        sunEl = feature.get("sunEl")
+        sensor = feature.get("SensorID")
+        acqDateval = feature.get("acqDate")
         try:
             acqDate = datetime.datetime.strptime(acqDateval, '%Y/%m/%d')
             datestr = acqDate.strftime('%Y%j')
@@ -126,27 +135,29 @@ def getscenedata(layer, localscenelist):
             datestr = sceneID[9:16]
             acqDate = datetime.datetime.strptime(datestr, '%Y%j')
 #            feature.SetField('acqDate', acqDate)
-        proclevel = feature.GetField("DT_L1")
+        proclevel = feature.get("DT_L1")
+        clearfrac = feature.get("ClearFrac")
         if sceneID[2:3] == '8' and ((datestr in L8exclude) or (sensor != 'OLI_TIRS')):
             includescene = False
         if sceneID[2:3] == '7' and datestr in L7exclude:
             includescene = False
         if sunEl: # ignore Null values
             if includescene and sunEl >= args.minsunel:
-                SR_file = feature.GetField("SR_path")
+                SR_file = feature.get("SR_path")
                 scenedata[sceneID] = {'LandsatPID': ProductID,
                                         'acqDate':acqDate, 
-                                        'Path': feature.GetField("path"), 
-                                        'Row': feature.GetField("row"), 
+                                        'Path': feature.get("path"), 
+                                        'Row': feature.get("row"), 
                                         'Sensor': sensor,  
-                                        'CCFull': feature.GetField("CCFull"), 
-                                        'CCLand': feature.GetField("CCLand"),
+                                        'CCFull': feature.get("CCFull"), 
+                                        'CCLand': feature.get("CCLand"),
                                         'sunEl': sunEl, 
                                         'SR_path': SR_file, 
-                                        'proclevel': proclevel}
+                                        'proclevel': proclevel,
+                                        'ClearFrac': clearfrac}
                 if SR_file and not args.usesrdir:
                     if os.path.isfile(SR_file):
-                        localscenelist.append(os.path.basename(SR_file)[:16])
+                        localscenelist.add(os.path.basename(SR_file)[:16])
     return scenedata, localscenelist
 
 def scenesearch(scenedata, sceneID, pathrowdict): # This function is still Ireland specific
@@ -169,10 +180,14 @@ def scenesearch(scenedata, sceneID, pathrowdict): # This function is still Irela
                 r += 1
     return scout    
 
+def belowminclear(scenedata, sceneID):
+    # True if the clear land percentage of an ingested scene is below --minclear
+    return args.minclear is not None and scenedata[sceneID]['ClearFrac'] is not None and scenedata[sceneID]['ClearFrac'] < args.minclear
+
 def findmissing(l8, l47, scenedata, localscenelist):
     keys = scenedata.keys()
     for sceneID in keys:
-        if not sceneID[:16] in localscenelist:
+        if not sceneID[:16] in localscenelist and not sceneID[:16] in pendingscenes and not belowminclear(scenedata, sceneID):
             if sceneID[2:3] == '8' and not any(sceneID in l8[key] for key in l8.keys()):
                 print('Adding {} to Landsat 8 processing list.'.format(sceneID))
                 if not sceneID[9:16] in l8.keys():
@@ -212,6 +227,10 @@ def populatelists(l8, l47, scenedata, localscenelist):
         sunEl = scenedata[sceneID]['sunEl']
         SR = scenedata[sceneID]['SR_path']
         proclevel = scenedata[sceneID]['proclevel']
+        if belowminclear(scenedata, sceneID):
+            continue
+        if sceneID[:16] in pendingscenes: # Ordered in a previous list, but not yet ingested
+            continue
         
         try:
             if (not sceneID[:16] in localscenelist or args.ignorelocal) and cc <= maxcc and sunEl >= args.minsunel and proclevel in proclevels: # Only run this for scenes that aren't present on disk or if we choose to ignore local copies.
@@ -271,7 +290,7 @@ def populatelists(l8, l47, scenedata, localscenelist):
                             sc = scenesearch(scenedata, sceneID, pathrowdict)
                             if len(sc) > 0:
                                 for s in sc:
-                                    if not s in l47[sceneID[9:16]]:
+                                    if not s in l47[sceneID[9:16]] and not s[:16] in pendingscenes:
                                         print('Also adding scene {} to the processing list.'.format(sceneID))
                                         l47[sceneID[9:16]].append(s)
                         
@@ -288,7 +307,7 @@ def populatelists(l8, l47, scenedata, localscenelist):
                             sc = scenesearch(scenedata, sceneID, pathrowdict)
                             if len(sc) > 0:
                                 for s in sc:
-                                    if not s in l8[sceneID[9:16]]:
+                                    if not s in l8[sceneID[9:16]] and not s[:16] in pendingscenes:
                                         print('Also adding scene {} to the processing list.'.format(sceneID))
                                         l8[sceneID[9:16]].append(s)
         except Exception as e:
@@ -310,94 +329,198 @@ for i in range(15):
 L7exclude.append('2017074')
 L7exclude.append('2017075')
 L7exclude.append('2017076')
-# Set various other variables
 
-pathrowdict = {}
-driver = ogr.GetDriverByName("ESRI Shapefile")
-dataSource = driver.Open(ieo.WRS2, 0)
-layer = dataSource.GetLayer()
-for feature in layer:
-    path = feature.GetField('Path')
-    row = feature.GetField('Row')
-    if not path in pathrowdict.keys():
-        pathrowdict[path] = []
-    if not row in pathrowdict[path]:
-        pathrowdict[path].append(row)
-dataSource = None
-for key in pathrowdict.keys():
-    pathrowdict[key].sort()
-
-print('Opening {}'.format(infile))
-if args.path and args.row:
-    print('Searching for scenes from WRS-2 Path {}, Row {}, with a maximum cloud cover of {:0.1f}%.'.format(args.path, args.row, args.maxcc))
-driver = ogr.GetDriverByName("ESRI Shapefile")
-dataSource = driver.Open(infile, 0)
-layer = dataSource.GetLayer()
-layer_defn = layer.GetLayerDefn()
-field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
-scenedata, localscenelist = getscenedata(layer, localscenelist)
+def run(runargs, shared = None):
+    # Creates the processing lists for parsed arguments runargs, and returns the list files written.
+    # Shapefile attributes and WRS-2 rows are cached per process, so that a calling process may run
+    # this repeatedly without re-reading unchanged shapefiles. If a dict shared is passed, the local
+    # scene list and pending orders are also read once and kept in it for later runs.
+    global args, aoiscenes, sensor, proclevels, pendingscenes
+    args = runargs
+    if shared is None:
+        shared = {}
+    # type conversions of start and end dates to datetime.datetime objects
+    if not isinstance(args.startdate, datetime.datetime):
+        args.startdate = datetime.datetime.strptime(args.startdate,'%Y/%m/%d')
+    if not args.enddate:
+        args.enddate = datetime.datetime.today()
+    elif not isinstance(args.enddate, datetime.datetime):
+        args.enddate = datetime.datetime.strptime(args.enddate,'%Y/%m/%d')
     
-
-l8 = {}
-l47 = {}
-l7slcoff = {}
-l5 = {}
-
-l8, l47 = populatelists(l8, l47, scenedata, localscenelist)
-
-if args.allinpath:
-    print('Now searching for missing scenes from same paths and dates of locally stored scenes.')
-    l8, l47 = findmissing(l8, l47, scenedata, localscenelist)
-
-
-if args.separate:
-    if len(l8.keys()) > 0:
-        i = 0
-        outfile = os.path.join(outdir, 'ESPA_L8_list{}.txt'.format(todaystr))
-        print('Writing output to: {}'.format(outfile))
-        keylist = list(l8.keys())
-        keylist.sort()
-        with open(outfile, 'w') as output:
-            for key in keylist:
-                for scene in l8[key]:
-                    if key.startswith('LC8'): # Excludes Landsat 8 scenes that do not contain both OLI and TIRS data 
-                        output.write('{}\n'.format(scenedata[scene]['LandsatPID']))
-                        i += 1
-        print('{} scenes for ESPA to process.'.format(i))
+    outdir = args.outdir
+    infile = args.shp
+    today = datetime.datetime.today()
+    todaystr = shared.get('todaystr', today.strftime('%Y%m%d-%H%M%S'))
+    outfiles = []
+    prefix = 'ESPA_'
+    if args.label:
+        prefix = 'ESPA_{}_'.format(args.label)
+    
+    if args.sensor:
+        if 'TM' in args.sensor:
+            sensor='LANDSAT_{}'.format(args.sensor)
+        elif not ('OLI' in args.sensor or 'TIRS' in args.sensor):
+            raise ValueError('This sensor is not supported: {}. Acceptable sensors are: TM, ETM, ETM_SLC_OFF, OLI, OLI_TIRS, TIRS. Leaving --sensor blank will search for all sensors.'.format(args.sensor))
+        else:
+            sensor = args.sensor
+    else:
+        sensor = ''
+    
+    if args.startdoy or args.enddoy:
+        if not (args.startdoy and args.enddoy):
+            raise ValueError('If used, both --startdoy and --enddoy must be defined.')
+        
+    localkey = 'local {} {}'.format(args.srdir, args.usesrdir)
+    if not localkey in shared.keys():
+        shared[localkey] = set()
+        if args.usesrdir:
+            dirs = [args.srdir, os.path.join(args.srdir,'L1G')]
+            for d in dirs:
+                flist = glob.glob(os.path.join(d,'L*_ref_{}.dat'.format(ieo.projacronym)))
+                if len(flist) > 0:
+                    for f in flist:
+                        if os.path.isfile(f):
+                            shared[localkey].add(os.path.basename(f)[:16])
+    localscenelist = set(shared[localkey]) # A set, as it is searched for every scene
+    
+    proclevels = ['L1TP']
+    if args.L1GS:
+        proclevels = ['L1TP', 'L1GT', 'L1GS']
+    elif args.L1GT:
+        proclevels = ['L1TP', 'L1GT']
+    elif args.ALL:
+        proclevels = ['L1TP', 'L1GT', 'L1GS']
+    
+    # Set various other variables
+    
+    loadpathrows()
+    
+    # Scenes in previous processing lists that have not expired or been ingested are excluded
+    orders = OrderLedger(args.orderledger)
+    pendingkey = 'pending {} {} {} {}'.format(args.orderledger, outdir, args.ledger, args.orderexpiry)
+    pendingscenes = set()
+    if not args.reorder:
+        if not pendingkey in shared.keys():
+            orders.importlists(outdir)
+            ledger = IngestLedger(args.ledger)
+            shared[pendingkey] = orders.pending(args.orderexpiry, ledger.ingestedscenes())
+            ledger.close()
+        pendingscenes = shared[pendingkey]
+        print('{} previously ordered scenes are pending and will be excluded.'.format(len(pendingscenes)))
+    
+    # Scenes intersecting the AOI are found with the footprint spatial index, which is updated first if
+    # the shapefile has changed since it was last synced
+    aoiscenes = None
+    if args.aoi:
+        index = sceneindex.SceneIndex()
+        index.sync(infile)
+        aoiscenes = set(index.query(geom = sceneindex.aoigeometry(args.aoi), startdate = args.startdate.strftime('%Y-%m-%d'), enddate = args.enddate.strftime('%Y-%m-%d')))
+        index.close()
+        print('{} scenes intersect the AOI: {}'.format(len(aoiscenes), args.aoi))
+    
+    print('Opening {}'.format(infile))
+    if args.path and args.row:
+        print('Searching for scenes from WRS-2 Path {}, Row {}, with a maximum cloud cover of {:0.1f}%.'.format(args.path, args.row, args.maxcc))
+    scenedata, localscenelist = getscenedata(readfeatures(infile), localscenelist)
+    
+    l8 = {}
+    l47 = {}
+    
+    l8, l47 = populatelists(l8, l47, scenedata, localscenelist)
     
-    if len(l47.keys()) > 0:
+    if args.allinpath:
+        print('Now searching for missing scenes from same paths and dates of locally stored scenes.')
+        l8, l47 = findmissing(l8, l47, scenedata, localscenelist)
+    
+    if args.separate:
+        if len(l8.keys()) > 0:
+            i = 0
+            outfile = os.path.join(outdir, '{}L8_list{}.txt'.format(prefix, todaystr))
+            print('Writing output to: {}'.format(outfile))
+            keylist = list(l8.keys())
+            keylist.sort()
+            with open(outfile, 'w') as output:
+                for key in keylist:
+                    for scene in l8[key]:
+                        if key.startswith('LC8'): # Excludes Landsat 8 scenes that do not contain both OLI and TIRS data 
+                            output.write('{}\n'.format(scenedata[scene]['LandsatPID']))
+                            i += 1
+            outfiles.append(outfile)
+            print('{} scenes for ESPA to process.'.format(i))
+        
+        if len(l47.keys()) > 0:
+            i = 0
+            outfile = os.path.join(outdir,'{}L47_list{}.txt'.format(prefix, todaystr))
+            print('Writing output to: {}'.format(outfile))
+            keylist = list(l47.keys())
+            keylist.sort()
+            with open(outfile, 'w') as output:
+                for key in keylist:
+                    for scene in l47[key]:
+                        if key[2:3] != '8':
+                            output.write('{}\n'.format(scenedata[scene]['LandsatPID']))
+                            i += 1
+            outfiles.append(outfile)
+            print('{} scenes for ESPA to process.'.format(i))
+    else:
         i = 0
-        outfile = os.path.join(outdir,'ESPA_L47_list{}.txt'.format(todaystr))
+        outfile = os.path.join(outdir,'{}list{}.txt'.format(prefix, todaystr))
         print('Writing output to: {}'.format(outfile))
-        keylist = list(l47.keys())
-        keylist.sort()
         with open(outfile, 'w') as output:
-            for key in keylist:
-                for scene in l47[key]:
-                    if key[2:3] != '8':
-                        output.write('{}\n'.format(scenedata[scene]['LandsatPID']))
-                        i += 1
+            for d in [l47, l8]:
+                if len(d.keys()) > 0:
+                    keylist = list(d.keys())
+                    keylist.sort()
+                    for key in keylist:
+                        for scene in d[key]:
+                            output.write('{}\n'.format(scenedata[scene]['LandsatPID']))
+                            i += 1
+        outfiles.append(outfile)
         print('{} scenes for ESPA to process.'.format(i))
-else:
-    i = 0
-    outfile = os.path.join(outdir,'ESPA_list{}.txt'.format(todaystr))
-    print('Writing output to: {}'.format(outfile))
-    with open(outfile, 'w') as output:
-        for d in [l47, l8]:
-            if len(d.keys()) > 0:
-                keylist = list(d.keys())
-                keylist.sort()
-                for key in keylist:
-                    for scene in d[key]:
-                        output.write('{}\n'.format(scenedata[scene]['LandsatPID']))
-                        i += 1
-    print('{} scenes for ESPA to process.'.format(i))
-                
-#        if len(l7)>0:
-#            for scene in l7:
-#                output.write('%s\n'%scene)
-#        if len(l5)>0:
-#            for scene in l5:
-#                output.write('%s\n'%scene)
+    for outfile in outfiles:
+        orders.importlist(outfile)
+        if pendingkey in shared.keys(): # Later runs with the same shared dict exclude the scenes just listed
+            with open(outfile, 'r') as lines:
+                shared[pendingkey].update(sceneidfromproductid(line.strip()) for line in lines if line.strip())
+    orders.close()
+    return outfiles
+
+def runbatch(batchargs):
+    # Creates processing lists for every query in batchargs.queryfile. All queries are evaluated
+    # against the same shapefile attributes and local scene list. Scenes in the list of one query are
+    # added to the pending orders, so they are excluded from those of later queries unless --reorder
+    # is set. Returns the list files written.
+    parser = getparser()
+    baseargs = copy.copy(batchargs)
+    baseargs.queryfile = None
+    baseargs.label = None
+    shared = {'todaystr': datetime.datetime.today().strftime('%Y%m%d-%H%M%S')}
+    outfiles = []
+    with open(batchargs.queryfile, 'r') as lines:
+        queries = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+    for i, query in enumerate(queries, start = 1):
+        print('\nQuery {} of {}: {}'.format(i, len(queries), query))
+        queryargs = parser.parse_args(shlex.split(query), namespace = copy.copy(baseargs))
+        if not queryargs.label: # Queries are written to separate files
+            if batchargs.label:
+                queryargs.label = '{}_q{}'.format(batchargs.label, i)
+            else:
+                queryargs.label = 'q{}'.format(i)
+        try:
+            outfiles.extend(run(queryargs, shared = shared))
+        except Exception as e:
+            print('Error processing query {}: {}'.format(i, e))
+            ieo.logerror(query, e)
+    return outfiles
+
+def main(argv = None):
+    args = getparser().parse_args(argv)
+    if args.queryfile:
+        outfiles = runbatch(args)
+    else:
+        outfiles = run(args)
+    print('Processing complete.')
+    return outfiles
 
-print('Processing complete.')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
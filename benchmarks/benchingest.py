@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script benchmarks newespaimport.py and makevrts.py against a synthetic library created with
+# synthespa.py. The following are timed:
+# 1. Ingest planning: a run of newespaimport.py over an ingest directory of archives that are all
+#    recorded as ingested, with the scene shapefile read (cold) or cached (warm).
+# 2. Per-scene import: a run of newespaimport.py over new archives, through the extract, import,
+#    and archive pipeline, including clear statistics and shapefile updates.
+# 3. VRT generation: a full run of makevrts.py, and an incremental run with nothing to rebuild.
+# 4. Catalog updates and CSV export of the VRT catalog.
+# The IEO module is replaced by ieostub.py, so that it does not need to be installed and no real
+# library is touched. GDAL and NumPy are required. Results are reported as CSV with the current
+# git commit, and may be appended to a report file to compare commits.
+
+import os, sys, argparse, tempfile, shutil, time, datetime, glob, contextlib
+import numpy as np
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+repodir = os.path.dirname(benchdir)
+sys.path.insert(0, repodir)
+sys.path.insert(0, benchdir)
+import ieostub, benchutil
+ieostub.install()
+
+parser = argparse.ArgumentParser('This script benchmarks ingest and VRT creation with a synthetic Landsat library.')
+parser.add_argument('--scenes', type = int, default = 1000, help = 'Number of ingested scenes in the library (default = 1000).')
+parser.add_argument('--planarchives', type = int, default = 500, help = 'Number of previously ingested archives in the ingest directory for the planning benchmark (default = 500).')
+parser.add_argument('--archives', type = int, default = 10, help = 'Number of new archives for the import benchmark (default = 10).')
+parser.add_argument('--xsize', type = int, default = 500, help = 'Scene width in pixels (default = 500).')
+parser.add_argument('--ysize', type = int, default = 500, help = 'Scene height in pixels (default = 500).')
+parser.add_argument('--paths', type = int, default = 4, help = 'Number of WRS-2 Paths, up to 8 (default = 4).')
+parser.add_argument('--rows', type = int, default = 4, help = 'Number of WRS-2 Rows per Path (default = 4).')
+parser.add_argument('--workers', type = int, default = 1, help = 'Number of scene import workers (default = 1).')
+parser.add_argument('--vrtworkers', type = int, default = os.cpu_count(), help = 'Number of VRTs built in parallel (default = number of CPU cores).')
+parser.add_argument('--usegdal', action = 'store_true', help = 'Build VRTs with gdal.BuildVRT rather than from ENVI headers.')
+parser.add_argument('--repeats', type = int, default = 3, help = 'Number of timed repeats (default = 3).')
+parser.add_argument('-o', '--output', type = str, default = None, help = 'CSV report file, to which results are appended.')
+parser.add_argument('--tempdir', type = str, default = None, help = 'Directory for temporary files.')
+args = parser.parse_args()
+
+results = []
+
+def record(name, items, func, describe, setup = None):
+    return benchutil.record(results, name, items, func, describe, args.repeats, setup = setup)
+
+commit = benchutil.gitcommit()
+rundate = datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+tempdir = tempfile.mkdtemp(dir = args.tempdir)
+try:
+    # The tools read library directories from ieo when imported, so these are set first
+    ieostub.setlibrary(tempdir)
+    import synthespa, newespaimport, makevrts
+    from ingestledger import IngestLedger
+    from vrtcatalog import VRTCatalog
+
+    starttime = time.time()
+    rng = np.random.default_rng(0)
+    numplan = min(args.planarchives, args.scenes)
+    scenes = synthespa.makescenes(args.scenes + args.archives, paths = args.paths, rows = args.rows)
+    libraryscenes, newscenes = scenes[:args.scenes], scenes[args.scenes:]
+    print('Creating synthetic library of {} scenes in: {}'.format(len(libraryscenes), tempdir))
+    synthespa.makelibrary(ieostub.librarydirs(), libraryscenes, args.xsize, args.ysize, ieostub.projacronym, projection = ieostub.projection())
+    plandir = os.path.join(tempdir, 'Plan')
+    os.makedirs(plandir)
+    print('Creating {} previously ingested and {} new ESPA archives.'.format(numplan, len(newscenes)))
+    for scene in libraryscenes[:numplan]: # Small archives, as they are only listed and checked against the ledger
+        synthespa.makearchive(plandir, scene, 16, 16, rng)
+    for scene in newscenes:
+        synthespa.makearchive(ieostub.ingestdir, scene, args.xsize, args.ysize, rng)
+    synthespa.makeshapefiles(scenes, ieostub.landsatshp, ieostub.WRS2, args.xsize, args.ysize, ieostub.prj, srdir = ieostub.srdir, projacronym = ieostub.projacronym)
+    planledger = os.path.join(tempdir, 'plan_ledger.sqlite')
+    ledger = IngestLedger(planledger)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for f in sorted(glob.glob(os.path.join(plandir, '*.tar.gz'))):
+            ledger.registerarchive(f, newespaimport.sceneidfromfilename(f))
+            ledger.finisharchive(f, 'complete')
+    ledger.close()
+    print('Synthetic data created in {:0.1f} s.'.format(time.time() - starttime))
+
+    # Archives are left in the ingest directories, so that every repeat sees the same archives
+    noarchive = os.path.join(tempdir, 'NoArchive')
+    scratchdir = os.path.join(tempdir, 'Scratch')
+    planargs = newespaimport.getparser().parse_args(['--indir', plandir, '--ledger', planledger, '--archdir', noarchive, '--scratchdir', scratchdir])
+    record('Ingest planning (cold)', numplan, lambda: newespaimport.run(planargs), lambda x: '{} archives checked, {} ingested'.format(numplan, len(x)), setup = newespaimport.shapefilecache.clear)
+    record('Ingest planning (warm)', numplan, lambda: newespaimport.run(planargs), lambda x: '{} archives checked, {} ingested'.format(numplan, len(x)))
+
+    importledger = os.path.join(tempdir, 'import_ledger.sqlite')
+    importargs = newespaimport.getparser().parse_args(['--ledger', importledger, '--archdir', noarchive, '--scratchdir', scratchdir, '--workers', str(args.workers)])
+    importargs.remove = True
+
+    def resetimport():
+        # Removes the ledger and the products of the new scenes
+        if os.path.isfile(importledger):
+            os.remove(importledger)
+        for scene in newscenes:
+            for d in ieostub.librarydirs().values():
+                for f in glob.glob(os.path.join(d, '{}*'.format(scene['sceneid'][:16]))):
+                    os.remove(f)
+
+    record('Per-scene import', len(newscenes), lambda: newespaimport.run(importargs), lambda x: '{} of {} scenes ingested'.format(len(x), len(newscenes)), setup = resetimport)
+    resetimport()
+
+    catalogfile = os.path.join(ieostub.catdir, 'Landsat', 'vrt_catalog.sqlite')
+    vrtoptions = ['--nocsv', '--catalog', catalogfile, '--workers', str(max(args.vrtworkers or 1, 1))]
+    if args.usegdal:
+        vrtoptions.append('--usegdal')
+    vrtargs = makevrts.getparser().parse_args(vrtoptions)
+    incrementalargs = makevrts.getparser().parse_args(vrtoptions + ['--incremental'])
+    indirs = makevrts.getindirs()[0]
+
+    def resetvrts():
+        for indir in indirs:
+            shutil.rmtree(os.path.join(indir, 'vrt'), ignore_errors = True)
+        if os.path.isfile(catalogfile):
+            os.remove(catalogfile)
+
+    record('VRT generation', len(libraryscenes), lambda: makevrts.run(vrtargs), lambda x: '{} VRTs built'.format(len(x)), setup = resetvrts)
+    record('VRT generation (incremental)', len(libraryscenes), lambda: makevrts.run(incrementalargs), lambda x: '{} VRTs built'.format(len(x)))
+
+    # Catalog entries of every VRT, as written by makevrts.run()
+    entries = []
+    for indir in indirs:
+        filedict = makevrts.makefiledict(indir, None) or {}
+        for key in sorted(filedict.keys()):
+            if len(filedict[key]) > 1:
+                filedict[key].sort()
+                entries.append([os.path.basename(indir), makevrts.makevrtfilename(os.path.join(indir, 'vrt'), filedict[key]), filedict[key], key])
+    upsertfile = os.path.join(tempdir, 'upsert_catalog.sqlite')
+
+    def upsertcatalog():
+        catalog = VRTCatalog(upsertfile)
+        for product, vrt, filelist, key in entries:
+            makevrts.writetocatalog(catalog, product, vrt, filelist, key)
+        catalog.close()
+        return entries
+
+    def removeupsert():
+        if os.path.isfile(upsertfile):
+            os.remove(upsertfile)
+
+    record('Catalog update', len(entries), upsertcatalog, lambda x: '{} entries'.format(len(x)), setup = removeupsert)
+
+    catalog = VRTCatalog(catalogfile)
+    rows = makevrts.loadpathrows()['rows']
+
+    def exportcatalog():
+        lines = 0
+        for product in catalog.products():
+            catfile = os.path.join(ieostub.catdir, 'Landsat', '{}_vrt.csv'.format(product))
+            catalog.exportcsv(product, catfile, rows)
+            with open(catfile, 'r') as f:
+                lines += sum(1 for line in f) - 1
+        return lines
+
+    record('Catalog CSV export', len(entries), exportcatalog, lambda x: '{} lines written'.format(x))
+    catalog.close()
+finally:
+    shutil.rmtree(tempdir, ignore_errors = True)
+
+if len(ieostub.errors) > 0:
+    print('\n{} errors were logged, including:'.format(len(ieostub.errors)))
+    for f, message in ieostub.errors[:5]:
+        print('{}: {}'.format(f, message))
+
+header = 'Commit,Date,Benchmark,Items,Seconds,SecondsPerItem,Result'
+lines = []
+for name, items, seconds, result in results:
+    lines.append('{},{},{},{},{:0.3f},{:0.5f},{}'.format(commit, rundate, name, items, seconds, seconds / max(items, 1), result))
+benchutil.writereport(header, lines, args.output)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script benchmarks processing list creation by MakeESPAproclist.py against synthetic
+# catalogs of increasing size. For each catalog size, a WRS-2 shapefile and a Landsat scene
+# shapefile are created, with Landsat 5, 7, and 8 acquisitions every 16 days over as many Path/Rows
+# as are needed, and with cloud cover, sun elevation, and processing level distributions similar to
+# those of Irish scenes. A fraction of the scenes are given empty local SR files, and another fraction
+# are marked as pending orders. readfeatures(), getscenedata(), scenesearch(), populatelists(), and
+# findmissing() are timed separately, with --allinpath on and off. Results are reported as CSV with
+# the current git commit, and may be appended to a report file to compare commits. The IEO module
+# is replaced by ieostub.py, whose library directories and WRS-2 and scene shapefiles are set to
+# the synthetic ones of each catalog, so that it does not need to be installed.
+
+import os, sys, argparse, tempfile, shutil, time, datetime, math, random, contextlib
+from osgeo import ogr, osr
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchdir))
+sys.path.insert(0, benchdir)
+import ieostub, benchutil
+ieostub.install()
+import MakeESPAproclist
+
+parser = argparse.ArgumentParser('This script benchmarks ESPA processing list creation with synthetic scene catalogs.')
+parser.add_argument('--scenes', type = str, default = '1000,10000,100000,500000', help = 'Comma-delimited catalog sizes in scenes (default = 1000,10000,100000,500000).')
+parser.add_argument('--localfrac', type = float, default = 0.3, help = 'Fraction of scenes with local SR data (default = 0.3).')
+parser.add_argument('--pendingfrac', type = float, default = 0.05, help = 'Fraction of scenes without local SR data that are pending orders (default = 0.05).')
+parser.add_argument('--searchsample', type = int, default = 1000, help = 'Number of local scenes for which scenesearch() is timed (default = 1000).')
+parser.add_argument('--repeats', type = int, default = 3, help = 'Number of timed repeats (default = 3).')
+parser.add_argument('--maxseconds', type = float, default = 300.0, help = 'A function is not repeated once a run takes longer than this, and is skipped for larger catalogs if it would take longer than this even with linear scaling (default = 300).')
+parser.add_argument('-o', '--output', type = str, default = None, help = 'CSV report file, to which results are appended.')
+parser.add_argument('--tempdir', type = str, default = None, help = 'Directory for temporary files.')
+args = parser.parse_args()
+
+# Landsat prefix, USGS SensorID, Collection 1 prefix, and first and last acquisition dates
+sensors = [['LT5', 'TM', 'LT05', datetime.datetime(1984, 3, 16), datetime.datetime(2011, 11, 18)],
+           ['LE7', 'ETM', 'LE07', datetime.datetime(1999, 5, 28), datetime.datetime(2020, 12, 31)],
+           ['LC8', 'OLI_TIRS', 'LC08', datetime.datetime(2013, 4, 11), datetime.datetime(2020, 12, 31)]]
+
+def acquisitions():
+    # Sensors and acquisition day offsets of a single Path/Row
+    acqs = []
+    for sensor in sensors:
+        d = sensor[3]
+        while d <= sensor[4]:
+            acqs.append([sensor, (d - sensors[0][3]).days])
+            d += datetime.timedelta(days = 16)
+    return acqs
+
+def footprint(path, row):
+    # Approximate WRS-2 scene footprint over Ireland, in geographic coordinates
+    lon = -8.0 - (path - 206) * 1.6 + (row - 23) * 0.25
+    lat = 53.0 - (row - 23) * 1.45
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [[-1.4, 0.85], [1.4, 0.85], [1.4, -0.85], [-1.4, -0.85], [-1.4, 0.85]]:
+        ring.AddPoint(lon + x, lat + y)
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    return poly
+
+def makescenes(numscenes, srdir, rng):
+    # Returns the Path/Rows and attribute dicts of numscenes synthetic scenes, and the set of pending
+    # scene IDs. Empty local SR files are created in srdir.
+    acqs = acquisitions()
+    numpathrows = max(1, int(math.ceil(numscenes / float(len(acqs)))))
+    numrows = min(numpathrows, 8)
+    pathrows = [[201 + i // numrows, 21 + i % numrows] for i in range(numpathrows)]
+    scenes = []
+    pending = set()
+    for path, row in pathrows:
+        lat = 53.0 - (row - 23) * 1.45
+        for sensor, days in acqs:
+            if len(scenes) >= numscenes:
+                break
+            acqdate = sensors[0][3] + datetime.timedelta(days = days + (path * 7) % 16)
+            if acqdate > sensor[4]:
+                continue
+            doy = int(acqdate.strftime('%j'))
+            sceneID = '{}{:03d}{:03d}{}LGN00'.format(sensor[0], path, row, acqdate.strftime('%Y%j'))
+            cc = round(100.0 * rng.betavariate(0.7, 0.5), 2)
+            ccland = round(min(max(cc + rng.gauss(0.0, 10.0), 0.0), 100.0), 2)
+            declination = 23.44 * math.sin(2.0 * math.pi * (doy - 81) / 365.0)
+            sunEl = round(90.0 - lat + declination - 8.0 + rng.gauss(0.0, 1.0), 2)
+            r = rng.random()
+            if cc < 60.0:
+                proclevel = 'L1TP' if r < 0.92 else ('L1GT' if r < 0.97 else 'L1GS')
+            else:
+                proclevel = 'L1TP' if r < 0.6 else ('L1GT' if r < 0.85 else 'L1GS')
+            SensorID = sensor[1]
+            if sensor[0] == 'LC8' and rng.random() < 0.01:
+                SensorID = 'OLI'
+            processed = acqdate + datetime.timedelta(days = rng.randint(10, 60))
+            scene = {'sceneID': sceneID,
+                     'LandsatPID': '{}_{}_{:03d}{:03d}_{}_{}_01_{}'.format(sensor[2], proclevel, path, row, acqdate.strftime('%Y%m%d'), processed.strftime('%Y%m%d'), 'T1' if proclevel == 'L1TP' else 'T2'),
+                     'sunEl': sunEl,
+                     'SensorID': SensorID,
+                     'acqDate': acqdate.strftime('%Y/%m/%d'),
+                     'DT_L1': proclevel,
+                     'path': path,
+                     'row': row,
+                     'CCFull': cc,
+                     'CCLand': ccland,
+                     'SR_path': None,
+                     'ClearFrac': None}
+            if rng.random() < args.localfrac:
+                scene['SR_path'] = os.path.join(srdir, '{}_ref_{}.dat'.format(sceneID, ieostub.projacronym))
+                scene['ClearFrac'] = round(min(max(100.0 - ccland - rng.gauss(5.0, 5.0), 0.0), 100.0), 2)
+                open(scene['SR_path'], 'w').close()
+            elif rng.random() < args.pendingfrac:
+                pending.add(sceneID[:16])
+            scenes.append(scene)
+    return pathrows, scenes, pending
+
+def writeshapefiles(pathrows, scenes, wrs2file, shpfile):
+    # Writes the WRS-2 and scene shapefiles, with the fields read by MakeESPAproclist.py
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds = driver.CreateDataSource(wrs2file)
+    layer = ds.CreateLayer('WRS2', srs, ogr.wkbPolygon)
+    for name in ['Path', 'Row']:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTInteger))
+    for path, row in pathrows:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('Path', path)
+        feature.SetField('Row', row)
+        feature.SetGeometry(footprint(path, row))
+        layer.CreateFeature(feature)
+        feature = None
+    ds = None
+    ds = driver.CreateDataSource(shpfile)
+    layer = ds.CreateLayer('WRS2_Landsat', srs, ogr.wkbPolygon)
+    for name, fieldtype, width in [['sceneID', ogr.OFTString, 21], ['LandsatPID', ogr.OFTString, 40], ['sunEl', ogr.OFTReal, 0], ['SensorID', ogr.OFTString, 16],
+                                   ['acqDate', ogr.OFTString, 10], ['DT_L1', ogr.OFTString, 4], ['path', ogr.OFTInteger, 0], ['row', ogr.OFTInteger, 0],
+                                   ['CCFull', ogr.OFTReal, 0], ['CCLand', ogr.OFTReal, 0], ['SR_path', ogr.OFTString, 254], ['ClearFrac', ogr.OFTReal, 0]]:
+        field = ogr.FieldDefn(name, fieldtype)
+        if width > 0:
+            field.SetWidth(width)
+        layer.CreateField(field)
+    geoms = {}
+    for scene in scenes:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        for key in scene.keys():
+            if scene[key] is not None:
+                feature.SetField(key, scene[key])
+        pathrow = (scene['path'], scene['row'])
+        if not pathrow in geoms.keys():
+            geoms[pathrow] = footprint(scene['path'], scene['row'])
+        feature.SetGeometry(geoms[pathrow])
+        layer.CreateFeature(feature)
+        feature = None
+    ds = None
+
+def listcount(l8, l47):
+    return sum(len(x) for x in l8.values()) + sum(len(x) for x in l47.values())
+
+commit = benchutil.gitcommit()
+rundate = datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+sizes = sorted(int(x) for x in args.scenes.split(','))
+results = []
+lasttimes = {} # Function and --allinpath: [catalog size, seconds], for skipping slow functions
+
+def record(numscenes, name, allinpath, calls, func, setup = None):
+    key = (name, allinpath)
+    if key in lasttimes.keys() and lasttimes[key][1] * numscenes / float(lasttimes[key][0]) > args.maxseconds:
+        print('{} (allinpath = {}): skipped.'.format(name, allinpath))
+        results.append([numscenes, name, allinpath, calls, None, None])
+        return None
+    seconds, result = benchutil.timeit(func, args.repeats, setup = setup, maxseconds = args.maxseconds)
+    lasttimes[key] = [numscenes, seconds]
+    results.append([numscenes, name, allinpath, calls, seconds, result])
+    print('{} (allinpath = {}): {:0.3f} s'.format(name, allinpath, seconds))
+    return result
+
+for numscenes in sizes:
+    tempdir = tempfile.mkdtemp(dir = args.tempdir)
+    try:
+        ieostub.setlibrary(tempdir)
+        srdir = ieostub.srdir
+        wrs2file = ieostub.WRS2
+        shpfile = ieostub.landsatshp
+        print('\nCreating synthetic catalog of {} scenes: {}'.format(numscenes, shpfile))
+        starttime = time.time()
+        pathrows, scenes, pending = makescenes(numscenes, srdir, random.Random(0))
+        writeshapefiles(pathrows, scenes, wrs2file, shpfile)
+        print('{} Path/Rows, {} local scenes, {} pending scenes created in {:0.1f} s.'.format(len(pathrows), len(os.listdir(srdir)), len(pending), time.time() - starttime))
+        scenes = None
+
+        # Arguments and module state as set by MakeESPAproclist.run()
+        procargs = MakeESPAproclist.getparser().parse_args(['--shp', shpfile, '--srdir', srdir, '--outdir', tempdir])
+        procargs.startdate = datetime.datetime.strptime(procargs.startdate, '%Y/%m/%d')
+        procargs.enddate = datetime.datetime(2021, 1, 1)
+        MakeESPAproclist.args = procargs
+        MakeESPAproclist.aoiscenes = None
+        MakeESPAproclist.pendingscenes = pending
+        MakeESPAproclist.proclevels = ['L1TP']
+        MakeESPAproclist.pathrowdict.clear()
+        MakeESPAproclist.loadpathrows()
+        localscenelist = set(os.path.basename(x)[:16] for x in os.listdir(srdir))
+
+        features = record(numscenes, 'readfeatures', '', numscenes, lambda: MakeESPAproclist.readfeatures(shpfile), setup = MakeESPAproclist.shapefilecache.clear)
+        if features is None:
+            features = MakeESPAproclist.readfeatures(shpfile)
+        scenedata = record(numscenes, 'getscenedata', '', len(features), lambda: MakeESPAproclist.getscenedata(features, set(localscenelist))[0])
+        if scenedata is None:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                scenedata = MakeESPAproclist.getscenedata(features, set(localscenelist))[0]
+        features = None
+        sample = [x for x in sorted(scenedata.keys()) if scenedata[x]['SR_path']][:max(args.searchsample, 0)]
+        record(numscenes, 'scenesearch', '', len(sample), lambda: sum(len(MakeESPAproclist.scenesearch(scenedata, x, MakeESPAproclist.pathrowdict)) for x in sample))
+        for allinpath in [False, True]:
+            procargs.allinpath = allinpath
+            lists = record(numscenes, 'populatelists', allinpath, len(scenedata), lambda: MakeESPAproclist.populatelists({}, {}, scenedata, localscenelist))
+            if allinpath:
+                if lists is None:
+                    print('findmissing (allinpath = True): skipped.')
+                    results.append([numscenes, 'findmissing', allinpath, len(scenedata), None, None])
+                else:
+                    record(numscenes, 'findmissing', allinpath, len(scenedata), lambda: MakeESPAproclist.findmissing({x: list(y) for x, y in lists[0].items()}, {x: list(y) for x, y in lists[1].items()}, scenedata, localscenelist))
+    finally:
+        shutil.rmtree(tempdir, ignore_errors = True)
+
+header = 'Commit,Date,Scenes,Function,AllInPath,Calls,Seconds,Result'
+lines = []
+for numscenes, name, allinpath, calls, seconds, result in results:
+    if seconds is None:
+        secondsstr, resultstr = '', 'skipped'
+    else:
+        secondsstr = '{:0.3f}'.format(seconds)
+        if isinstance(result, tuple): # Processing lists
+            resultstr = '{} scenes listed'.format(listcount(result[0], result[1]))
+        elif isinstance(result, int): # Neighbouring scenes found
+            resultstr = '{} scenes found'.format(result)
+        else:
+            resultstr = '{} scenes'.format(len(result))
+    lines.append('{},{},{},{},{},{},{},{}'.format(commit, rundate, numscenes, name, allinpath, calls, secondsstr, resultstr))
+benchutil.writereport(header, lines, args.output)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script benchmarks decoding of a synthetic full scene pixel QA layer with the lookup tables in
+# qadecode.py against bitwise decoding with NumPy. The layer is written as a flat binary file, as
+# ingested ENVI products are, and read as a numpy.memmap. It does not require the IEO module.
+
+import os, sys, argparse, tempfile, shutil, time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import qadecode
+
+parser = argparse.ArgumentParser('This script benchmarks lookup table decoding of pixel QA layers.')
+parser.add_argument('--xsize', type = int, default = 7900, help = 'Scene width in pixels (default = 7900).')
+parser.add_argument('--ysize', type = int, default = 7000, help = 'Scene height in pixels (default = 7000).')
+parser.add_argument('--landsat', type = int, default = 8, help = 'Landsat number of the pixel QA encoding (default = 8).')
+parser.add_argument('--repeats', type = int, default = 5, help = 'Number of timed repeats (default = 5).')
+parser.add_argument('--tempdir', type = str, default = None, help = 'Directory for temporary files.')
+args = parser.parse_args()
+
+def bitwiseclasses(mask, landsat):
+    # Bitwise decoding, as the QA consumers did before qadecode.py
+    out = np.full(mask.shape, qadecode.unclassified, dtype = np.uint8)
+    out[(mask & 2) > 0] = qadecode.clear
+    out[(mask & 4) > 0] = qadecode.water
+    out[(mask & 16) > 0] = qadecode.snow
+    out[(mask & 8) > 0] = qadecode.shadow
+    out[(mask & 32) > 0] = qadecode.cloud
+    out[(mask & 1) > 0] = qadecode.fill
+    if landsat == 8:
+        out[(mask & 1024) > 0] = qadecode.fill
+    return out
+
+def bitwiseclear(mask, landsat):
+    clear = ((mask & 2) > 0) & ((mask & 4) == 0) & ((mask & 1) == 0) & ((mask & 56) == 0)
+    if landsat == 8:
+        clear &= (mask & 1024) == 0
+    return clear
+
+def timeit(func, repeats):
+    times = []
+    for i in range(repeats):
+        starttime = time.time()
+        result = func()
+        times.append(time.time() - starttime)
+    return min(times), result
+
+tempdir = tempfile.mkdtemp(dir = args.tempdir)
+try:
+    # Typical pixel QA values: fill, clear land, water, shadow, snow, cloud, with confidence bits
+    if args.landsat == 8:
+        values = [1, 322, 324, 328, 336, 352, 386, 480, 834, 836, 898, 900, 904, 928, 992, 1346]
+    else:
+        values = [1, 66, 68, 72, 80, 96, 112, 130, 132, 136, 144, 160, 176, 224]
+    qafile = os.path.join(tempdir, 'synthetic_pixel_qa.dat')
+    print('Creating {} x {} synthetic pixel QA layer: {}'.format(args.xsize, args.ysize, qafile))
+    rng = np.random.default_rng(0)
+    rng.choice(np.array(values, dtype = np.uint16), size = (args.ysize, args.xsize)).tofile(qafile)
+    mask = np.memmap(qafile, dtype = np.uint16, mode = 'r', shape = (args.ysize, args.xsize))
+
+    starttime = time.time()
+    qadecode.table('pixel_qa', args.landsat)
+    qadecode.cleartable('pixel_qa', args.landsat)
+    print('Lookup tables built in {:0.3f} s.'.format(time.time() - starttime))
+
+    results = []
+    for name, func in [['Bitwise classes', lambda: bitwiseclasses(mask, args.landsat)],
+                       ['Lookup table classes', lambda: qadecode.decode(mask, 'pixel_qa', args.landsat)],
+                       ['Bitwise clear land', lambda: bitwiseclear(mask, args.landsat)],
+                       ['Lookup table clear land', lambda: qadecode.clearland(mask, 'pixel_qa', args.landsat)]]:
+        seconds, result = timeit(func, max(args.repeats, 1))
+        results.append([name, seconds, result])
+        print('{}: {:0.3f} s'.format(name, seconds))
+
+    if not np.array_equal(results[0][2], results[1][2]) or not np.array_equal(results[2][2], results[3][2]):
+        print('Error: lookup table and bitwise decoding results differ.')
+    print('\nMethod,Seconds,Speedup')
+    for i, [name, seconds, result] in enumerate(results):
+        print('{},{:0.3f},{:0.2f}'.format(name, seconds, results[i - i % 2][1] / seconds))
+    mask = None
+finally:
+    shutil.rmtree(tempdir, ignore_errors = True)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module holds the timing and reporting functions shared by the benchmarks: the current git
+# commit, minimum-of-repeats timing with the output of the timed function discarded, and CSV
+# reports that are printed and may be appended to a report file to compare commits.
+
+import os, time, contextlib, subprocess
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def gitcommit():
+    # Short hash of the current commit, with a + if the working tree has been modified
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = repodir, stderr = subprocess.DEVNULL).decode().strip()
+        if subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = repodir, stderr = subprocess.DEVNULL).strip():
+            commit += '+'
+        return commit
+    except Exception:
+        return 'unknown'
+
+def timeit(func, repeats, setup = None, maxseconds = None):
+    # Minimum time of repeats, with the output of the timed function discarded. A function taking
+    # longer than maxseconds isn't repeated.
+    times = []
+    for i in range(max(repeats, 1)):
+        if setup:
+            setup()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            starttime = time.time()
+            result = func()
+            times.append(time.time() - starttime)
+        if maxseconds is not None and times[-1] > maxseconds:
+            break
+    return min(times), result
+
+def record(results, name, items, func, describe, repeats, setup = None):
+    # Times func, and appends [name, items, seconds, description of the result] to results
+    seconds, result = timeit(func, repeats, setup = setup)
+    results.append([name, items, seconds, describe(result)])
+    print('{}: {:0.3f} s'.format(name, seconds))
+    return result
+
+def writereport(header, lines, output = None):
+    # Prints CSV lines, and appends them to the file output if set, with the header if it is new
+    print('\n{}'.format(header))
+    for line in lines:
+        print(line)
+    if output:
+        newfile = not os.path.isfile(output)
+        with open(output, 'a') as f:
+            if newfile:
+                f.write('{}\n'.format(header))
+            for line in lines:
+                f.write('{}\n'.format(line))
+        print('Results appended to: {}'.format(output))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script benchmarks reprojection of a synthetic Landsat-sized UTM scene to the local projection
+# with increasing numbers of warp threads. Each run uses the GDAL configuration and warp options
+# set by newespaimport.configurewarp() for --warpthreads, --warpmem, and --gdalcache, with unset
+# values filled in by newespaimport.warpdefaults() as in an ingest with the given --workers. The
+# IEO module is replaced by ieostub.py, so that it does not need to be installed.
+
+import os, sys, argparse, tempfile, shutil, time
+import numpy as np
+from osgeo import gdal, osr
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchdir))
+sys.path.insert(0, benchdir)
+import ieostub
+ieostub.install()
+import newespaimport
+
+parser = argparse.ArgumentParser('This script benchmarks multithreaded warping of a synthetic Landsat scene.')
+parser.add_argument('--xsize', type = int, default = 7900, help = 'Scene width in pixels (default = 7900).')
+parser.add_argument('--ysize', type = int, default = 7000, help = 'Scene height in pixels (default = 7000).')
+parser.add_argument('--bands', type = int, default = 7, help = 'Number of bands (default = 7, as for a Landsat 8 SR stack).')
+parser.add_argument('--srcepsg', type = int, default = 32629, help = 'Source EPSG code (default = 32629, UTM zone 29N).')
+parser.add_argument('--dstepsg', type = int, default = 2157, help = 'Destination EPSG code (default = 2157, Irish Transverse Mercator).')
+parser.add_argument('--threads', type = str, default = None, help = 'Comma-delimited list of thread counts (default = powers of two up to the number of CPU cores).')
+parser.add_argument('--workers', type = int, default = 1, help = 'Number of ingest import workers, from which unset warp memory and cache sizes are derived (default = 1).')
+parser.add_argument('--warpmem', type = int, default = None, help = 'Warp memory limit in MB (default = as set by newespaimport.py).')
+parser.add_argument('--gdalcache', type = int, default = None, help = 'GDAL block cache size in MB (default = as set by newespaimport.py).')
+parser.add_argument('--resampling', type = str, default = 'near', help = 'Resampling method (default = near).')
+parser.add_argument('--tempdir', type = str, default = None, help = 'Directory for temporary files.')
+args = parser.parse_args()
+
+if args.threads:
+    threadcounts = [int(x) for x in args.threads.split(',')]
+else:
+    threadcounts = [1]
+    while threadcounts[-1] * 2 <= (os.cpu_count() or 1):
+        threadcounts.append(threadcounts[-1] * 2)
+
+def ingestsettings(threads):
+    # Warp settings of an ingest run with --warpthreads threads and the benchmark's other options
+    importoptions = ['--workers', str(args.workers), '--warpthreads', str(threads)]
+    if args.warpmem:
+        importoptions += ['--warpmem', str(args.warpmem)]
+    if args.gdalcache:
+        importoptions += ['--gdalcache', str(args.gdalcache)]
+    return newespaimport.warpdefaults(newespaimport.getparser().parse_args(importoptions))
+
+tempdir = tempfile.mkdtemp(dir = args.tempdir)
+
+try:
+    # Create a synthetic SR stack in ENVI format, located over Ireland in UTM zone 29N
+    src = os.path.join(tempdir, 'synthetic_sr.dat')
+    print('Creating {} x {} x {} synthetic scene: {}'.format(args.xsize, args.ysize, args.bands, src))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(args.srcepsg)
+    ds = gdal.GetDriverByName('ENVI').Create(src, args.xsize, args.ysize, args.bands, gdal.GDT_Int16)
+    ds.SetGeoTransform([450000.0, 30.0, 0.0, 6000000.0, 0.0, -30.0])
+    ds.SetProjection(srs.ExportToWkt())
+    rng = np.random.default_rng(0)
+    for b in range(1, args.bands + 1):
+        band = ds.GetRasterBand(b)
+        band.SetNoDataValue(-9999)
+        band.WriteArray(rng.integers(0, 10000, size = (args.ysize, args.xsize), dtype = np.int16))
+    ds = None
+
+    results = []
+    for threads in threadcounts:
+        settings = ingestsettings(threads)
+        warpoptions = newespaimport.configurewarp(settings.warpthreads, settings.warpmem, settings.gdalcache)
+        dst = os.path.join(tempdir, 'warped_{}.dat'.format(threads))
+        starttime = time.time()
+        gdal.Warp(dst, src, format = 'ENVI', dstSRS = 'EPSG:{}'.format(args.dstepsg), xRes = 30, yRes = 30, resampleAlg = args.resampling, **warpoptions)
+        seconds = time.time() - starttime
+        results.append([threads, settings.warpmem, settings.gdalcache, seconds])
+        print('{} threads, {} MB warp memory, {} MB GDAL cache: {:0.2f} s'.format(threads, settings.warpmem, settings.gdalcache, seconds))
+        gdal.GetDriverByName('ENVI').Delete(dst)
+
+    print('\nThreads,WarpMemoryMB,GDALCacheMB,Seconds,Speedup')
+    for threads, warpmem, gdalcache, seconds in results:
+        print('{},{},{},{:0.2f},{:0.2f}'.format(threads, warpmem, gdalcache, seconds, results[0][3] / seconds))
+finally:
+    shutil.rmtree(tempdir, ignore_errors = True)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module stands in for the IEO module in the benchmarks, so that they run without an IEO
+# installation and never write to a real library. install() registers it as ieo before the tools
+# are imported, and setlibrary() points the library directories and catalog files to a synthetic
+# library. importespa() stacks the SR and BT bands of an extracted ESPA scene into ingested
+# products without reprojecting them, copies the pixel QA layer, and calculates NDVI and EVI with
+# vegindex.py, so that the file I/O of an ingest is still measured. Errors are kept in a list.
+
+import os, sys, glob, shutil, tempfile, datetime
+from ingestledger import extractarchive
+
+projacronym = 'ITM'
+errorfile = None
+errors = []
+
+try:
+    from osgeo import osr
+    prj = osr.SpatialReference()
+    prj.ImportFromEPSG(2157) # Irish Transverse Mercator
+except ImportError:
+    prj = None
+
+def setlibrary(basedir, create = True):
+    # Sets the library directories and catalog files to those of a library in basedir
+    global srdir, btdir, fmaskdir, pixelqadir, ndvidir, evidir, ingestdir, archdir, catdir, landsatshp, WRS2, NTS
+    srdir = os.path.join(basedir, 'SR')
+    btdir = os.path.join(basedir, 'BT')
+    fmaskdir = os.path.join(basedir, 'Fmask')
+    pixelqadir = os.path.join(basedir, 'PixelQA')
+    ndvidir = os.path.join(basedir, 'NDVI')
+    evidir = os.path.join(basedir, 'EVI')
+    ingestdir = os.path.join(basedir, 'Ingest')
+    archdir = os.path.join(basedir, 'Archive')
+    catdir = os.path.join(basedir, 'Catalog')
+    landsatshp = os.path.join(catdir, 'WRS2_Landsat.shp')
+    WRS2 = os.path.join(catdir, 'WRS2_descending.shp')
+    NTS = os.path.join(catdir, 'AOI.shp')
+    if create:
+        for d in [srdir, btdir, fmaskdir, pixelqadir, ndvidir, evidir, ingestdir, archdir, os.path.join(catdir, 'Landsat')]:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+setlibrary(os.path.join(tempfile.gettempdir(), 'ieostub'), create = False)
+
+def librarydirs():
+    # Returns a dict of product: directory, as used by synthespa.makelibrary()
+    return {'ref': srdir, 'BT': btdir, 'pixel_qa': pixelqadir, 'NDVI': ndvidir, 'EVI': evidir}
+
+def projection():
+    if prj:
+        return prj.ExportToWkt()
+    return None
+
+def install():
+    # Makes this module the one imported as ieo
+    sys.modules['ieo'] = sys.modules[__name__]
+
+def logerror(f, message):
+    errors.append([f, str(message)])
+
+def stack(infiles, outfile, bandnames):
+    # Concatenates single band BSQ rasters into one, and returns the header of the first
+    import enviheader, synthespa
+    header = enviheader.readheader(infiles[0])
+    with open(outfile, 'wb') as output:
+        for f in infiles:
+            with open(f, 'rb') as data:
+                shutil.copyfileobj(data, output, 2 ** 20)
+    xsize, ysize, bands = enviheader.rastersize(header)
+    synthespa.writeheader(outfile, xsize, ysize, len(infiles), enviheader.envidatatypes[int(header['data type'])][1], enviheader.geotransform(header), mapname = 'Transverse Mercator',
+                          projection = projection(), nodata = enviheader.nodatavalue(header), bandnames = bandnames)
+    return header
+
+def importespa(f, remove = False, overwrite = False, warpoptions = None):
+    # Ingests one ESPA scene from an archive or from its extracted *_sr_band7.img file. Products
+    # are not reprojected, so warpoptions are accepted but not used.
+    import synthespa, vegindex
+    scratch = None
+    if f.endswith('.tar.gz'):
+        scratch = tempfile.mkdtemp(dir = os.path.dirname(f))
+        try:
+            extractarchive(f, scratch)
+        except:
+            shutil.rmtree(scratch, ignore_errors = True)
+            raise
+        flist = glob.glob(os.path.join(scratch, '*_sr_band7.img'))
+        if len(flist) == 0:
+            shutil.rmtree(scratch, ignore_errors = True)
+            raise IOError('No SR data found in: {}'.format(f))
+        f = flist[0]
+    try:
+        dirname = os.path.dirname(f)
+        productid = os.path.basename(f)[:40]
+        landsat = int(productid[3:4])
+        sceneid = synthespa.makescene(landsat, int(productid[10:13]), int(productid[13:16]), datetime.datetime.strptime(productid[17:25], '%Y%m%d'))['sceneid']
+        srfile = os.path.join(srdir, '{}_ref_{}.dat'.format(sceneid, projacronym))
+        if os.path.isfile(srfile) and not overwrite:
+            print('SR data for scene {} exist, skipping.'.format(sceneid))
+            return
+        print('Importing scene {}.'.format(sceneid))
+        stack([os.path.join(dirname, '{}_sr_band{}.img'.format(productid, band)) for band in synthespa.srbands[landsat]], srfile, ['Band {}'.format(band) for band in synthespa.srbands[landsat]])
+        stack([os.path.join(dirname, '{}_bt_band{}.img'.format(productid, band)) for band in synthespa.btbands[landsat]], os.path.join(btdir, '{}_BT_{}.dat'.format(sceneid, projacronym)), ['Band {}'.format(band) for band in synthespa.btbands[landsat]])
+        qafile = os.path.join(pixelqadir, '{}_pixel_qa.dat'.format(sceneid))
+        stack([os.path.join(dirname, '{}_pixel_qa.img'.format(productid))], qafile, ['pixel_qa'])
+        vegindex.calcindices(srfile, qafile, os.path.join(ndvidir, '{}_NDVI.dat'.format(sceneid)), os.path.join(evidir, '{}_EVI.dat'.format(sceneid)), overwrite = True)
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors = True)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module creates small synthetic ESPA-processed Landsat archives, ingested library products,
+# and scene and WRS-2 shapefiles for the benchmarks. File names follow the ESPA and IEO conventions
+# exactly, as the tools parse scene IDs, Paths, Rows, and dates from fixed character positions:
+# archives are named e.g. LC082070232017010101T1-SC20170115000000.tar.gz and contain
+# <product ID>_sr_band<n>.img ENVI files, and ingested products are named by the 21 character scene
+# ID, e.g. LC82070232017001LGN00_ref_ITM.dat. Each date holds the Rows of a single Path, so that
+# makevrts.py creates one mosaic per date. Run as a script, it writes a synthetic library in the
+# layout of ieostub.py to a directory.
+
+import os, sys, argparse, datetime, tarfile, shutil, tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import enviheader
+from orderledger import sceneidfromproductid
+
+# SR and BT band numbers in ESPA archives, and typical pixel QA values, by Landsat number
+srbands = {8: [1, 2, 3, 4, 5, 6, 7], 7: [1, 2, 3, 4, 5, 7]}
+btbands = {8: [10, 11], 7: [6]}
+qavalues = {8: [1, 322, 324, 328, 336, 352, 386, 480, 834, 836, 898, 900, 904, 928, 992, 1346],
+            7: [1, 66, 68, 72, 80, 96, 112, 130, 132, 136, 144, 160, 176, 224]}
+pixelsize = 30.0
+
+def makescene(landsat, path, row, acqdate):
+    # Returns a dict of the names of one scene
+    prefix = {8: 'LC8', 7: 'LE7'}[landsat]
+    processed = acqdate + datetime.timedelta(days = 14)
+    productid = '{}0{}_L1TP_{:03d}{:03d}_{}_{}_01_T1'.format(prefix[:2], prefix[2], path, row, acqdate.strftime('%Y%m%d'), processed.strftime('%Y%m%d'))
+    return {'landsat': landsat,
+            'path': path,
+            'row': row,
+            'acqdate': acqdate,
+            'sceneid': '{}LGN00'.format(sceneidfromproductid(productid)),
+            'productid': productid,
+            'archive': '{}{:03d}{:03d}{}01T1-SC{}.tar.gz'.format(productid[:4], path, row, acqdate.strftime('%Y%m%d'), (processed + datetime.timedelta(days = 1)).strftime('%Y%m%d%H%M%S'))}
+
+def makescenes(numscenes, paths = 4, rows = 4, startpath = 205, startrow = 21, startdate = datetime.datetime(2013, 4, 11)):
+    # Returns numscenes scene dicts. Landsat 8 and 7 acquisitions alternate every 8 days, and each
+    # Path is acquired on a different day, so up to 8 Paths are supported.
+    if paths < 1 or paths > 8:
+        raise ValueError('Between 1 and 8 Paths are supported.')
+    scenes = []
+    k = 0
+    while len(scenes) < numscenes:
+        landsat = 8 if k % 2 == 0 else 7
+        for p in range(paths):
+            acqdate = startdate + datetime.timedelta(days = 8 * k + p)
+            for r in range(rows):
+                if len(scenes) < numscenes:
+                    scenes.append(makescene(landsat, startpath + p, startrow + r, acqdate))
+        k += 1
+    return scenes
+
+def geotransform(scene, xsize, ysize):
+    # Scene placement in the local projection. Adjacent Rows overlap by 10%, and Paths are offset
+    # westwards.
+    ulx = 500000.0 - (scene['path'] - 205) * xsize * pixelsize * 0.85 + (scene['row'] - 21) * xsize * pixelsize * 0.05
+    uly = 900000.0 - (scene['row'] - 21) * ysize * pixelsize * 0.9
+    return [ulx, pixelsize, 0.0, uly, 0.0, -pixelsize]
+
+def envidatatype(dtype):
+    codes = {value[1]: key for key, value in enviheader.envidatatypes.items()}
+    dtype = np.dtype(dtype)
+    return codes['{}{}'.format(dtype.kind, dtype.itemsize)]
+
+def writeheader(datfile, xsize, ysize, bands, dtype, geotrans, mapname = 'UTM', projection = None, nodata = None, bandnames = None, description = None):
+    # Writes the ENVI header of a BSQ raster. mapname 'UTM' is as in ESPA archives, others as in
+    # ingested products.
+    if mapname == 'UTM':
+        mapinfo = 'UTM, 1, 1, {}, {}, {}, {}, 29, North, WGS-84, units=Meters'.format(geotrans[0], geotrans[3], geotrans[1], -geotrans[5])
+    else:
+        mapinfo = '{}, 1, 1, {}, {}, {}, {}, units=Meters'.format(mapname, geotrans[0], geotrans[3], geotrans[1], -geotrans[5])
+    lines = ['ENVI',
+             'description = {{{}}}'.format(description or os.path.basename(datfile)),
+             'samples = {}'.format(xsize),
+             'lines = {}'.format(ysize),
+             'bands = {}'.format(bands),
+             'header offset = 0',
+             'file type = ENVI Standard',
+             'data type = {}'.format(envidatatype(dtype)),
+             'interleave = bsq',
+             'byte order = 0',
+             'map info = {{{}}}'.format(mapinfo)]
+    if projection:
+        lines.append('coordinate system string = {{{}}}'.format(projection))
+    if nodata is not None:
+        lines.append('data ignore value = {}'.format(nodata))
+    if bandnames:
+        lines.append('band names = {{{}}}'.format(', '.join(bandnames)))
+    with open(os.path.splitext(datfile)[0] + '.hdr', 'w') as output:
+        output.write('{}\n'.format('\n'.join(lines)))
+
+def writeenvi(datfile, data, geotrans, **kwargs):
+    # Writes a 2 or 3 dimensional array as an ENVI raster
+    if data.ndim == 2:
+        data = data[np.newaxis, :, :]
+    data.tofile(datfile)
+    writeheader(datfile, data.shape[2], data.shape[1], data.shape[0], data.dtype, geotrans, **kwargs)
+
+def writesparse(datfile, xsize, ysize, bands, dtype, geotrans, **kwargs):
+    # Writes an ENVI raster of the full size without writing its data, for tests that only read
+    # file names and headers
+    with open(datfile, 'wb') as output:
+        output.truncate(xsize * ysize * bands * np.dtype(dtype).itemsize)
+    writeheader(datfile, xsize, ysize, bands, dtype, geotrans, **kwargs)
+
+def scenedata(scene, xsize, ysize, rng):
+    # Returns [SR, BT, pixel QA] arrays, with fill along the western edge
+    landsat = scene['landsat']
+    edge = np.arange(xsize)[np.newaxis, :] < (xsize // 20 + np.arange(ysize)[:, np.newaxis] // 10)
+    sr = rng.integers(0, 5000, size = (len(srbands[landsat]), ysize, xsize), dtype = np.int16)
+    bt = rng.integers(2700, 3100, size = (len(btbands[landsat]), ysize, xsize), dtype = np.int16)
+    qa = rng.choice(np.array(qavalues[landsat][1:], dtype = np.uint16), size = (ysize, xsize))
+    sr[:, edge] = -9999
+    bt[:, edge] = -9999
+    qa[edge] = 1
+    return sr, bt, qa
+
+def makearchive(outdir, scene, xsize, ysize, rng):
+    # Writes an ESPA-style .tar.gz archive of a scene, and returns its file name
+    archive = os.path.join(outdir, scene['archive'])
+    workdir = tempfile.mkdtemp(dir = outdir)
+    try:
+        sr, bt, qa = scenedata(scene, xsize, ysize, rng)
+        gt = geotransform(scene, xsize, ysize)
+        pid = scene['productid']
+        for data, bands, name, nodata in [[sr, srbands[scene['landsat']], 'sr_band', -9999], [bt, btbands[scene['landsat']], 'bt_band', -9999]]:
+            for i, band in enumerate(bands):
+                writeenvi(os.path.join(workdir, '{}_{}{}.img'.format(pid, name, band)), data[i], gt, nodata = nodata, bandnames = ['band {} {}'.format(band, name[:2])])
+        writeenvi(os.path.join(workdir, '{}_pixel_qa.img'.format(pid)), qa, gt, nodata = 1, bandnames = ['pixel_qa'])
+        with open(os.path.join(workdir, '{}_MTL.txt'.format(pid)), 'w') as output:
+            output.write('GROUP = L1_METADATA_FILE\n  LANDSAT_PRODUCT_ID = "{}"\n  LANDSAT_SCENE_ID = "{}"\n  DATE_ACQUIRED = {}\n  WRS_PATH = {}\n  WRS_ROW = {}\nEND_GROUP = L1_METADATA_FILE\nEND\n'.format(pid, scene['sceneid'], scene['acqdate'].strftime('%Y-%m-%d'), scene['path'], scene['row']))
+        with open(os.path.join(workdir, '{}.xml'.format(pid)), 'w') as output:
+            output.write('<?xml version="1.0" encoding="UTF-8"?>\n<espa_metadata version="2.0">\n  <global_metadata>\n    <product_id>{}</product_id>\n    <acquisition_date>{}</acquisition_date>\n  </global_metadata>\n</espa_metadata>\n'.format(pid, scene['acqdate'].strftime('%Y-%m-%d')))
+        with tarfile.open(archive, 'w:gz', compresslevel = 1) as tar:
+            for name in sorted(os.listdir(workdir)):
+                tar.add(os.path.join(workdir, name), arcname = name)
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+    return archive
+
+def makelibrary(dirs, scenes, xsize, ysize, projacronym, projection = None):
+    # Writes sparse ingested products of scenes. dirs is a dict of ref, BT, pixel_qa, NDVI, and EVI
+    # directories.
+    for scene in scenes:
+        gt = geotransform(scene, xsize, ysize)
+        base = scene['sceneid']
+        kwargs = {'mapname': 'Transverse Mercator', 'projection': projection}
+        writesparse(os.path.join(dirs['ref'], '{}_ref_{}.dat'.format(base, projacronym)), xsize, ysize, len(srbands[scene['landsat']]), np.int16, gt, nodata = -9999, **kwargs)
+        writesparse(os.path.join(dirs['BT'], '{}_BT_{}.dat'.format(base, projacronym)), xsize, ysize, len(btbands[scene['landsat']]), np.int16, gt, nodata = -9999, **kwargs)
+        writesparse(os.path.join(dirs['pixel_qa'], '{}_pixel_qa.dat'.format(base)), xsize, ysize, 1, np.uint16, gt, nodata = 1, **kwargs)
+        writesparse(os.path.join(dirs['NDVI'], '{}_NDVI.dat'.format(base)), xsize, ysize, 1, np.float32, gt, nodata = 0, **kwargs)
+        writesparse(os.path.join(dirs['EVI'], '{}_EVI.dat'.format(base)), xsize, ysize, 1, np.float32, gt, nodata = 0, **kwargs)
+
+def footprint(scene, xsize, ysize):
+    from osgeo import ogr
+    gt = geotransform(scene, xsize, ysize)
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [[0, 0], [xsize, 0], [xsize, ysize], [0, ysize], [0, 0]]:
+        ring.AddPoint(gt[0] + x * gt[1], gt[3] + y * gt[5])
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    return poly
+
+def makeshapefiles(scenes, shapefile, wrs2file, xsize, ysize, srs, srdir = None, projacronym = None):
+    # Writes the scene footprint shapefile read by newespaimport.py and the WRS-2 shapefile read by
+    # makevrts.py. If srdir is set, SR_path is set for scenes with an SR file there.
+    from osgeo import ogr
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    for f in [shapefile, wrs2file]:
+        if os.path.isfile(f):
+            driver.DeleteDataSource(f)
+    ds = driver.CreateDataSource(shapefile)
+    layer = ds.CreateLayer(os.path.splitext(os.path.basename(shapefile))[0], srs, ogr.wkbPolygon)
+    for name, width in [['sceneID', 21], ['LandsatPID', 40], ['acqDate', 10], ['SR_path', 254]]:
+        field = ogr.FieldDefn(name, ogr.OFTString)
+        field.SetWidth(width)
+        layer.CreateField(field)
+    for name in ['path', 'row']:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTInteger))
+    pathrows = {}
+    for scene in scenes:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('sceneID', scene['sceneid'])
+        feature.SetField('LandsatPID', scene['productid'])
+        feature.SetField('acqDate', scene['acqdate'].strftime('%Y/%m/%d'))
+        feature.SetField('path', scene['path'])
+        feature.SetField('row', scene['row'])
+        if srdir:
+            srfile = os.path.join(srdir, '{}_ref_{}.dat'.format(scene['sceneid'], projacronym))
+            if os.path.isfile(srfile):
+                feature.SetField('SR_path', srfile)
+        feature.SetGeometry(footprint(scene, xsize, ysize))
+        layer.CreateFeature(feature)
+        feature = None
+        pathrows[(scene['path'], scene['row'])] = scene
+    ds = None
+    ds = driver.CreateDataSource(wrs2file)
+    layer = ds.CreateLayer(os.path.splitext(os.path.basename(wrs2file))[0], srs, ogr.wkbPolygon)
+    for name in ['PATH', 'ROW']:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTInteger))
+    for path, row in sorted(pathrows.keys()):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('PATH', path)
+        feature.SetField('ROW', row)
+        feature.SetGeometry(footprint(pathrows[(path, row)], xsize, ysize))
+        layer.CreateFeature(feature)
+        feature = None
+    ds = None
+
+if __name__ == '__main__':
+    import ieostub
+    parser = argparse.ArgumentParser('This script creates a synthetic Landsat library and ESPA archives.')
+    parser.add_argument('-o', '--outdir', type = str, required = True, help = 'Output directory, laid out as the directories of ieostub.py.')
+    parser.add_argument('--scenes', type = int, default = 1000, help = 'Number of ingested scenes in the library (default = 1000).')
+    parser.add_argument('--archives', type = int, default = 10, help = 'Number of ESPA archives in the ingest directory, for scenes not in the library (default = 10).')
+    parser.add_argument('--xsize', type = int, default = 500, help = 'Scene width in pixels (default = 500).')
+    parser.add_argument('--ysize', type = int, default = 500, help = 'Scene height in pixels (default = 500).')
+    parser.add_argument('--paths', type = int, default = 4, help = 'Number of WRS-2 Paths, up to 8 (default = 4).')
+    parser.add_argument('--rows', type = int, default = 4, help = 'Number of WRS-2 Rows per Path (default = 4).')
+    args = parser.parse_args()
+
+    ieostub.setlibrary(args.outdir)
+    rng = np.random.default_rng(0)
+    scenes = makescenes(args.scenes + args.archives, paths = args.paths, rows = args.rows)
+    print('Writing {} ingested scenes to: {}'.format(args.scenes, args.outdir))
+    makelibrary(ieostub.librarydirs(), scenes[:args.scenes], args.xsize, args.ysize, ieostub.projacronym, projection = ieostub.projection())
+    print('Writing {} ESPA archives to: {}'.format(args.archives, ieostub.ingestdir))
+    for scene in scenes[args.scenes:]:
+        makearchive(ieostub.ingestdir, scene, args.xsize, args.ysize, rng)
+    print('Writing shapefiles: {}, {}'.format(ieostub.landsatshp, ieostub.WRS2))
+    makeshapefiles(scenes, ieostub.landsatshp, ieostub.WRS2, args.xsize, args.ysize, ieostub.prj, srdir = ieostub.srdir, projacronym = ieostub.projacronym)
+    print('Processing complete.')
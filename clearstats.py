@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script calculates the clear land, water, cloud shadow, snow, and cloud fractions of ingested
+# scenes from their Fmask or pixel QA layers, as fractions of non-fill pixels within the ingested
+# (local projection) extent, or within the AOI bounds for scenes ingested with --aoi. Unlike the
+# USGS scene-wide cloud cover values, these describe the area actually ingested. Masks are read
+# blockwise. Results are stored in the ingest ledger and written to new fields in ieo.landsatshp, so
+# that scene selection and compositing can filter on them without opening any rasters.
+# newespaimport.py calculates them at ingest; run as a script, this backfills the existing library.
+
+import os, sys, glob, argparse, time, math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from osgeo import gdal, ogr
+from ingestledger import IngestLedger
+import qadecode, vegindex, sceneindex
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+classes = ['clear', 'water', 'shadow', 'snow', 'cloud']
+shapefields = {'clear': 'ClearFrac', 'water': 'WaterFrac', 'shadow': 'ShadowFrac', 'snow': 'SnowFrac', 'cloud': 'CloudFrac'}
+masksuffixes = {'pixel_qa': '_pixel_qa.dat', 'cfmask': '_cfmask.dat'}
+
+def scenebasefromfilename(maskfile):
+    basename = os.path.basename(maskfile)
+    for suffix in masksuffixes.values():
+        if basename.endswith(suffix):
+            return basename[:-len(suffix)]
+    return os.path.splitext(basename)[0]
+
+def scenekey(scenebase):
+    # Returns the product ID or 16 character scene ID used to match a scene to its footprint feature
+    if len(scenebase) >= 40:
+        return scenebase[:40]
+    if scenebase[2:3] == '0': # Scene ID with a two digit Landsat number, e.g. LC08207023...
+        return scenebase[:2] + scenebase[3:17]
+    return scenebase[:16]
+
+def classcounts(mask, masktype, landsat = None):
+    # Returns [dict of class: pixel count, number of non-fill pixels] for a block of mask data
+    return qadecode.classcounts(mask, masktype, landsat)
+
+def maskwindow(ds, bounds):
+    # Returns the pixel window [xoff, yoff, xsize, ysize] of a dataset within bounds [minX, minY, maxX, maxY]
+    geotrans = ds.GetGeoTransform()
+    xoff = max(0, int(math.floor((bounds[0] - geotrans[0]) / geotrans[1] + 0.5)))
+    xend = min(ds.RasterXSize, int(math.floor((bounds[2] - geotrans[0]) / geotrans[1] + 0.5)))
+    yoff = max(0, int(math.floor((bounds[3] - geotrans[3]) / geotrans[5] + 0.5)))
+    yend = min(ds.RasterYSize, int(math.floor((bounds[1] - geotrans[3]) / geotrans[5] + 0.5)))
+    return [xoff, yoff, max(xend - xoff, 0), max(yend - yoff, 0)]
+
+def maskfractions(maskfile, masktype = None, blocklines = 1024, bounds = None):
+    # Returns [dict of class: fraction of non-fill pixels, number of non-fill pixels] for a mask file,
+    # or for the part of it within bounds [minX, minY, maxX, maxY], e.g. those of an ingest AOI
+    if not masktype:
+        if maskfile.endswith(masksuffixes['pixel_qa']):
+            masktype = 'pixel_qa'
+        else:
+            masktype = 'cfmask'
+    ds = gdal.Open(maskfile)
+    if not ds:
+        raise IOError('Unable to open mask file: {}'.format(maskfile))
+    band = ds.GetRasterBand(1)
+    landsat = vegindex.landsatnumber(maskfile)
+    xoff, ystart, xsize, ysize = [0, 0, ds.RasterXSize, ds.RasterYSize]
+    if bounds:
+        xoff, ystart, xsize, ysize = maskwindow(ds, bounds)
+    totals = {key: 0 for key in classes}
+    pixels = 0
+    if xsize == 0: # No overlap with the bounds
+        ysize = 0
+    for yoff in range(ystart, ystart + ysize, blocklines):
+        counts, valid = classcounts(band.ReadAsArray(xoff, yoff, xsize, min(blocklines, ystart + ysize - yoff)), masktype, landsat)
+        for key in classes:
+            totals[key] += counts[key]
+        pixels += valid
+    ds = None
+    if pixels == 0:
+        return {key: 0.0 for key in classes}, 0
+    return {key: totals[key] / pixels for key in classes}, pixels
+
+def scenestats(maskfile, bounds = None):
+    # Worker function for the backfill. Returns [scenebase, mask file, mask type, fractions, pixels].
+    if maskfile.endswith(masksuffixes['pixel_qa']):
+        masktype = 'pixel_qa'
+    else:
+        masktype = 'cfmask'
+    fractions, pixels = maskfractions(maskfile, masktype, bounds = bounds)
+    return [scenebasefromfilename(maskfile), maskfile, masktype, fractions, pixels]
+
+def recordstats(ledger, maskfile, bounds = None):
+    # Calculates statistics for a mask file, within bounds if set, and stores them in the ingest
+    # ledger. Returns the scenebase.
+    scenebase, maskfile, masktype, fractions, pixels = scenestats(maskfile, bounds = bounds)
+    ledger.setclearstats(scenebase, maskfile, masktype, fractions, pixels)
+    return scenebase
+
+def findmasks(pixelqadir, fmaskdir, year = None):
+    # Returns a dict of scenebase: mask file, preferring pixel QA layers over Fmask
+    masks = {}
+    for dirname, suffix in [(fmaskdir, masksuffixes['cfmask']), (pixelqadir, masksuffixes['pixel_qa'])]:
+        if year:
+            flist = glob.glob(os.path.join(dirname, 'L*{}*{}'.format(year, suffix)))
+        else:
+            flist = glob.glob(os.path.join(dirname, 'L*{}'.format(suffix)))
+        for f in flist:
+            masks[scenebasefromfilename(f)] = f
+    return masks
+
+def updateshapefile(shapefile, stats):
+    # Writes clear statistics to ieo.landsatshp. stats is a dict of scenebase: ledger row. Features
+    # are matched by product ID for product ID based file names, and by scene ID otherwise.
+    if len(stats) == 0:
+        return 0
+    byscene = {scenekey(scenebase): stats[scenebase] for scenebase in stats.keys()}
+    # The fields written here are not held in the scene index, so an index that was in sync with the
+    # shapefile is kept in sync rather than rebuilt by the next query
+    index = None
+    if os.path.isfile(sceneindex.defaultindex()):
+        index = sceneindex.SceneIndex()
+        if not index.insync(shapefile):
+            index.close()
+            index = None
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    data_source = driver.Open(shapefile, 1)
+    if not data_source:
+        if index:
+            index.close()
+        raise IOError('Unable to open: {}'.format(shapefile))
+    layer = data_source.GetLayer()
+    layer_defn = layer.GetLayerDefn()
+    field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+    for key in classes:
+        if not shapefields[key] in field_names:
+            layer.CreateField(ogr.FieldDefn(shapefields[key], ogr.OFTReal))
+    updated = 0
+    for feature in layer:
+        row = byscene.get(feature.GetField('LandsatPID') or '') or byscene.get((feature.GetField('sceneID') or '')[:16])
+        if row:
+            for key in classes:
+                feature.SetField(shapefields[key], round(row[key] * 100.0, 2)) # percent, as with CCFull and CCLand
+            layer.SetFeature(feature)
+            updated += 1
+    data_source = None
+    if index:
+        index.setsource(shapefile)
+        index.close()
+    return updated
+
+def clearfractions(shapefile = None):
+    # Returns a dict of scenebase key (product ID or 16 character scene ID): clear land percentage,
+    # read from the attribute table only
+    if not shapefile:
+        shapefile = ieo.landsatshp
+    data_source = ogr.Open(shapefile, 0)
+    layer = data_source.GetLayer()
+    layer_defn = layer.GetLayerDefn()
+    field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+    clear = {}
+    if shapefields['clear'] in field_names:
+        for feature in layer:
+            value = feature.GetField(shapefields['clear'])
+            if value is not None:
+                if feature.GetField('LandsatPID'):
+                    clear[feature.GetField('LandsatPID')] = value
+                if feature.GetField('sceneID'):
+                    clear[feature.GetField('sceneID')[:16]] = value
+    data_source = None
+    return clear
+
+def lookupclear(clear, scenebase):
+    return clear.get(scenekey(scenebase))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script calculates clear land, water, cloud shadow, snow, and cloud fractions for the ingested library.')
+    parser.add_argument('-f', '--fmaskdir', type = str, default = ieo.fmaskdir, help = 'Fmask directory')
+    parser.add_argument('-q', '--pixelqadir', type = str, default = ieo.pixelqadir, help = 'Pixel QA directory')
+    parser.add_argument('-y', '--year', type = int, default = None, help = 'Process scenes only for a specific year.')
+    parser.add_argument('--ledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ingest_ledger.sqlite'), help = 'SQLite ingest ledger in which statistics are stored.')
+    parser.add_argument('--shp', type = str, default = ieo.landsatshp, help = 'Scene footprint shapefile to update (default = ieo.landsatshp).')
+    parser.add_argument('--noshp', action = 'store_true', help = 'Do not update the shapefile.')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count(), help = 'Number of scenes processed in parallel (default = number of CPU cores).')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'Recalculate statistics for scenes already in the ledger.')
+    args = parser.parse_args()
+
+    ledger = IngestLedger(args.ledger)
+    masks = findmasks(args.pixelqadir, args.fmaskdir, year = args.year)
+    existing = ledger.getclearstats()
+    todo = [masks[key] for key in sorted(masks.keys()) if args.overwrite or not key in existing.keys() or existing[key]['maskfile'] != masks[key]]
+    print('Calculating statistics for {} of {} scenes.'.format(len(todo), len(masks)))
+    starttime = time.time()
+    with ProcessPoolExecutor(max_workers = max(args.workers or 1, 1)) as executor:
+        futures = {executor.submit(scenestats, f): f for f in todo}
+        for i, future in enumerate(as_completed(futures), start = 1):
+            try:
+                scenebase, maskfile, masktype, fractions, pixels = future.result()
+                ledger.setclearstats(scenebase, maskfile, masktype, fractions, pixels)
+                print('{}: {:0.1f}% clear land, {:0.1f}% cloud, scene {} of {}.'.format(scenebase, fractions['clear'] * 100.0, fractions['cloud'] * 100.0, i, len(todo)))
+            except Exception as e:
+                print('Error processing {}: {}'.format(futures[future], e))
+                ieo.logerror(futures[future], e)
+    print('Statistics calculated in {:0.1f} s.'.format(time.time() - starttime))
+    if not args.noshp:
+        print('{} features updated in: {}'.format(updateshapefile(args.shp, ledger.getclearstats(masks.keys())), args.shp))
+    ledger.close()
+
+    print('Processing complete.')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module reads ENVI .hdr sidecar files of ingested products, so that raster dimensions,
+# data types, georeferencing, and nodata values can be obtained without opening the rasters.
+# Parsed headers are cached and only re-read if the header file has been modified.
+
+import os, threading
+
+# ENVI data type codes: [GDAL data type name, NumPy dtype character code]
+envidatatypes = {1: ['Byte', 'u1'],
+                 2: ['Int16', 'i2'],
+                 3: ['Int32', 'i4'],
+                 4: ['Float32', 'f4'],
+                 5: ['Float64', 'f8'],
+                 6: ['CFloat32', 'c8'],
+                 9: ['CFloat64', 'c16'],
+                 12: ['UInt16', 'u2'],
+                 13: ['UInt32', 'u4'],
+                 14: ['Int64', 'i8'],
+                 15: ['UInt64', 'u8']}
+
+headercache = {}
+cachelock = threading.Lock()
+
+def hdrfilename(datfile):
+    # ENVI headers may replace the data file extension or be appended to it
+    for hdr in [os.path.splitext(datfile)[0] + '.hdr', datfile + '.hdr']:
+        if os.path.isfile(hdr):
+            return hdr
+    return None
+
+def parseheader(hdr):
+    # Returns a dict of lower case header keys and string values. Values in braces may span lines.
+    header = {}
+    with open(hdr, 'r') as f:
+        lines = f.read().splitlines()
+    if len(lines) == 0 or not lines[0].strip().upper().startswith('ENVI'):
+        raise ValueError('Not an ENVI header: {}'.format(hdr))
+    i = 1
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if not '=' in line:
+            continue
+        key, value = line.split('=', 1)
+        value = value.strip()
+        if value.startswith('{'):
+            while not value.endswith('}') and i < len(lines):
+                value += '\n' + lines[i].strip()
+                i += 1
+            value = value[1:-1].strip()
+        header[key.strip().lower()] = value
+    return header
+
+def readheader(datfile):
+    # Returns a parsed header from the cache, reading it if new or modified
+    hdr = hdrfilename(datfile)
+    if not hdr:
+        raise IOError('ENVI header not found for: {}'.format(datfile))
+    mtime = os.path.getmtime(hdr)
+    with cachelock:
+        if hdr in headercache.keys() and headercache[hdr][0] == mtime:
+            return headercache[hdr][1]
+    header = parseheader(hdr)
+    with cachelock:
+        headercache[hdr] = [mtime, header]
+    return header
+
+def splitlist(value):
+    return [x.strip() for x in value.replace('\n', ' ').split(',')]
+
+def rastersize(header):
+    # Returns [samples, lines, bands]
+    return [int(header['samples']), int(header['lines']), int(header.get('bands', 1))]
+
+def datatype(header):
+    return envidatatypes[int(header['data type'])][0]
+
+def geotransform(header):
+    # Converts 'map info' to a GDAL geotransform. Reference pixel coordinates in ENVI are one-based.
+    if not 'map info' in header.keys():
+        raise ValueError('ENVI header has no map info.')
+    mapinfo = splitlist(header['map info'])
+    refx, refy = float(mapinfo[1]), float(mapinfo[2])
+    easting, northing = float(mapinfo[3]), float(mapinfo[4])
+    xres, yres = float(mapinfo[5]), float(mapinfo[6])
+    if any(x.lower().startswith('rotation') for x in mapinfo):
+        raise ValueError('Rotated ENVI rasters are not supported.')
+    ulx = easting - (refx - 1.0) * xres
+    uly = northing + (refy - 1.0) * yres
+    return [ulx, xres, 0.0, uly, 0.0, -yres]
+
+def projection(header):
+    # Returns the WKT stored in 'coordinate system string', if present
+    return header.get('coordinate system string', '').replace('\n', '')
+
+def bandnames(header):
+    if 'band names' in header.keys():
+        return splitlist(header['band names'])
+    return []
+
+def nodatavalue(header):
+    return header.get('data ignore value', None)
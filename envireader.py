@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module exposes ingested ENVI products (SR, BT, NDVI, EVI, Fmask, and pixel QA) as read-only
+# numpy.memmap arrays, using the dimensions, data type, byte order, header offset, and interleave
+# in their .hdr files. Opening a file reads only its header; data are paged in by the operating
+# system as they are accessed, and pages are shared between processes reading the same file.
+# Band and window accessors return views rather than copies, in [bands, lines, samples] order for
+# any interleave.
+
+import numpy as np
+import enviheader
+
+def dtype(header):
+    # NumPy dtype of the data, with byte order 0 = little endian, 1 = big endian
+    code = enviheader.envidatatypes[int(header['data type'])][1]
+    if code == 'u1':
+        return np.dtype(code)
+    if int(header.get('byte order', 0)) == 1:
+        return np.dtype('>{}'.format(code))
+    return np.dtype('<{}'.format(code))
+
+def interleave(header):
+    return header.get('interleave', 'bsq').strip().lower()
+
+def openraw(datfile, mode = 'r'):
+    # Returns a memmap in the file's own interleave: BSQ [bands, lines, samples],
+    # BIL [lines, bands, samples], or BIP [lines, samples, bands]
+    header = enviheader.readheader(datfile)
+    samples, lines, bands = enviheader.rastersize(header)
+    shapes = {'bsq': (bands, lines, samples), 'bil': (lines, bands, samples), 'bip': (lines, samples, bands)}
+    layout = interleave(header)
+    if not layout in shapes.keys():
+        raise ValueError('Unsupported ENVI interleave {} for: {}'.format(layout, datfile))
+    return np.memmap(datfile, dtype = dtype(header), mode = mode, offset = int(header.get('header offset', 0)), shape = shapes[layout])
+
+def openbands(datfile, mode = 'r'):
+    # Returns a [bands, lines, samples] view of the file, whatever its interleave
+    data = openraw(datfile, mode = mode)
+    layout = interleave(enviheader.readheader(datfile))
+    if layout == 'bil':
+        return data.transpose(1, 0, 2)
+    elif layout == 'bip':
+        return data.transpose(2, 0, 1)
+    return data
+
+def band(datfile, number = 1):
+    # Returns a [lines, samples] view of one band. Band numbers start at 1, as in GDAL.
+    return openbands(datfile)[number - 1]
+
+def window(datfile, number, xoff, yoff, xsize, ysize):
+    # Returns a [lines, samples] view of a window of one band, as ReadAsArray(xoff, yoff, xsize, ysize)
+    return band(datfile, number)[yoff:yoff + ysize, xoff:xoff + xsize]
+
+def nodata(datfile):
+    # Returns the nodata value cast to the data type of the file, or None
+    header = enviheader.readheader(datfile)
+    value = enviheader.nodatavalue(header)
+    if value is None:
+        return None
+    return dtype(header).type(float(value))
+
+def masked(data, nodataval):
+    # Returns a masked array view of data with nodata values masked
+    if nodataval is None:
+        return np.ma.masked_array(data, mask = np.ma.nomask)
+    return np.ma.masked_equal(data, nodataval, copy = False)
+
+def georeference(datfile):
+    # Returns [GDAL geotransform, projection WKT]
+    header = enviheader.readheader(datfile)
+    return [enviheader.geotransform(header), enviheader.projection(header)]
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script downloads completed ESPA orders into ieo.ingestdir for newespaimport.py. Archives
+# are listed in a manifest file, one URL per line optionally followed by its MD5 checksum, or are
+# read from the ESPA API for order IDs. Downloads run concurrently and are written to .part files,
+# which are resumed with HTTP Range requests if a transfer is interrupted. Completed files are
+# checked against their expected size and checksum, then renamed into the ingest directory, so
+# that newespaimport.py never sees a partial archive. The total download rate may be capped.
+
+import os, sys, argparse, threading, time, getpass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+from ingestledger import md5sum
+
+class RateLimiter(object):
+    # Token bucket shared by all download threads. rate is in bytes per second; None or 0 is unlimited.
+    def __init__(self, rate = None):
+        self.rate = rate
+        self.allowance = float(rate or 0)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.allowance = min(self.allowance + (now - self.last) * self.rate, float(self.rate))
+            self.last = now
+            self.allowance -= nbytes
+            wait = -self.allowance / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+def readmanifest(manifest):
+    # Returns a list of dicts with the URL and, if listed, the MD5 checksum of each archive
+    items = []
+    with open(manifest, 'r') as lines:
+        for line in lines:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            parts = line.split()
+            item = {'url': parts[0], 'md5': None}
+            if len(parts) > 1:
+                item['md5'] = parts[1].lower()
+            items.append(item)
+    return items
+
+def orderitems(orderid, baseurl, session):
+    # Returns completed items of an ESPA order, as listed by the ESPA API
+    response = session.get('{}item-status/{}'.format(baseurl, orderid), timeout = 60)
+    response.raise_for_status()
+    items = []
+    for item in response.json().get(orderid, []):
+        if item.get('status') == 'complete' and item.get('product_dld_url'):
+            items.append({'url': item['product_dld_url'], 'md5': None, 'md5url': item.get('cksum_download_url')})
+    return items
+
+def expectedmd5(item, session):
+    # The checksum is taken from the manifest, or downloaded from the ESPA checksum URL
+    if item.get('md5'):
+        return item['md5']
+    if item.get('md5url'):
+        response = session.get(item['md5url'], timeout = 60)
+        response.raise_for_status()
+        return response.text.split()[0].lower()
+    return None
+
+def totalsize(response, offset):
+    # Full size of the remote file from a 200 or 206 response, or None if the server didn't say
+    if response.status_code == 206 and '/' in response.headers.get('Content-Range', ''):
+        size = response.headers['Content-Range'].split('/')[-1]
+        if size != '*':
+            return int(size)
+    elif response.headers.get('Content-Length'):
+        return int(response.headers['Content-Length']) + offset
+    return None
+
+def download(item, outdir, session, limiter = None, blocksize = 2 ** 20, retries = 5, overwrite = False):
+    # Downloads one archive to outdir, resuming any earlier partial download. Returns the filename.
+    url = item['url']
+    basename = os.path.basename(url.split('?')[0])
+    outfile = os.path.join(outdir, basename)
+    partfile = '{}.part'.format(outfile)
+    if os.path.isfile(outfile) and not overwrite:
+        print('{} exists, skipping.'.format(basename))
+        return outfile
+    md5 = expectedmd5(item, session)
+    size = None
+    tries = 0
+    while True:
+        tries += 1
+        offset = 0
+        if os.path.isfile(partfile):
+            offset = os.path.getsize(partfile)
+        headers = {}
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            with session.get(url, headers = headers, stream = True, timeout = 60) as response:
+                if response.status_code == 416: # The part file already holds the whole archive
+                    size = offset
+                else:
+                    response.raise_for_status()
+                    if response.status_code == 200 and offset > 0:
+                        print('Server does not support resuming {}, restarting.'.format(basename))
+                        offset = 0
+                    size = totalsize(response, offset)
+                    if offset > 0:
+                        print('Resuming {} at {:0.1f} MB.'.format(basename, offset / 1048576.0))
+                    else:
+                        print('Downloading {}.'.format(basename))
+                    with open(partfile, 'ab' if offset > 0 else 'wb') as output:
+                        for block in response.iter_content(chunk_size = blocksize):
+                            if block:
+                                output.write(block)
+                                if limiter:
+                                    limiter.consume(len(block))
+            if size is not None and os.path.getsize(partfile) < size:
+                raise IOError('Transfer of {} ended at {} of {} bytes.'.format(basename, os.path.getsize(partfile), size))
+            break
+        except (requests.exceptions.RequestException, IOError) as e:
+            if tries >= retries:
+                raise
+            print('Error downloading {} ({}), retrying in {} s.'.format(basename, e, 2 ** tries))
+            time.sleep(2 ** tries)
+    if size is not None and os.path.getsize(partfile) != size:
+        message = 'Size of {} is {} bytes, expected {} bytes.'.format(basename, os.path.getsize(partfile), size)
+        os.remove(partfile)
+        raise IOError(message)
+    if md5:
+        checksum = md5sum(partfile)
+        if checksum != md5:
+            os.remove(partfile) # A corrupt part file can't be resumed
+            raise IOError('Checksum of {} is {}, expected {}.'.format(basename, checksum, md5))
+    os.replace(partfile, outfile)
+    return outfile
+
+def run(items, outdir, session = None, workers = 4, maxrate = None, overwrite = False):
+    # Downloads items concurrently. Returns [list of downloaded files, list of failed URLs].
+    if not session:
+        session = requests.Session()
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    limiter = RateLimiter(maxrate)
+    downloaded = []
+    failed = []
+    with ThreadPoolExecutor(max_workers = max(workers, 1)) as executor:
+        futures = {executor.submit(download, item, outdir, session, limiter, overwrite = overwrite): item['url'] for item in items}
+        for future in as_completed(futures):
+            try:
+                downloaded.append(future.result())
+                print('Downloaded {}, {} of {}.'.format(os.path.basename(downloaded[-1]), len(downloaded), len(items)))
+            except Exception as e:
+                print('Error downloading {}: {}'.format(futures[future], e))
+                ieo.logerror(futures[future], e)
+                failed.append(futures[future])
+    return downloaded, failed
+
+def getparser():
+    parser = argparse.ArgumentParser('This script downloads completed ESPA orders to the ingest directory.')
+    parser.add_argument('-m', '--manifest', type = str, default = None, help = 'Text file of archive URLs, one per line, each optionally followed by its MD5 checksum.')
+    parser.add_argument('--order', type = str, default = None, help = 'Comma-delimited ESPA order IDs to download.')
+    parser.add_argument('-u', '--username', type = str, default = None, help = 'USGS/EROS Registration System (ERS) username, used with --order.')
+    parser.add_argument('-p', '--password', type = str, default = None, help = 'USGS/EROS Registration System (ERS) password, used with --order.')
+    parser.add_argument('--baseurl', type = str, default = 'https://espa.cr.usgs.gov/api/v1/', help = 'ESPA API base URL (default = "https://espa.cr.usgs.gov/api/v1/").')
+    parser.add_argument('-o', '--outdir', type = str, default = ieo.ingestdir, help = 'Output directory (default = ieo.ingestdir).')
+    parser.add_argument('-w', '--workers', type = int, default = 4, help = 'Number of concurrent downloads (default = 4).')
+    parser.add_argument('--maxrate', type = float, default = None, help = 'Maximum total download rate in MB/s (default = unlimited).')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'Download archives already in the output directory again.')
+    return parser
+
+def main(argv = None):
+    args = getparser().parse_args(argv)
+    session = requests.Session()
+    items = []
+    if args.manifest:
+        items.extend(readmanifest(args.manifest))
+    if args.order:
+        if not args.username:
+            args.username = input('USGS/ERS username: ')
+        if not args.password:
+            args.password = getpass.getpass('USGS/ERS password: ')
+        session.auth = (args.username, args.password)
+        if not args.baseurl.endswith('/'):
+            args.baseurl += '/'
+        for orderid in args.order.split(','):
+            items.extend(orderitems(orderid.strip(), args.baseurl, session))
+    if len(items) == 0:
+        print('Error: no archives to download. Set --manifest or --order. Exiting.')
+        sys.exit()
+    maxrate = None
+    if args.maxrate:
+        maxrate = args.maxrate * 1048576.0
+    print('Downloading {} archives to: {}'.format(len(items), args.outdir))
+    downloaded, failed = run(items, args.outdir, session = session, workers = args.workers, maxrate = maxrate, overwrite = args.overwrite)
+    print('{} archives downloaded, {} failed.'.format(len(downloaded), len(failed)))
+    return downloaded, failed
+
+if __name__ == '__main__':
+    main()
+    print('Processing complete.')
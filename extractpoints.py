@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script extracts pixel time series for sample points from the ingested library. Scene
+# footprints in ieo.landsatshp are used to find which scenes cover which points, points are
+# grouped per scene, and each scene is opened once and read in small windows around its points,
+# with scenes spread across a thread pool. Output is a tidy table with one row per point and
+# scene, including the raw QA value, its decoded class, and a clear land flag.
+#
+# It may also be imported, e.g.:
+#   import extractpoints
+#   rows = extractpoints.extract(extractpoints.loadpoints('points.shp', idfield = 'ID'), products = ['NDVI'])
+
+import os, sys, argparse, datetime, time, csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from osgeo import gdal, ogr, osr
+import vegindex, qadecode
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+# Product: [shapefile path field, nodata value]
+productfields = {'SR': ['SR_path', -9999], 'BT': ['BT_path', -9999], 'NDVI': ['NDVI_path', 0], 'EVI': ['EVI_path', 0]}
+srbandnames = {'L8': ['coastal', 'blue', 'green', 'red', 'nir', 'swir1', 'swir2'],
+               'L47': ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']}
+
+def loadpoints(pointfile, idfield = None):
+    # Returns a list of [point ID, X, Y] in the local projection. Non-point geometries use their centroid.
+    data_source = ogr.Open(pointfile, 0)
+    if not data_source:
+        raise IOError('Unable to open point file: {}'.format(pointfile))
+    layer = data_source.GetLayer()
+    srs = layer.GetSpatialRef()
+    transform = None
+    if srs and not srs.IsSame(ieo.prj):
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(srs, ieo.prj)
+    points = []
+    for feature in layer:
+        geom = feature.GetGeometryRef().Centroid()
+        if transform:
+            geom.Transform(transform)
+        if idfield:
+            pointid = feature.GetField(idfield)
+        else:
+            pointid = feature.GetFID()
+        points.append([pointid, geom.GetX(), geom.GetY()])
+    data_source = None
+    return points
+
+def loadfootprints(shapefile = None, startdate = None, enddate = None, maxcc = None):
+    # Returns a list of scene dicts with footprint geometry and product file paths. Dates are
+    # datetime.date objects.
+    if not shapefile:
+        shapefile = ieo.landsatshp
+    data_source = ogr.Open(shapefile, 0)
+    layer = data_source.GetLayer()
+    fieldnames = [layer.GetLayerDefn().GetFieldDefn(i).GetName() for i in range(layer.GetLayerDefn().GetFieldCount())]
+    scenes = []
+    for feature in layer:
+        paths = {}
+        for product in productfields.keys():
+            if productfields[product][0] in fieldnames:
+                f = feature.GetField(productfields[product][0])
+                if f and os.path.isfile(f):
+                    paths[product] = f
+        if len(paths) == 0:
+            continue
+        try: # OGR returns date fields as YYYY/MM/DD strings
+            acqdate = datetime.datetime.strptime(feature.GetField('acqDate')[:10], '%Y/%m/%d').date()
+        except (TypeError, ValueError): # As in MakeESPAproclist.getscenedata(), the date is taken from the scene ID
+            sceneID = feature.GetField('sceneID') or ''
+            try:
+                acqdate = datetime.datetime.strptime(sceneID[9:16], '%Y%j').date()
+            except ValueError:
+                print('Error: no acquisition date for scene {}, skipping.'.format(sceneID))
+                ieo.logerror(sceneID, '"acqDate" field missing acquisition date data.')
+                continue
+        if (startdate and acqdate < startdate) or (enddate and acqdate > enddate):
+            continue
+        if maxcc is not None and feature.GetField('CCFull') is not None and feature.GetField('CCFull') > maxcc:
+            continue
+        maskfile, masktype = None, None
+        for field, mtype in [['PixQA_path', 'pixel_qa'], ['Fmask_path', 'cfmask']]:
+            if field in fieldnames:
+                f = feature.GetField(field)
+                if f and os.path.isfile(f):
+                    maskfile, masktype = f, mtype
+                    break
+        geom = feature.GetGeometryRef().Clone()
+        scenes.append({'sceneID': feature.GetField('sceneID'), 'date': acqdate, 'geom': geom,
+                       'envelope': geom.GetEnvelope(), 'paths': paths, 'maskfile': maskfile, 'masktype': masktype})
+    data_source = None
+    return scenes
+
+def assignpoints(points, scenes):
+    # Returns a list of [scene, indices of points within its footprint]. Envelopes are tested with
+    # NumPy first, so that only candidate points are tested against the footprint polygon.
+    assignments = []
+    if len(points) == 0:
+        return assignments
+    xy = np.array([[p[1], p[2]] for p in points])
+    for scene in scenes:
+        minX, maxX, minY, maxY = scene['envelope']
+        candidates = np.nonzero((xy[:, 0] >= minX) & (xy[:, 0] <= maxX) & (xy[:, 1] >= minY) & (xy[:, 1] <= maxY))[0]
+        indices = []
+        for i in candidates:
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint(xy[i, 0], xy[i, 1])
+            if scene['geom'].Contains(point):
+                indices.append(int(i))
+        if len(indices) > 0:
+            assignments.append([scene, indices])
+    return assignments
+
+def readpixels(filename, cols, rows, blocklines = 256):
+    # Returns an array of [bands, points] values. Points are read in windows of up to blocklines
+    # lines covering only the columns spanned by the points within each window.
+    ds = gdal.Open(filename)
+    if not ds:
+        raise IOError('Unable to open: {}'.format(filename))
+    values = np.zeros((ds.RasterCount, len(cols)), dtype = np.float64)
+    order = np.argsort(rows)
+    start = 0
+    while start < len(order):
+        end = start
+        while end < len(order) and rows[order[end]] < rows[order[start]] + blocklines:
+            end += 1
+        idx = order[start:end]
+        x0, x1 = cols[idx].min(), cols[idx].max() + 1
+        y0, y1 = rows[idx].min(), rows[idx].max() + 1
+        for b in range(ds.RasterCount):
+            data = ds.GetRasterBand(b + 1).ReadAsArray(int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+            values[b, idx] = data[rows[idx] - y0, cols[idx] - x0]
+        start = end
+    ds = None
+    return values
+
+def extractscene(scene, points, indices, products, blocklines = 256):
+    # Returns a list of output rows for the points within one scene
+    gt = None
+    for product in products:
+        if product in scene['paths']:
+            ds = gdal.Open(scene['paths'][product])
+            gt = ds.GetGeoTransform()
+            xsize, ysize = ds.RasterXSize, ds.RasterYSize
+            ds = None
+            break
+    if not gt:
+        return []
+    xy = np.array([[points[i][1], points[i][2]] for i in indices])
+    cols = np.floor((xy[:, 0] - gt[0]) / gt[1]).astype(np.int64)
+    rows = np.floor((xy[:, 1] - gt[3]) / gt[5]).astype(np.int64)
+    inside = (cols >= 0) & (cols < xsize) & (rows >= 0) & (rows < ysize)
+    indices = [i for i, x in zip(indices, inside) if x]
+    cols, rows = cols[inside], rows[inside]
+    if len(indices) == 0:
+        return []
+    landsat = vegindex.landsatnumber(scene['sceneID'])
+    columns = {}
+    for product in products:
+        if not product in scene['paths']:
+            continue
+        values = readpixels(scene['paths'][product], cols, rows, blocklines = blocklines)
+        if product == 'SR':
+            if landsat == 8:
+                names = srbandnames['L8']
+            else:
+                names = srbandnames['L47']
+            for b in range(values.shape[0]):
+                if b < len(names):
+                    columns['SR_{}'.format(names[b])] = [values[b], productfields[product][1]]
+        elif product == 'BT':
+            for b in range(values.shape[0]):
+                columns['BT_{}'.format(b + 1)] = [values[b], productfields[product][1]]
+        else:
+            columns[product] = [values[0], productfields[product][1]]
+    if len(columns) == 0:
+        return []
+    qa, clear = None, None
+    if scene['maskfile']:
+        qa = readpixels(scene['maskfile'], cols, rows, blocklines = blocklines)[0].astype(np.int64)
+        qaclass = qadecode.decode(qa, scene['masktype'], landsat)
+        clear = qaclass == qadecode.clear
+    outrows = []
+    for j, i in enumerate(indices):
+        # Points falling on fill in every product are outside the imaged area of the scene
+        if all(columns[name][0][j] == columns[name][1] for name in columns.keys()):
+            continue
+        row = {'pointid': points[i][0], 'x': points[i][1], 'y': points[i][2], 'sceneID': scene['sceneID'],
+               'date': scene['date'].strftime('%Y-%m-%d'), 'landsat': landsat}
+        for name in columns.keys():
+            value = columns[name][0][j]
+            if value == columns[name][1]:
+                row[name] = None
+            else:
+                row[name] = value
+        if qa is not None:
+            row['masktype'] = scene['masktype']
+            row['qa'] = int(qa[j])
+            row['qaclass'] = int(qaclass[j])
+            row['clear'] = int(clear[j])
+        else:
+            row['masktype'], row['qa'], row['qaclass'], row['clear'] = None, None, None, None
+        outrows.append(row)
+    return outrows
+
+def extract(points, products = ['SR', 'NDVI', 'EVI'], shapefile = None, startdate = None, enddate = None, maxcc = None, workers = None, blocklines = 256):
+    # Returns a list of dicts, one per point and scene, sorted by point ID and date
+    if not workers:
+        workers = os.cpu_count() or 1
+    scenes = loadfootprints(shapefile = shapefile, startdate = startdate, enddate = enddate, maxcc = maxcc)
+    assignments = assignpoints(points, scenes)
+    print('{} points fall within {} scenes.'.format(len(points), len(assignments)))
+    results = []
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = {executor.submit(extractscene, scene, points, indices, products, blocklines): scene['sceneID'] for scene, indices in assignments}
+        for i, future in enumerate(as_completed(futures), start = 1):
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                print('Error extracting points from {}: {}'.format(futures[future], e))
+                ieo.logerror(futures[future], e)
+            if i % 100 == 0:
+                print('{} of {} scenes processed.'.format(i, len(futures)))
+    results.sort(key = lambda row: (str(row['pointid']), row['date'], row['sceneID']))
+    return results
+
+def writecsv(results, outfile):
+    fieldnames = ['pointid', 'x', 'y', 'sceneID', 'date', 'landsat']
+    for row in results:
+        for key in row.keys():
+            if not key in fieldnames and not key in ['masktype', 'qa', 'qaclass', 'clear']:
+                fieldnames.append(key)
+    fieldnames.extend(['masktype', 'qa', 'qaclass', 'clear'])
+    with open(outfile, 'w', newline = '') as output:
+        writer = csv.DictWriter(output, fieldnames = fieldnames, restval = '')
+        writer.writeheader()
+        for row in results:
+            writer.writerow(row)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script extracts pixel time series for sample points from the ingested library.')
+    parser.add_argument('pointfile', type = str, help = 'Point vector file.')
+    parser.add_argument('-o', '--outfile', type = str, required = True, help = 'Output CSV file.')
+    parser.add_argument('--idfield', type = str, default = None, help = 'Point ID field. If not set, feature IDs are used.')
+    parser.add_argument('--products', type = str, default = 'SR,NDVI,EVI', help = 'Comma-delimited products: SR, BT, NDVI, EVI (default = SR,NDVI,EVI).')
+    parser.add_argument('--shapefile', type = str, default = ieo.landsatshp, help = 'Scene footprint shapefile (default = ieo.landsatshp).')
+    parser.add_argument('--startdate', type = str, default = None, help = 'Starting date, YYYY/MM/DD')
+    parser.add_argument('--enddate', type = str, default = None, help = 'Ending date, YYYY/MM/DD')
+    parser.add_argument('--maxcc', type = float, default = None, help = 'Maximum scene cloud cover in percent.')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count(), help = 'Number of scenes read in parallel (default = number of CPU cores).')
+    parser.add_argument('--blocklines', type = int, default = 256, help = 'Maximum number of lines per read window.')
+    args = parser.parse_args()
+
+    starttime = time.time()
+    startdate, enddate = None, None
+    if args.startdate:
+        startdate = datetime.datetime.strptime(args.startdate, '%Y/%m/%d').date()
+    if args.enddate:
+        enddate = datetime.datetime.strptime(args.enddate, '%Y/%m/%d').date()
+    products = [x.strip().upper() for x in args.products.split(',')]
+    for product in products:
+        if not product in productfields.keys():
+            print('Error: unknown product {}. Exiting.'.format(product))
+            sys.exit()
+
+    points = loadpoints(args.pointfile, idfield = args.idfield)
+    print('{} points loaded from: {}'.format(len(points), args.pointfile))
+    results = extract(points, products = products, shapefile = args.shapefile, startdate = startdate, enddate = enddate, maxcc = args.maxcc, workers = max(args.workers or 1, 1), blocklines = args.blocklines)
+    writecsv(results, args.outfile)
+    print('{} rows written to {} in {:0.1f} s.'.format(len(results), args.outfile, time.time() - starttime))
+
+    print('Processing complete.')
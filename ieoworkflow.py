@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script runs the Landsat library workflow in a single process: updating the scene shapefile
+# from the USGS (updateshp.py), creating ESPA processing lists (MakeESPAproclist.py), ingesting
+# ESPA-processed scenes (newespaimport.py), and creating VRTs (makevrts.py). IEO, GDAL, and the
+# tools are imported once, and WRS-2 Paths/ Rows, shapefile attributes, and the VRT catalog are
+# loaded once and reused by every stage. With --interval, the workflow is repeated in the same
+# process, and the shapefile is only re-read by the later stages after it has been modified.
+
+import os, sys, argparse, time, datetime
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+from vrtcatalog import VRTCatalog
+import updateshp, MakeESPAproclist, newespaimport, makevrts
+
+stages = ['update', 'proclist', 'ingest', 'vrt']
+
+def getparser():
+    parser = argparse.ArgumentParser('This script runs the shapefile update, ESPA processing list, ingest, and VRT tools in a single process.')
+    parser.add_argument('--stages', type = str, default = ','.join(stages), help = 'Comma-delimited stages to run, in order: {} (default = all).'.format(', '.join(stages)))
+    parser.add_argument('-u','--username', type = str, default = None, help = 'USGS/EROS Registration System (ERS) username.')
+    parser.add_argument('-p', '--password', type = str, default = None, help = 'USGS/EROS Registration System (ERS) password.')
+    parser.add_argument('--startdate', type = str, default = None, help = 'Start date for the shapefile update and processing lists in YYYY-MM-DD format.')
+    parser.add_argument('--aoi', type = str, default = None, help = 'Area of interest vector file, used for the processing lists and ingest.')
+    parser.add_argument('--workers', type = int, default = 1, help = 'Number of scene import workers.')
+    parser.add_argument('--vrtworkers', type = int, default = os.cpu_count(), help = 'Number of VRTs built in parallel (default = number of CPU cores).')
+    parser.add_argument('--catalog', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'vrt_catalog.sqlite'), help = 'VRT catalog database.')
+    parser.add_argument('--interval', type = float, default = None, help = 'Repeat the workflow every this many hours in the same process (default = run once).')
+    return parser
+
+def stageargs(module, argv, **kwargs):
+    # Returns the default arguments of a tool, as parsed by its own parser, updated with kwargs
+    stageargs = module.getparser().parse_args(argv)
+    for key in kwargs.keys():
+        if kwargs[key] is not None:
+            setattr(stageargs, key, kwargs[key])
+    return stageargs
+
+def runstage(name, func, *funcargs, **funckwargs):
+    # Runs one stage, logging rather than raising errors so that later stages still run
+    print('\nStarting stage: {}'.format(name))
+    starttime = time.time()
+    try:
+        result = func(*funcargs, **funckwargs)
+    except SystemExit:
+        print('Error: stage {} exited.'.format(name))
+        ieo.logerror(name, 'Stage exited.')
+        result = None
+    except Exception as e:
+        print('Error in stage {}: {}'.format(name, e))
+        ieo.logerror(name, e)
+        result = None
+    print('Stage {} finished in {:0.1f} s.'.format(name, time.time() - starttime))
+    return result
+
+def runworkflow(args, catalog):
+    # Runs the selected stages once, and returns a dict of stage: result
+    selected = [x.strip() for x in args.stages.split(',')]
+    results = {}
+    if 'update' in selected:
+        results['update'] = runstage('update', updateshp.run, stageargs(updateshp, [], username = args.username, password = args.password, startdate = args.startdate))
+        # Credentials entered at the prompt are kept for later runs
+        args.username, args.password = updateshp.args.username, updateshp.args.password
+    if 'proclist' in selected:
+        startdate = None
+        if args.startdate:
+            startdate = args.startdate.replace('-', '/')
+        results['proclist'] = runstage('proclist', MakeESPAproclist.run, stageargs(MakeESPAproclist, [], startdate = startdate, aoi = args.aoi))
+    if 'ingest' in selected:
+        results['ingest'] = runstage('ingest', newespaimport.run, stageargs(newespaimport, [], aoi = args.aoi, workers = args.workers))
+    if 'vrt' in selected:
+        # Only VRTs with new or modified members are rebuilt
+        results['vrt'] = runstage('vrt', makevrts.run, stageargs(makevrts, ['--incremental'], workers = args.vrtworkers), catalog = catalog)
+    return results
+
+def main(argv = None):
+    args = getparser().parse_args(argv)
+    for x in args.stages.split(','):
+        if not x.strip() in stages:
+            print('Error: unknown stage {}. Stages are: {}. Exiting.'.format(x, ', '.join(stages)))
+            sys.exit()
+    catalog = VRTCatalog(args.catalog)
+    try:
+        while True:
+            starttime = time.time()
+            print('Workflow started: {}'.format(datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')))
+            results = runworkflow(args, catalog)
+            for name in results.keys():
+                if isinstance(results[name], list):
+                    print('{}: {} items.'.format(name, len(results[name])))
+            print('Workflow finished in {:0.1f} s.'.format(time.time() - starttime))
+            if not args.interval:
+                break
+            seconds = max(args.interval * 3600.0 - (time.time() - starttime), 0.0)
+            print('Next run in {:0.1f} hours.'.format(seconds / 3600.0))
+            time.sleep(seconds)
+    finally:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
+    print('Processing complete.')
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module keeps a persistent SQLite ledger of ingested ESPA archives, so that
+# reruns of newespaimport.py can skip finished archives and resume partial scenes.
+
+import os, glob, datetime, hashlib, sqlite3, threading, tarfile
+
+# Products expected in the library for every ingested scene. 'mask' is satisfied by
+# either a Fmask or a pixel QA layer.
+products = ['ref', 'BT', 'mask', 'NDVI', 'EVI']
+
+def productdirs(ieo, outdir = None, btdir = None, fmaskdir = None, pixelqadir = None, ndvidir = None, evidir = None):
+    # This returns a dict of product: [(directory, file suffix), ...] for the local library
+    return {'ref' : [(outdir or ieo.srdir, '_ref_{}.dat'.format(ieo.projacronym))],
+            'BT' : [(btdir or ieo.btdir, '_BT_{}.dat'.format(ieo.projacronym))],
+            'mask' : [(pixelqadir or ieo.pixelqadir, '_pixel_qa.dat'), (fmaskdir or ieo.fmaskdir, '_cfmask.dat')],
+            'NDVI' : [(ndvidir or ieo.ndvidir, '_NDVI.dat')],
+            'EVI' : [(evidir or ieo.evidir, '_EVI.dat')]}
+
+def scenepatterns(sceneid):
+    # Ingested files may be named by the 16 character scene ID, its long form with a two digit
+    # Landsat number, or the 40 character product ID
+    patterns = ['{}*'.format(sceneid[:16]), '{}0{}{}{}*'.format(sceneid[:2], sceneid[2:3], sceneid[3:9], sceneid[9:16])]
+    try:
+        datestr = datetime.datetime.strptime(sceneid[9:16], '%Y%j').strftime('%Y%m%d')
+        patterns.append('{}0{}_*_{}_{}_*'.format(sceneid[:2], sceneid[2:3], sceneid[3:9], datestr))
+    except ValueError:
+        pass
+    return patterns
+
+def findproducts(sceneid, dirs):
+    # Returns a dict of product: filename for products of a scene present on disk
+    found = {}
+    for product in dirs.keys():
+        for dirname, ext in dirs[product]:
+            for pattern in scenepatterns(sceneid):
+                flist = glob.glob(os.path.join(dirname, '{}{}'.format(pattern, ext)))
+                if len(flist) > 0:
+                    found[product] = flist[0]
+                    break
+            if product in found.keys():
+                break
+    return found
+
+def md5sum(filename, blocksize = 2 ** 20):
+    # Chunked MD5 checksum, so that multi-GB archives are not read into memory
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def extractarchive(archive, outdir):
+    # Extracts a .tar.gz archive, refusing members that would be written outside outdir, as
+    # archives are downloaded from the network. The tarfile data filter is used where available.
+    with tarfile.open(archive) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(outdir, filter = 'data')
+            return
+        root = os.path.abspath(outdir)
+        for member in tar.getmembers():
+            target = os.path.abspath(os.path.join(root, member.name))
+            if os.path.isabs(member.name) or not target.startswith(root + os.sep) or not (member.isfile() or member.isdir()):
+                raise IOError('Refusing to extract {} from archive: {}'.format(member.name, archive))
+        tar.extractall(outdir)
+
+class IngestLedger(object):
+    # Archives are keyed by basename, so that moving the ingest directory does not invalidate
+    # the ledger. Size and modification time are used to detect a changed archive without
+    # re-reading it; the checksum is only computed when an archive is new or has changed.
+    # The connection is shared between ingest pipeline threads and serialised with a lock.
+    def __init__(self, dbfile):
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile, timeout = 60, check_same_thread = False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        with self.lock, self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS archives (
+                archive TEXT PRIMARY KEY,
+                path TEXT,
+                size INTEGER,
+                mtime REAL,
+                checksum TEXT,
+                sceneid TEXT,
+                status TEXT,
+                started TEXT,
+                finished TEXT,
+                seconds REAL)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS archives_sceneid ON archives (sceneid)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS products (
+                sceneid TEXT,
+                product TEXT,
+                path TEXT,
+                status TEXT,
+                updated TEXT,
+                PRIMARY KEY (sceneid, product))''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS clearstats (
+                scenebase TEXT PRIMARY KEY,
+                maskfile TEXT,
+                masktype TEXT,
+                clear REAL,
+                water REAL,
+                shadow REAL,
+                snow REAL,
+                cloud REAL,
+                pixels INTEGER,
+                updated TEXT)''')
+
+    def close(self):
+        self.conn.close()
+
+    def getarchive(self, filename):
+        with self.lock:
+            return self.conn.execute('SELECT * FROM archives WHERE archive = ?', (os.path.basename(filename),)).fetchone()
+
+    def unchanged(self, filename, row = None):
+        # True if the archive on disk matches the ledger record by size and modification time
+        if not row:
+            row = self.getarchive(filename)
+        if not row or not os.path.isfile(filename):
+            return False
+        stat = os.stat(filename)
+        return row['size'] == stat.st_size and row['mtime'] == stat.st_mtime
+
+    def isfinished(self, filename):
+        # Single primary key lookup and stat, used to skip finished archives
+        row = self.getarchive(filename)
+        return bool(row) and row['status'] == 'complete' and self.unchanged(filename, row)
+
+    def registerarchive(self, filename, sceneid):
+        row = self.getarchive(filename)
+        if row and self.unchanged(filename, row):
+            return row['checksum']
+        print('Calculating checksum for archive: {}'.format(os.path.basename(filename)))
+        stat = os.stat(filename)
+        checksum = md5sum(filename)
+        with self.lock, self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO archives (archive, path, size, mtime, checksum, sceneid, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''', (os.path.basename(filename), filename, stat.st_size, stat.st_mtime, checksum, sceneid, 'pending'))
+        return checksum
+
+    def startarchive(self, filename):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE archives SET status = ?, started = ?, finished = NULL, seconds = NULL WHERE archive = ?', ('running', datetime.datetime.now().isoformat(), os.path.basename(filename)))
+
+    def finisharchive(self, filename, status, seconds = None):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE archives SET status = ?, finished = ?, seconds = ? WHERE archive = ?', (status, datetime.datetime.now().isoformat(), seconds, os.path.basename(filename)))
+
+    def setproducts(self, sceneid, found):
+        # Records the completion state of every product of a scene in one transaction. Products are
+        # made together by ieo.importespa(), so import times are only recorded per archive.
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.conn:
+            for product in products:
+                if product in found.keys():
+                    self.conn.execute('''INSERT INTO products (sceneid, product, path, status, updated) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (sceneid, product) DO UPDATE SET path = excluded.path, status = excluded.status, updated = excluded.updated''', (sceneid, product, found[product], 'complete', now))
+                else:
+                    self.conn.execute('''INSERT INTO products (sceneid, product, path, status, updated) VALUES (?, ?, NULL, ?, ?)
+                        ON CONFLICT (sceneid, product) DO UPDATE SET path = NULL, status = excluded.status, updated = excluded.updated''', (sceneid, product, 'missing', now))
+
+    def missingproducts(self, sceneid):
+        with self.lock:
+            rows = self.conn.execute('SELECT product FROM products WHERE sceneid = ? AND status = ?', (sceneid, 'complete')).fetchall()
+        done = [row['product'] for row in rows]
+        return [product for product in products if not product in done]
+
+    def sceneprogress(self, sceneid):
+        with self.lock:
+            rows = self.conn.execute('SELECT product, status FROM products WHERE sceneid = ?', (sceneid,)).fetchall()
+        return {row['product'] : row['status'] for row in rows}
+
+    def setclearstats(self, scenebase, maskfile, masktype, fractions, pixels):
+        # scenebase is the mask file name without its product suffix, fractions a dict of class: fraction
+        with self.lock, self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO clearstats (scenebase, maskfile, masktype, clear, water, shadow, snow, cloud, pixels, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (scenebase, maskfile, masktype, fractions['clear'], fractions['water'], fractions['shadow'],
+                fractions['snow'], fractions['cloud'], pixels, datetime.datetime.now().isoformat()))
+
+    def getclearstats(self, scenebases = None):
+        # Returns a dict of scenebase: row for the given scenes, or for all scenes
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM clearstats').fetchall()
+        if scenebases is not None:
+            scenebases = set(scenebases)
+            rows = [row for row in rows if row['scenebase'] in scenebases]
+        return {row['scenebase'] : row for row in rows}
+
+    def ingestedscenes(self):
+        # Returns the set of 16 character scene IDs of completely ingested archives
+        with self.lock:
+            rows = self.conn.execute('SELECT DISTINCT sceneid FROM archives WHERE status = ?', ('complete',)).fetchall()
+        return set(row['sceneid'][:16] for row in rows if row['sceneid'])
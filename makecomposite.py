@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script creates cloud-free surface reflectance composites from the ingested library for a
+# date range, e.g. seasonal medians or best available pixel composites. Input scenes are selected
+# by date and WRS-2 Path from the SR directory, so that scenes on dates without a VRT mosaic and
+# scenes ingested since makevrts.py was last run are included, and masked to clear land with their
+# Fmask or pixel QA layers. The output grid is processed in tiles spread across processes, and only
+# the windows of scenes overlapping each tile are read, so memory use is bounded by tile size. Mean,
+# max-NDVI, and best pixel composites are accumulated scene by scene; median composites are
+# calculated in strips of lines sized so that the windows of all overlapping scenes fit in a fixed
+# memory budget.
+#
+# Output is an ENVI file with blue, green, red, NIR, SWIR1, and SWIR2 bands, plus a band with the
+# number of clear observations.
+
+import os, sys, glob, argparse, datetime, time, warnings
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from osgeo import gdal
+import enviheader, envireader, vegindex, clearstats, qadecode
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+bandnames = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+methods = ['median', 'mean', 'maxndvi', 'bestpixel']
+
+def scenedict(srfile, d):
+    # Returns the information on a scene needed by the tile workers. d is a datetime.date.
+    basename = os.path.basename(srfile)
+    scenebase = basename[:basename.find('_ref_')]
+    maskfile = vegindex.findmask(scenebase, ieo.pixelqadir, ieo.fmaskdir)
+    if not maskfile:
+        return None
+    header = enviheader.readheader(srfile)
+    xsize, ysize, bands = enviheader.rastersize(header)
+    landsat = vegindex.landsatnumber(srfile)
+    if landsat == 8:
+        numbers = vegindex.bandnumbers['L8']
+    else:
+        numbers = vegindex.bandnumbers['L47']
+    return {'srfile': srfile, 'maskfile': maskfile, 'masktype': vegindex.masktypefromfilename(maskfile), 'landsat': landsat,
+            'bands': [numbers[name] for name in bandnames], 'date': d.toordinal(),
+            'geotransform': enviheader.geotransform(header), 'xsize': xsize, 'ysize': ysize}
+
+def libraryscenes(startdate, enddate, path = None):
+    # Selects SR scenes from the SR directory
+    scenes = []
+    for srfile in glob.glob(os.path.join(ieo.srdir, 'L*_ref_{}.dat'.format(ieo.projacronym))):
+        basename = os.path.basename(srfile)
+        if len(basename) > 40:
+            p, datestr = basename[4:7], basename[10:17]
+        else:
+            p, datestr = basename[3:6], basename[9:16]
+        d = datetime.datetime.strptime(datestr, '%Y%j').date()
+        if d < startdate or d > enddate or (path and int(p) != path):
+            continue
+        scenes.append([srfile, d])
+    return scenes
+
+def readwindow(filename, bands, scenegt, sxsize, sysize, geotrans, x0, y0, xsize, ysize, fill, dtype):
+    # Reads a window of the output grid from a scene, filling areas outside the scene
+    out = np.full((len(bands), ysize, xsize), fill, dtype = dtype)
+    xoff = int(round((scenegt[0] - geotrans[0]) / geotrans[1])) - x0
+    yoff = int(round((geotrans[3] - scenegt[3]) / -geotrans[5])) - y0
+    cx0, cx1 = max(xoff, 0), min(xoff + sxsize, xsize)
+    cy0, cy1 = max(yoff, 0), min(yoff + sysize, ysize)
+    if cx1 <= cx0 or cy1 <= cy0:
+        return out
+    # Windows are copied straight from the memory-mapped file, with GDAL as a fallback for files
+    # the ENVI reader does not support
+    try:
+        data = envireader.openbands(filename)
+        for i, band in enumerate(bands):
+            out[i, cy0:cy1, cx0:cx1] = data[band - 1, cy0 - yoff:cy1 - yoff, cx0 - xoff:cx1 - xoff]
+        return out
+    except (IOError, ValueError, KeyError):
+        pass
+    ds = gdal.Open(filename)
+    if not ds:
+        raise IOError('Unable to open: {}'.format(filename))
+    for i, band in enumerate(bands):
+        out[i, cy0:cy1, cx0:cx1] = ds.GetRasterBand(band).ReadAsArray(cx0 - xoff, cy0 - yoff, cx1 - cx0, cy1 - cy0)
+    ds = None
+    return out
+
+def readscene(scene, geotrans, x0, y0, xsize, ysize):
+    # Returns [clear land array, SR array] of a window of one scene, or None if it has no clear land
+    if scene['masktype'] == 'pixel_qa':
+        maskfill = 1
+    else:
+        maskfill = 255
+    mask = readwindow(scene['maskfile'], [1], scene['geotransform'], scene['xsize'], scene['ysize'], geotrans, x0, y0, xsize, ysize, maskfill, np.uint16)[0]
+    clear = qadecode.clearland(mask, scene['masktype'], scene['landsat'])
+    if not clear.any():
+        return None
+    sr = readwindow(scene['srfile'], scene['bands'], scene['geotransform'], scene['xsize'], scene['ysize'], geotrans, x0, y0, xsize, ysize, vegindex.srnodata, np.int16)
+    clear &= (sr != vegindex.srnodata).all(axis = 0)
+    return clear, sr
+
+def medianstrip(scenes, geotrans, x0, y0, xsize, ysize):
+    # Returns the median composite and clear count of a strip, holding one window per scene
+    count = np.zeros((ysize, xsize), dtype = np.int16)
+    stack = []
+    for scene in scenes:
+        window = readscene(scene, geotrans, x0, y0, xsize, ysize)
+        if window:
+            clear, sr = window
+            count += clear
+            stack.append(np.where(clear, sr, np.nan).astype(np.float32))
+    if len(stack) == 0:
+        return np.full((len(bandnames), ysize, xsize), vegindex.srnodata, dtype = np.int16), count
+    with warnings.catch_warnings(): # All-NaN pixels are expected where no clear observations exist
+        warnings.simplefilter('ignore', category = RuntimeWarning)
+        result = np.nanmedian(np.stack(stack), axis = 0)
+    return np.where(np.isfinite(result), np.round(result), vegindex.srnodata).astype(np.int16), count
+
+def compositetile(scenes, geotrans, x0, y0, xsize, ysize, method, targetdate, medianmem = 256):
+    # Returns [x0, y0, composite array of bands + clear count] for one tile. Median composites are
+    # calculated in strips of lines, so that the float32 windows of all scenes use at most medianmem
+    # MB (or a single line per scene).
+    numbands = len(bandnames)
+    if method == 'median':
+        lines = max(1, int(medianmem * 1048576 // max(len(scenes) * numbands * xsize * 4, 1)))
+        out = np.empty((numbands + 1, ysize, xsize), dtype = np.int16)
+        for yoff in range(0, ysize, lines):
+            strip, count = medianstrip(scenes, geotrans, x0, y0 + yoff, xsize, min(lines, ysize - yoff))
+            out[:numbands, yoff:yoff + strip.shape[1]] = strip
+            out[numbands, yoff:yoff + strip.shape[1]] = count
+        return [x0, y0, out]
+    count = np.zeros((ysize, xsize), dtype = np.int16)
+    if method == 'mean':
+        sums = np.zeros((numbands, ysize, xsize), dtype = np.float64)
+    else:
+        best = np.full((numbands, ysize, xsize), vegindex.srnodata, dtype = np.int16)
+        bestscore = np.full((ysize, xsize), -np.inf, dtype = np.float32)
+    for scene in scenes:
+        window = readscene(scene, geotrans, x0, y0, xsize, ysize)
+        if not window:
+            continue
+        clear, sr = window
+        count += clear
+        if method == 'mean':
+            sums += np.where(clear, sr, 0)
+        else:
+            if method == 'maxndvi':
+                red = sr[bandnames.index('red')].astype(np.float32)
+                nir = sr[bandnames.index('nir')].astype(np.float32)
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    score = (nir - red) / (nir + red)
+                score = np.where(clear & np.isfinite(score), score, -np.inf)
+            else: # bestpixel: the clear observation closest to the target date
+                score = np.where(clear, -abs(scene['date'] - targetdate), -np.inf).astype(np.float32)
+            better = score > bestscore
+            best = np.where(better, sr, best)
+            bestscore = np.where(better, score, bestscore)
+    if method == 'mean':
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            best = np.where(count > 0, np.round(sums / count), vegindex.srnodata).astype(np.int16)
+    return [x0, y0, np.concatenate([best, count[np.newaxis]])]
+
+def overlaps(scene, geotrans, x0, y0, xsize, ysize):
+    gt = scene['geotransform']
+    minx, maxy = geotrans[0] + x0 * geotrans[1], geotrans[3] + y0 * geotrans[5]
+    maxx, miny = minx + xsize * geotrans[1], maxy + ysize * geotrans[5]
+    return gt[0] < maxx and gt[0] + scene['xsize'] * gt[1] > minx and gt[3] > miny and gt[3] + scene['ysize'] * gt[5] < maxy
+
+def createoutput(outfile, xsize, ysize, geotrans, method, startdate, enddate):
+    driver = gdal.GetDriverByName('ENVI')
+    if os.path.isfile(outfile):
+        driver.Delete(outfile)
+    ds = driver.Create(outfile, xsize, ysize, len(bandnames) + 1, gdal.GDT_Int16)
+    ds.SetGeoTransform(geotrans)
+    ds.SetProjection(ieo.prj.ExportToWkt())
+    for i, name in enumerate(bandnames, start = 1):
+        band = ds.GetRasterBand(i)
+        band.SetNoDataValue(vegindex.srnodata)
+        band.SetDescription('{} {} {} to {}'.format(name, method, startdate, enddate))
+    ds.GetRasterBand(len(bandnames) + 1).SetDescription('Clear observations')
+    return ds
+
+def makecomposite(scenes, outfile, method, startdate, enddate, targetdate = None, extent = None, tilesize = 256, workers = None, medianmem = 256):
+    # scenes is a list of scene dicts from scenedict(). extent is [minX, minY, maxX, maxY]; if not
+    # set, the union of the scenes is used.
+    if not workers:
+        workers = os.cpu_count() or 1
+    if not targetdate:
+        targetdate = startdate + (enddate - startdate) // 2
+    if not extent:
+        extent = [min(s['geotransform'][0] for s in scenes), min(s['geotransform'][3] + s['ysize'] * s['geotransform'][5] for s in scenes),
+                  max(s['geotransform'][0] + s['xsize'] * s['geotransform'][1] for s in scenes), max(s['geotransform'][3] for s in scenes)]
+    pixelsize = scenes[0]['geotransform'][1]
+    geotrans = [extent[0], pixelsize, 0.0, extent[3], 0.0, -pixelsize]
+    xsize = int(round((extent[2] - extent[0]) / pixelsize))
+    ysize = int(round((extent[3] - extent[1]) / pixelsize))
+    print('Creating {} x {} pixel {} composite from {} scenes: {}'.format(xsize, ysize, method, len(scenes), outfile))
+    starttime = time.time()
+    ds = createoutput(outfile, xsize, ysize, geotrans, method, startdate, enddate)
+    tiles = [[x0, y0, min(tilesize, xsize - x0), min(tilesize, ysize - y0)] for y0 in range(0, ysize, tilesize) for x0 in range(0, xsize, tilesize)]
+
+    def writetile(x0, y0, data):
+        for i in range(data.shape[0]):
+            ds.GetRasterBand(i + 1).WriteArray(data[i], x0, y0)
+
+    # Tiles are written by the main process as they complete, with at most twice as many tiles in
+    # flight as there are workers
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = set()
+        for i, tile in enumerate(tiles, start = 1):
+            x0, y0, tx, ty = tile
+            tilescenes = [s for s in scenes if overlaps(s, geotrans, x0, y0, tx, ty)]
+            pending.add(executor.submit(compositetile, tilescenes, geotrans, x0, y0, tx, ty, method, targetdate.toordinal(), medianmem))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    writetile(*future.result())
+            if i % 100 == 0:
+                print('{} of {} tiles submitted.'.format(i, len(tiles)))
+        for future in pending:
+            writetile(*future.result())
+    ds.FlushCache()
+    ds = None
+    print('Composite written in {:0.1f} s.'.format(time.time() - starttime))
+    return outfile
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script creates cloud-free surface reflectance composites from the ingested library.')
+    parser.add_argument('-o', '--outfile', type = str, required = True, help = 'Output ENVI file.')
+    parser.add_argument('--startdate', type = str, required = True, help = 'Starting date, YYYY/MM/DD')
+    parser.add_argument('--enddate', type = str, required = True, help = 'Ending date, YYYY/MM/DD')
+    parser.add_argument('-m', '--method', type = str, default = 'median', choices = methods, help = 'Composite method (default = median).')
+    parser.add_argument('--targetdate', type = str, default = None, help = 'Target date for best pixel composites, YYYY/MM/DD (default = middle of the date range).')
+    parser.add_argument('--path', type = int, default = None, help = 'Use only scenes from this WRS-2 Path.')
+    parser.add_argument('--extent', type = str, default = None, help = 'Output extent in the local projection: minX,minY,maxX,maxY (default = union of scenes).')
+    parser.add_argument('--minclear', type = float, default = None, help = 'Minimum clear land percentage of scenes, from the clear statistics in the scene shapefile (see clearstats.py).')
+    parser.add_argument('--shp', type = str, default = ieo.landsatshp, help = 'Scene footprint shapefile holding clear statistics (default = ieo.landsatshp).')
+    parser.add_argument('--tilesize', type = int, default = 256, help = 'Tile size in pixels. Memory use scales with this value.')
+    parser.add_argument('--medianmem', type = int, default = 256, help = 'Memory in MB for the scene windows of each median tile. Tiles with many scenes are processed in strips of lines (default = 256).')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count(), help = 'Number of tiles processed in parallel (default = number of CPU cores).')
+    args = parser.parse_args()
+
+    startdate = datetime.datetime.strptime(args.startdate, '%Y/%m/%d').date()
+    enddate = datetime.datetime.strptime(args.enddate, '%Y/%m/%d').date()
+    targetdate = None
+    if args.targetdate:
+        targetdate = datetime.datetime.strptime(args.targetdate, '%Y/%m/%d').date()
+    extent = None
+    if args.extent:
+        extent = [float(x) for x in args.extent.split(',')]
+
+    flist = libraryscenes(startdate, enddate, path = args.path)
+    if args.minclear is not None:
+        # Scenes are filtered using the attribute table only. Scenes without statistics are kept.
+        clear = clearstats.clearfractions(args.shp)
+        numfiles = len(flist)
+        keep = []
+        for srfile, d in flist:
+            basename = os.path.basename(srfile)
+            value = clearstats.lookupclear(clear, basename[:basename.find('_ref_')])
+            if value is None or value >= args.minclear:
+                keep.append([srfile, d])
+        flist = keep
+        print('{} of {} scenes have at least {:0.1f}% clear land.'.format(len(flist), numfiles, args.minclear))
+    scenes = []
+    for srfile, d in flist:
+        scene = scenedict(srfile, d)
+        if scene:
+            scenes.append(scene)
+        else:
+            print('Error: no Fmask or pixel QA layer found for {}, skipping.'.format(os.path.basename(srfile)))
+    if len(scenes) == 0:
+        print('No scenes found for {} to {}. Exiting.'.format(startdate, enddate))
+        sys.exit()
+
+    makecomposite(scenes, args.outfile, args.method, startdate, enddate, targetdate = targetdate, extent = extent, tilesize = args.tilesize, workers = max(args.workers or 1, 1), medianmem = args.medianmem)
+
+    print('Processing complete.')
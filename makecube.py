@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script converts ingested SR, NDVI, EVI, and QA products for a WRS-2 Path/Row or an area of
+# interest into a chunked, compressed HDF5 datacube with time x y x x chunks, so that time series
+# reads over a region touch a few chunks rather than hundreds of scene files. Each time step is one
+# scene, with the acquisition date and scene ID stored as coordinates. Scenes are read in parallel,
+# and the cube can be appended to as new scenes are ingested.
+#
+# SR bands are stored by name (blue, green, red, nir, swir1, swir2), so that Landsat 4-7 and 8 data
+# share the same datasets. Cube layout:
+#   /time (YYYY-MM-DD), /sceneid, /<product> datasets of shape [time, y, x]
+#   root attributes: geotransform, projection
+
+import os, sys, glob, argparse, datetime, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from osgeo import gdal, ogr, osr
+import enviheader, envireader
+
+try:
+    import h5py
+except ImportError:
+    print('Error: this script requires the h5py module. Exiting.')
+    sys.exit()
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+# SR stack band numbers by band name
+srbands = {'L8': {'blue': 2, 'green': 3, 'red': 4, 'nir': 5, 'swir1': 6, 'swir2': 7},
+           'L47': {'blue': 1, 'green': 2, 'red': 3, 'nir': 4, 'swir1': 5, 'swir2': 6}}
+
+def productinfo():
+    # Returns a dict of cube dataset: [directory, file suffix, band name or number, NumPy dtype, fill value]
+    info = {}
+    for name in ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']:
+        info['SR_{}'.format(name)] = [ieo.srdir, '_ref_{}.dat'.format(ieo.projacronym), name, 'i2', -9999]
+    info['NDVI'] = [ieo.ndvidir, '_NDVI.dat', 1, 'f4', 0]
+    info['EVI'] = [ieo.evidir, '_EVI.dat', 1, 'f4', 0]
+    info['pixel_qa'] = [ieo.pixelqadir, '_pixel_qa.dat', 1, 'u2', 1]
+    info['fmask'] = [ieo.fmaskdir, '_cfmask.dat', 1, 'u1', 255]
+    return info
+
+def parsescenebase(scenebase):
+    # Returns [Path/Row, date (YYYYDDD), Landsat number] for a scene or product ID based file name
+    if len(scenebase) >= 40:
+        return [scenebase[4:10], scenebase[10:17], int(scenebase[3:4])]
+    return [scenebase[3:9], scenebase[9:16], int(scenebase[2:3])]
+
+def findscenes(pathrow = None, extent = None, startdate = None, enddate = None):
+    # Finds ingested scenes by their SR files. extent is [minX, minY, maxX, maxY] in the local projection.
+    scenes = []
+    for srfile in glob.glob(os.path.join(ieo.srdir, 'L*_ref_{}.dat'.format(ieo.projacronym))):
+        basename = os.path.basename(srfile)
+        scenebase = basename[:basename.find('_ref_')]
+        pr, d, landsat = parsescenebase(scenebase)
+        if pathrow and pr != pathrow:
+            continue
+        if (startdate and d < startdate) or (enddate and d > enddate):
+            continue
+        header = enviheader.readheader(srfile)
+        if extent:
+            gt = enviheader.geotransform(header)
+            xsize, ysize, bands = enviheader.rastersize(header)
+            if gt[0] > extent[2] or gt[0] + xsize * gt[1] < extent[0] or gt[3] < extent[1] or gt[3] + ysize * gt[5] > extent[3]:
+                continue
+        scenes.append([d, scenebase, landsat])
+    scenes.sort()
+    return scenes
+
+def scenegrid(scenes):
+    # Union extent of the SR files of the scenes
+    extent = None
+    for d, scenebase, landsat in scenes:
+        srfile = os.path.join(ieo.srdir, '{}_ref_{}.dat'.format(scenebase, ieo.projacronym))
+        header = enviheader.readheader(srfile)
+        gt = enviheader.geotransform(header)
+        xsize, ysize, bands = enviheader.rastersize(header)
+        e = [gt[0], gt[3] + ysize * gt[5], gt[0] + xsize * gt[1], gt[3]]
+        if not extent:
+            extent = e
+        else:
+            extent = [min(extent[0], e[0]), min(extent[1], e[1]), max(extent[2], e[2]), max(extent[3], e[3])]
+    return extent
+
+def aoiextent(aoifile, pixelsize = 30.0):
+    # Bounding box of an AOI vector file in the local projection, snapped outwards to the pixel grid
+    data_source = ogr.Open(aoifile, 0)
+    layer = data_source.GetLayer()
+    srs = layer.GetSpatialRef()
+    minX, maxX, minY, maxY = layer.GetExtent()
+    if srs and not srs.IsSame(ieo.prj):
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in [[minX, minY], [minX, maxY], [maxX, maxY], [maxX, minY], [minX, minY]]:
+            ring.AddPoint(x, y)
+        poly = ogr.Geometry(ogr.wkbPolygon)
+        poly.AddGeometry(ring)
+        poly.Transform(osr.CoordinateTransformation(srs, ieo.prj))
+        minX, maxX, minY, maxY = poly.GetEnvelope()
+    data_source = None
+    return [np.floor(minX / pixelsize) * pixelsize, np.floor(minY / pixelsize) * pixelsize, np.ceil(maxX / pixelsize) * pixelsize, np.ceil(maxY / pixelsize) * pixelsize]
+
+def readwindow(filename, band, geotrans, xsize, y0, y1, dtype, fill):
+    # Reads rows y0:y1 of the cube grid from a scene file, filling areas outside the scene
+    out = np.full((y1 - y0, xsize), fill, dtype = dtype)
+    if not os.path.isfile(filename):
+        return out
+    header = enviheader.readheader(filename)
+    gt = enviheader.geotransform(header)
+    sxsize, sysize, bands = enviheader.rastersize(header)
+    xoff = int(round((gt[0] - geotrans[0]) / geotrans[1]))
+    yoff = int(round((geotrans[3] - gt[3]) / -geotrans[5]))
+    # Intersection of the scene with the requested rows, in cube coordinates
+    cx0, cx1 = max(xoff, 0), min(xoff + sxsize, xsize)
+    cy0, cy1 = max(yoff, y0), min(yoff + sysize, y1)
+    if cx1 <= cx0 or cy1 <= cy0:
+        return out
+    try:
+        out[cy0 - y0:cy1 - y0, cx0:cx1] = envireader.band(filename, band)[cy0 - yoff:cy1 - yoff, cx0 - xoff:cx1 - xoff]
+        return out
+    except (IOError, ValueError, KeyError):
+        pass
+    ds = gdal.Open(filename)
+    data = ds.GetRasterBand(band).ReadAsArray(cx0 - xoff, cy0 - yoff, cx1 - cx0, cy1 - cy0)
+    ds = None
+    out[cy0 - y0:cy1 - y0, cx0:cx1] = data
+    return out
+
+def createcube(outfile, geotrans, xsize, ysize, chunks, compression, datasets):
+    cube = h5py.File(outfile, 'w')
+    cube.attrs['geotransform'] = geotrans
+    cube.attrs['projection'] = ieo.prj.ExportToWkt()
+    cube.create_dataset('time', shape = (0,), maxshape = (None,), dtype = 'S10', chunks = (1024,))
+    cube.create_dataset('sceneid', shape = (0,), maxshape = (None,), dtype = 'S40', chunks = (1024,))
+    for name in datasets.keys():
+        dtype, fill = datasets[name][3], datasets[name][4]
+        cube.create_dataset(name, shape = (0, ysize, xsize), maxshape = (None, ysize, xsize), dtype = dtype,
+                            chunks = (chunks[0], min(chunks[1], ysize), min(chunks[2], xsize)), compression = compression,
+                            shuffle = True, fillvalue = fill)
+    return cube
+
+def sorttime(cube, datasets, chunks):
+    # Reorders the time steps from the first one out of date order, e.g. after scenes older than the
+    # last in the cube have been appended. Data are moved in windows of one chunk in y and x, so that
+    # memory is bounded by the number of time steps moved. Returns the number of time steps moved.
+    times = cube['time'][:]
+    sceneids = cube['sceneid'][:]
+    order = sorted(range(len(times)), key = lambda i: (times[i], sceneids[i]))
+    t0 = 0
+    while t0 < len(order) and order[t0] == t0:
+        t0 += 1
+    if t0 == len(order):
+        return 0
+    moved = np.array(order[t0:]) - t0
+    cube['time'][t0:] = times[t0:][moved]
+    cube['sceneid'][t0:] = sceneids[t0:][moved]
+    for name in datasets.keys():
+        ysize, xsize = cube[name].shape[1:]
+        for y0 in range(0, ysize, chunks[1]):
+            for x0 in range(0, xsize, chunks[2]):
+                window = (slice(t0, None), slice(y0, min(y0 + chunks[1], ysize)), slice(x0, min(x0 + chunks[2], xsize)))
+                cube[name][window] = cube[name][window][moved]
+    return len(moved)
+
+def appendscenes(cube, scenes, datasets, workers, chunks):
+    # Appends scenes in batches of the time chunk size. Each batch is read in blocks of chunk
+    # rows, so that every chunk is written once and memory is bounded by the block size. Scenes
+    # older than those already in the cube are then sorted into place.
+    scenes = sorted(scenes)
+    geotrans = list(cube.attrs['geotransform'])
+    t0 = cube['time'].shape[0]
+    ysize, xsize = cube[list(datasets.keys())[0]].shape[1:]
+    newsize = t0 + len(scenes)
+    for name in ['time', 'sceneid'] + list(datasets.keys()):
+        cube[name].resize(newsize, axis = 0)
+    cube['time'][t0:] = [datetime.datetime.strptime(d, '%Y%j').strftime('%Y-%m-%d').encode() for d, scenebase, landsat in scenes]
+    cube['sceneid'][t0:] = [scenebase[:40].encode() for d, scenebase, landsat in scenes]
+
+    def readscene(scene, name, y0, y1):
+        d, scenebase, landsat = scene
+        dirname, suffix, band, dtype, fill = datasets[name]
+        if isinstance(band, str):
+            if landsat == 8:
+                band = srbands['L8'][band]
+            else:
+                band = srbands['L47'][band]
+        return readwindow(os.path.join(dirname, '{}{}'.format(scenebase, suffix)), band, geotrans, xsize, y0, y1, dtype, fill)
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        for b0 in range(0, len(scenes), chunks[0]):
+            batch = scenes[b0:b0 + chunks[0]]
+            starttime = time.time()
+            for y0 in range(0, ysize, chunks[1]):
+                y1 = min(y0 + chunks[1], ysize)
+                for name in datasets.keys():
+                    blocks = list(executor.map(lambda scene: readscene(scene, name, y0, y1), batch))
+                    cube[name][t0 + b0:t0 + b0 + len(batch), y0:y1, :] = np.stack(blocks)
+            print('Added scenes {} to {} of {} in {:0.1f} s.'.format(b0 + 1, b0 + len(batch), len(scenes), time.time() - starttime))
+    if t0 > 0:
+        starttime = time.time()
+        moved = sorttime(cube, datasets, chunks)
+        if moved > 0:
+            print('Sorted {} time steps into date order in {:0.1f} s.'.format(moved, time.time() - starttime))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script builds a chunked HDF5 datacube from ingested Landsat products.')
+    parser.add_argument('-o', '--outfile', type = str, required = True, help = 'Output HDF5 file. If it exists, new scenes will be appended.')
+    parser.add_argument('--pathrow', type = str, default = None, help = 'WRS-2 Path/Row in PPPRRR format, e.g. 207023.')
+    parser.add_argument('--aoi', type = str, default = None, help = 'Area of interest vector file. The cube covers its bounding box.')
+    parser.add_argument('--products', type = str, default = 'SR,NDVI,EVI,QA', help = 'Comma-delimited products: SR, NDVI, EVI, QA (default = all).')
+    parser.add_argument('--startdate', type = str, default = None, help = 'Starting date, YYYY/MM/DD')
+    parser.add_argument('--enddate', type = str, default = None, help = 'Ending date, YYYY/MM/DD')
+    parser.add_argument('--chunks', type = str, default = '16,256,256', help = 'Chunk size as time,y,x (default = 16,256,256).')
+    parser.add_argument('--compression', type = str, default = 'gzip', help = 'HDF5 compression filter (default = gzip).')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count(), help = 'Number of scenes read in parallel (default = number of CPU cores).')
+    args = parser.parse_args()
+
+    if not (args.pathrow or args.aoi):
+        print('Error: either --pathrow or --aoi must be set. Exiting.')
+        sys.exit()
+    chunks = [int(x) for x in args.chunks.split(',')]
+    startdate, enddate = None, None
+    if args.startdate:
+        startdate = datetime.datetime.strptime(args.startdate, '%Y/%m/%d').strftime('%Y%j')
+    if args.enddate:
+        enddate = datetime.datetime.strptime(args.enddate, '%Y/%m/%d').strftime('%Y%j')
+
+    info = productinfo()
+    datasets = {}
+    for product in args.products.upper().split(','):
+        if product == 'QA':
+            names = ['pixel_qa', 'fmask']
+        else:
+            names = [name for name in info.keys() if name == product or name.startswith('{}_'.format(product))]
+        for name in names:
+            datasets[name] = info[name]
+
+    extent = None
+    if args.aoi:
+        extent = aoiextent(args.aoi)
+    scenes = findscenes(pathrow = args.pathrow, extent = extent, startdate = startdate, enddate = enddate)
+    if len(scenes) == 0:
+        print('No scenes found. Exiting.')
+        sys.exit()
+
+    if os.path.isfile(args.outfile):
+        cube = h5py.File(args.outfile, 'a')
+        existing = set(x.decode() for x in cube['sceneid'][:])
+        scenes = [scene for scene in scenes if not scene[1][:40] in existing]
+        print('Appending {} new scenes to: {}'.format(len(scenes), args.outfile))
+    else:
+        if not extent:
+            extent = scenegrid(scenes)
+        geotrans = [extent[0], 30.0, 0.0, extent[3], 0.0, -30.0]
+        xsize = int(round((extent[2] - extent[0]) / 30.0))
+        ysize = int(round((extent[3] - extent[1]) / 30.0))
+        print('Creating {} x {} pixel datacube with {} scenes: {}'.format(xsize, ysize, len(scenes), args.outfile))
+        cube = createcube(args.outfile, geotrans, xsize, ysize, chunks, args.compression, datasets)
+    if len(scenes) > 0:
+        appendscenes(cube, scenes, {name: datasets[name] for name in datasets.keys() if name in cube.keys()}, max(args.workers or 1, 1), chunks)
+    cube.close()
+
+    print('Processing complete.')
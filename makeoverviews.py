@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script builds overview pyramids for ingested Landsat products and their VRT mosaics, in
+# parallel across files. ENVI files and VRTs cannot hold internal overviews, so these are written
+# as external .ovr files. Scene overviews are built first, so that VRT overviews can be computed
+# from them rather than from the full resolution members. Files whose overviews are newer than the
+# file (and, for VRTs, all of its members) are skipped.
+
+import os, sys, glob, argparse, time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from osgeo import gdal
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+def defaultresampling():
+    # Categorical layers use nearest neighbour resampling, continuous ones are averaged
+    return {ieo.srdir: 'AVERAGE', ieo.btdir: 'AVERAGE', ieo.ndvidir: 'AVERAGE', ieo.evidir: 'AVERAGE', ieo.fmaskdir: 'NEAREST', ieo.pixelqadir: 'NEAREST'}
+
+def vrtmembers(vrt):
+    # Returns the source files of a VRT
+    members = []
+    for element in ET.parse(vrt).getroot().iter('SourceFilename'):
+        filename = element.text
+        if element.get('relativeToVRT') == '1':
+            filename = os.path.join(os.path.dirname(vrt), filename)
+        if not filename in members:
+            members.append(filename)
+    return members
+
+def overviewscurrent(f):
+    ovr = '{}.ovr'.format(f)
+    if not os.path.isfile(ovr):
+        return False
+    inputs = [f]
+    if f.endswith('.vrt'):
+        inputs.extend([x for x in vrtmembers(f) if os.path.isfile(x)])
+    return os.path.getmtime(ovr) >= max(os.path.getmtime(x) for x in inputs)
+
+def buildoverviews(f, resampling, levels, compress = None):
+    # Builds external overviews for one file. Returns [file, seconds].
+    starttime = time.time()
+    if compress:
+        gdal.SetConfigOption('COMPRESS_OVERVIEW', compress)
+    ovr = '{}.ovr'.format(f)
+    if os.path.isfile(ovr):
+        os.remove(ovr)
+    ds = gdal.Open(f, gdal.GA_ReadOnly) # Opening read-only creates external overviews
+    if not ds:
+        raise IOError('Unable to open: {}'.format(f))
+    ds.BuildOverviews(resampling, levels)
+    ds = None
+    return [f, time.time() - starttime]
+
+def findfiles(dirname, year = None, vrts = False):
+    if vrts:
+        dirname = os.path.join(dirname, 'vrt')
+        ext = '.vrt'
+    else:
+        ext = '.dat'
+    if year:
+        return sorted(glob.glob(os.path.join(dirname, 'L*{}*{}'.format(year, ext))))
+    return sorted(glob.glob(os.path.join(dirname, 'L*{}'.format(ext))))
+
+def runbatch(files, levels, workers, compress, overwrite):
+    # files is a list of [file name, resampling method]
+    tasks = []
+    for f, resampling in files:
+        if overwrite or not overviewscurrent(f):
+            tasks.append([f, resampling])
+    print('Building overviews for {} of {} files.'.format(len(tasks), len(files)))
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {executor.submit(buildoverviews, f, resampling, levels, compress): f for f, resampling in tasks}
+        for i, future in enumerate(as_completed(futures), start = 1):
+            try:
+                f, seconds = future.result()
+                print('Overviews built for {} in {:0.1f} s, file {} of {}.'.format(os.path.basename(f), seconds, i, len(tasks)))
+            except Exception as e:
+                print('Error building overviews for {}: {}'.format(futures[future], e))
+                ieo.logerror(futures[future], e)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script builds overview pyramids for ingested Landsat products and VRTs.')
+    parser.add_argument('-i', '--indir', type = str, default = None, help = 'Input directory. If not set, all product directories will be processed.')
+    parser.add_argument('-r', '--resampling', type = str, default = None, help = 'Resampling method. If not set, NEAREST is used for Fmask and pixel QA, and AVERAGE for other products.')
+    parser.add_argument('-l', '--levels', type = str, default = '2,4,8,16,32', help = 'Comma-delimited overview levels (default = 2,4,8,16,32).')
+    parser.add_argument('-y', '--year', type = int, default = None, help = 'Process files only for a specific year.')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count(), help = 'Number of files processed in parallel (default = number of CPU cores).')
+    parser.add_argument('--compress', type = str, default = 'DEFLATE', help = 'Overview compression (default = DEFLATE).')
+    parser.add_argument('--noscenes', action = 'store_true', help = 'Do not build overviews for scene files.')
+    parser.add_argument('--novrts', action = 'store_true', help = 'Do not build overviews for VRTs.')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'Rebuild overviews even if they are current.')
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(',')]
+    resamplingdict = defaultresampling()
+    if args.indir:
+        indirs = [args.indir]
+    else:
+        indirs = [ieo.srdir, ieo.fmaskdir, ieo.btdir, ieo.ndvidir, ieo.evidir, ieo.pixelqadir]
+
+    for vrts in [False, True]:
+        if (vrts and args.novrts) or (not vrts and args.noscenes):
+            continue
+        files = []
+        for indir in indirs:
+            resampling = args.resampling or resamplingdict.get(indir, 'AVERAGE')
+            files.extend([[f, resampling] for f in findfiles(indir, year = args.year, vrts = vrts)])
+        if vrts:
+            print('Processing VRTs.')
+        else:
+            print('Processing scenes.')
+        runbatch(files, levels, max(args.workers or 1, 1), args.compress, args.overwrite)
+
+    print('Processing complete.')
@@ -7,9 +7,11 @@
 
 # This script creates VRTs from ingested Landsat data and catalogue files
 
-import os, sys, glob, datetime, argparse#, ieo
-from subprocess import Popen
-from osgeo import ogr
+import os, sys, glob, datetime, argparse, json#, ieo
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from osgeo import ogr, gdal
+import vrtwriter, enviheader
+from vrtcatalog import VRTCatalog
 
 try: # This is included as the module may not properly install in Anaconda.
     import ieo
@@ -23,27 +25,40 @@ except:
         print('Error: that is not a valid path for the IEO module. Exiting.')
         sys.exit()
 
-parser = argparse.ArgumentParser('This script creates VRT files for Landsat data.')
+args = None # Set by run()
 
-parser.add_argument('-i', '--indir', type = str, default = None, help = 'Input directory. If this is set then --nodataval must also be set. Otherwise, default values will be used.')
-parser.add_argument('-o', '--outdir', type = str, default = None, help = 'Data output directory.')
-parser.add_argument('-y', '--year', type = int, default = None, help = 'Process secenes only for a specific year.')
-parser.add_argument('--overwrite', action = "store_true", help = 'Overwrite existing files.')
-parser.add_argument('--nodataval', type = int, default = None, help = 'No data value. This must be set if --indir is also set.')
-#parser.add_argument('--minrow', type = int, default = 21, help = 'Lowest WRS-2 Row number.')
-parser.add_argument('--rowspath', type = int, default = 4, help = 'Max WRS-2 Rows per Path.')
-args = parser.parse_args()
+def getparser():
+    parser = argparse.ArgumentParser('This script creates VRT files for Landsat data.')
 
-if args.indir:
-    indirs = [args.indir]
-    nodatavals = {args.indir: args.nodataval}
-else:
-    indirs = [ieo.srdir, ieo.fmaskdir, ieo.btdir, ieo.ndvidir, ieo.evidir, ieo.pixelqadir]
-    nodatavals = {ieo.srdir: '-9999', ieo.fmaskdir: '255', ieo.btdir: '-9999', ieo.ndvidir: '0', ieo.evidir: '0', ieo.pixelqadir: '1'}
+    parser.add_argument('-i', '--indir', type = str, default = None, help = 'Input directory. If this is set then --nodataval must also be set. Otherwise, default values will be used.')
+    parser.add_argument('-o', '--outdir', type = str, default = None, help = 'Data output directory.')
+    parser.add_argument('-y', '--year', type = int, default = None, help = 'Process secenes only for a specific year.')
+    parser.add_argument('--overwrite', action = "store_true", help = 'Overwrite existing files.')
+    parser.add_argument('--nodataval', type = int, default = None, help = 'No data value. This must be set if --indir is also set.')
+    #parser.add_argument('--minrow', type = int, default = 21, help = 'Lowest WRS-2 Row number.')
+    parser.add_argument('--rowspath', type = int, default = 4, help = 'Max WRS-2 Rows per Path.')
+    parser.add_argument('--catalog', type = str, default = None, help = 'VRT catalog database (default = vrt_catalog.sqlite in the Landsat catalog directory).')
+    parser.add_argument('--nocsv', action = "store_true", help = 'Do not export updated catalogs to CSV files.')
+    parser.add_argument('--incremental', action = "store_true", help = 'Only rebuild VRTs whose member files have been added, removed, or modified since they were last built.')
+    parser.add_argument('--timeseries', action = "store_true", help = 'Create per-Path/Row time series stacks, with one band per acquisition date, rather than date mosaics.')
+    parser.add_argument('--tsbands', type = str, default = None, help = 'Comma-delimited band numbers for time series stacks of multiband products (default = all bands).')
+    parser.add_argument('--usegdal', action = "store_true", help = 'Build VRTs with gdal.BuildVRT, which opens every member raster, rather than from ENVI headers.')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count(), help = 'Number of VRTs built in parallel (default = number of CPU cores).')
+    return parser
+
+def getindirs(indir = None, nodataval = None):
+    # Returns [input directories, dict of directory: nodata value]
+    if indir:
+        return [indir], {indir: nodataval}
+    return [ieo.srdir, ieo.fmaskdir, ieo.btdir, ieo.ndvidir, ieo.evidir, ieo.pixelqadir], {ieo.srdir: '-9999', ieo.fmaskdir: '255', ieo.btdir: '-9999', ieo.ndvidir: '0', ieo.evidir: '0', ieo.pixelqadir: '1'}
+
+# Products whose band meanings are the same for all sensors. Time series stacks of other products
+# are made separately for Landsat 8 and Landsats 4-7.
+mixedsensordirs = [ieo.ndvidir, ieo.evidir, ieo.fmaskdir]
 
 def makefiledict(dirname, year):
-    if args.year:
-        flist = glob.glob(os.path.join(dirname, 'L*{}*.dat'.format(args.year)))
+    if year:
+        flist = glob.glob(os.path.join(dirname, 'L*{}*.dat'.format(year)))
     else:
         flist = glob.glob(os.path.join(dirname, 'L*.dat'))
     filedict = {}
@@ -63,6 +78,32 @@ def makefiledict(dirname, year):
                 filedict[basename[rangerow[1]:rangerow[2]]].append(f)
     return filedict
 
+def maketsdict(dirname, year, mixedsensors):
+    # Groups files by WRS-2 Path/Row (and sensor), sorted by acquisition date
+    if year:
+        flist = glob.glob(os.path.join(dirname, 'L*{}*.dat'.format(year)))
+    else:
+        flist = glob.glob(os.path.join(dirname, 'L*.dat'))
+    tsdict = {}
+    for f in flist:
+        basename = os.path.basename(f)
+        if len(basename) > 40:
+            pathrow, d, sceneID, landsat = basename[4:10], basename[10:17], basename[:40], basename[3:4]
+        else:
+            pathrow, d, sceneID, landsat = basename[3:9], basename[9:16], basename[:21], basename[2:3]
+        if mixedsensors:
+            group = pathrow
+        elif landsat == '8':
+            group = '{}_L8'.format(pathrow)
+        else:
+            group = '{}_L47'.format(pathrow)
+        if not group in tsdict.keys():
+            tsdict[group] = []
+        tsdict[group].append([d, sceneID, f])
+    for group in tsdict.keys():
+        tsdict[group].sort()
+    return tsdict
+
 def getpathrows():
     pathrowdict = {'paths': {}, 'rows': []}
     driver = ogr.GetDriverByName("ESRI Shapefile")
@@ -85,6 +126,14 @@ def getpathrows():
     
     return pathrowdict
 
+pathrowcache = {}
+
+def loadpathrows():
+    # ieo.WRS2 is only read once per process
+    if not 'pathrowdict' in pathrowcache.keys():
+        pathrowcache['pathrowdict'] = getpathrows()
+    return pathrowcache['pathrowdict']
+
 def makevrtfilename(outdir, filelist):
     numscenes = len(filelist)
     basename = os.path.basename(filelist[0]).replace('.dat', '.vrt')
@@ -99,75 +148,239 @@ def makevrtfilename(outdir, filelist):
     vrtfilename = os.path.join(outdir, outbasename)
     return vrtfilename
 
-def writetocsv(catfile, vrt, filelist, d, pathrowdict):
-    minrow = min(pathrowdict['rows'])
-    datetuple = datetime.datetime.strptime(d, '%Y%j')
-    scenelist = ['None'] * args.rowspath
+def sceneinfo(filelist):
+    # Returns the WRS-2 Path and a dict of Row: scene or product ID for the members of a VRT
+    scenes = {}
     for f in filelist:
-        if len(os.path.basename(f)) < 40:
-            sceneID = os.path.basename(f)[:21]
-            i = int(sceneID[7:9]) - minrow
-            path = sceneID[3:6]
+        basename = os.path.basename(f)
+        if len(basename) < 40:
+            sceneID = basename[:21]
+            row = int(sceneID[6:9])
+            path = int(sceneID[3:6])
         else:
-            sceneID = os.path.basename(os.path.basename(f))[:40]
-            i = int(sceneID[8:10]) - minrow
-            path = sceneID[4:7]
-        scenelist[i] = sceneID
-    header = 'Date,Year,DOY,Path'
-    for x in pathrowdict['rows']:
-        header += ',R{:03d}'.format(x)
-        header += ',VRT'
-    if not os.path.isfile(catfile): # creates catalog file if missing
-        with open(catfile, 'w') as output:
-            output.write('{}\n'.format(header))    
-    outline = '{},{},{},{}'.format(datetuple.strftime('%Y-%m-%d'), datetuple.strftime('%Y'), datetuple.strftime('%j'), path)
-    for s in scenelist:
-        outline += ',{}'.format(s)
-    with open(catfile, 'a') as output:
-        output.write('{}\n'.format(outline))
-    
-def makevrt(filelist, catfile, vrt, datetuple, pathrowdict):
+            sceneID = basename[:40]
+            row = int(sceneID[7:10])
+            path = int(sceneID[4:7])
+        scenes[row] = sceneID
+    return path, scenes
+
+def writetocatalog(catalog, product, vrt, filelist, d):
+    path, scenes = sceneinfo(filelist)
+    catalog.upsert(product, d, path, vrt, scenes)
+
+# Dependency tracking. Each VRT directory has a manifest recording, for every date, the VRT built
+# and the modification times of its members, so that --incremental only rebuilds VRTs whose
+# member set or members have changed.
+
+def readmanifest(vrtdir):
+    manifestfile = os.path.join(vrtdir, 'vrt_manifest.json')
+    if os.path.isfile(manifestfile):
+        with open(manifestfile, 'r') as f:
+            return json.load(f)
+    return {}
+
+def writemanifest(vrtdir, manifest):
+    manifestfile = os.path.join(vrtdir, 'vrt_manifest.json')
+    with open('{}.tmp'.format(manifestfile), 'w') as output:
+        json.dump(manifest, output, indent = 1, sort_keys = True)
+    os.replace('{}.tmp'.format(manifestfile), manifestfile)
+
+def memberstate(filelist):
+    # Modification times of member data files and their headers
+    state = {}
+    for f in filelist:
+        mtimes = [os.path.getmtime(x) for x in [f, os.path.splitext(f)[0] + '.hdr'] if os.path.isfile(x)]
+        state[f] = max(mtimes)
+    return state
+
+def isuptodate(manifest, key, vrt, members):
+    # VRTs missing from the manifest, e.g. those built by earlier versions, are considered up
+    # to date if they are newer than all of their members
+    if not os.path.isfile(vrt):
+        return False
+    if key in manifest.keys():
+        return manifest[key]['vrt'] == vrt and manifest[key]['members'] == members
+    return os.path.getmtime(vrt) >= max(members.values())
+
+def maketsvrt(filelist, vrt, band, nodataval, descriptions):
+    print('Now creating time series VRT: {}'.format(os.path.basename(vrt)))
+    try:
+        return vrtwriter.writetimeseriesvrt(vrt, filelist, band = band, nodataval = nodataval, descriptions = descriptions)
+    except (IOError, ValueError, KeyError) as e:
+        print('Unable to create {} from ENVI headers ({}), using gdal.BuildVRT.'.format(os.path.basename(vrt), e))
+    ds = gdal.BuildVRT(vrt, filelist, separate = True, bandList = [band], srcNodata = nodataval)
+    if not ds:
+        raise RuntimeError('gdal.BuildVRT failed: {}'.format(gdal.GetLastErrorMsg()))
+    if descriptions:
+        for i, description in enumerate(descriptions, start = 1):
+            ds.GetRasterBand(i).SetDescription(description)
+    ds = None
+    return vrt
+
+def makevrt(filelist, vrt, nodataval):
+    # Builds the VRT in-process. This is equivalent to 'gdalbuildvrt -srcnodata nodataval vrt filelist'.
+    # By default the VRT XML is written from the members' ENVI headers, without opening the rasters.
     dirname, basename = os.path.split(vrt)
     print('Now creating VRT: {}'.format(basename))
-    proclist = ['gdalbuildvrt', '-srcnodata', nodatavals[os.path.dirname(filelist[0])], vrt]    
-#    scenelist.append(vrt)
-    for f in filelist:
-        if f:
-            proclist.append(f)
-    p = Popen(proclist)
-    print(p.communicate())
-    writetocsv(catfile, vrt, filelist, datetuple, pathrowdict)
-
-today = datetime.datetime.today()
-catdir = os.path.join(ieo.catdir, 'Landsat')
-pathrowdict = getpathrows()
-
-for indir in indirs:
-    print('Now processing files in subdir {}, number {} of {}.'.format(os.path.basename(indir), indirs.index(indir) + 1, len(indirs)))
-    if args.outdir:
-        vrtdir = args.outdir
-    else:
-        vrtdir = os.path.join(indir, 'vrt')
-    print('New VRTs will be written to: {}'.format(vrtdir))
-    
-    if not os.path.isdir(vrtdir):
-        os.mkdir(vrtdir)
-    catfile = os.path.join(catdir, '{}_vrt.csv'.format(os.path.basename(indir)))
-    print('New VRTs created will be logged in: {}'.format(catfile))
-        
-    filedict = makefiledict(indir, args.year)
-    keylist = sorted(filedict.keys())
-    if len(keylist) > 0:
-        for key in keylist:
-            if len(filedict[key]) > 1:
-                filedict[key].sort()
-                vrt = makevrtfilename(vrtdir, filedict[key])
-                if args.overwrite or not os.path.isfile(vrt):
-                    print('Now processing {}, number {} of {}.'.format(os.path.basename(vrt), keylist.index(key) + 1, len(keylist)))
-                    makevrt(filedict[key], catfile, vrt, key, pathrowdict)
-                else:
-                    print('{} exists and no overwrite set, skipping.'.format(os.path.basename(vrt)))
+    if not args.usegdal:
+        try:
+            return vrtwriter.writemosaicvrt(vrt, filelist, nodataval)
+        except (IOError, ValueError, KeyError) as e:
+            print('Unable to create {} from ENVI headers ({}), using gdal.BuildVRT.'.format(basename, e))
+    ds = gdal.BuildVRT(vrt, [f for f in filelist if f], srcNodata = nodataval)
+    if not ds:
+        raise RuntimeError('gdal.BuildVRT failed: {}'.format(gdal.GetLastErrorMsg()))
+    ds = None
+    return vrt
+
+def queuetimeseries(tasks, indir, vrtdir, manifest, nodatavals):
+    # Time series stacks have fixed file names and are rebuilt whenever their members change
+    product = os.path.basename(indir)
+    tsdir = os.path.join(vrtdir, 'timeseries')
+    if not os.path.isdir(tsdir):
+        os.mkdir(tsdir)
+    tsdict = maketsdict(indir, args.year, indir in mixedsensordirs)
+    for group in sorted(tsdict.keys()):
+        filelist = [x[2] for x in tsdict[group]]
+        descriptions = ['{} {}'.format(datetime.datetime.strptime(x[0], '%Y%j').strftime('%Y-%m-%d'), x[1]) for x in tsdict[group]]
+        members = memberstate(filelist)
+        if args.tsbands:
+            bands = [int(x) for x in args.tsbands.split(',')]
+        else:
+            bands = list(range(1, enviheader.rastersize(enviheader.readheader(filelist[0]))[2] + 1))
+        for band in bands:
+            if args.year:
+                basename = '{}_{}_b{}_{}_ts.vrt'.format(group, product, band, args.year)
+            else:
+                basename = '{}_{}_b{}_ts.vrt'.format(group, product, band)
+            vrt = os.path.join(tsdir, basename)
+            mkey = 'timeseries/{}/{}'.format(product, basename)
+            if args.overwrite or not isuptodate(manifest, mkey, vrt, members):
+                print('Queueing {} ({} dates).'.format(basename, len(filelist)))
+                tasks.append({'func': maketsvrt, 'args': (filelist, vrt, band, nodatavals[indir], descriptions), 'vrt': vrt, 'vrtdir': vrtdir, 'mkey': mkey, 'members': members, 'catalog': None})
             else:
-                print('An insufficient number of scenes for dat {} exist, skipping.'.format(key))
+                print('{} is up to date, skipping.'.format(basename))
+
+def run(runargs, catalog = None):
+    # Creates VRTs with the options in runargs, as parsed by getparser(). An open VRTCatalog may be
+    # passed in by a calling process, in which case it is committed but left open. Returns the list
+    # of VRTs built.
+    global args
+    args = runargs
+    catdir = os.path.join(ieo.catdir, 'Landsat')
+    pathrowdict = loadpathrows()
+    indirs, nodatavals = getindirs(args.indir, args.nodataval)
+
+    # VRTs for all dates and directories are queued for a pool of workers. The catalog and
+    # manifests are only written to by this thread as VRTs are completed.
+    tasks = []
+    manifests = {}
+    closecatalog = not catalog
+    if not catalog:
+        if not args.catalog:
+            args.catalog = os.path.join(catdir, 'vrt_catalog.sqlite')
+        print('New VRTs created will be logged in: {}'.format(args.catalog))
+        catalog = VRTCatalog(args.catalog)
+    catfiles = {}
+    built = []
+
+    for indir in indirs:
+        print('Now processing files in subdir {}, number {} of {}.'.format(os.path.basename(indir), indirs.index(indir) + 1, len(indirs)))
+        if args.outdir:
+            vrtdir = args.outdir
+        else:
+            vrtdir = os.path.join(indir, 'vrt')
+        print('New VRTs will be written to: {}'.format(vrtdir))
         
-print('Processing complete.')
\ No newline at end of file
+        if not os.path.isdir(vrtdir):
+            os.mkdir(vrtdir)
+        if not vrtdir in manifests.keys():
+            manifests[vrtdir] = readmanifest(vrtdir)
+        manifest = manifests[vrtdir]
+        if args.timeseries:
+            queuetimeseries(tasks, indir, vrtdir, manifest, nodatavals)
+            continue
+        product = os.path.basename(indir)
+        catfiles[product] = os.path.join(catdir, '{}_vrt.csv'.format(product))
+            
+        filedict = makefiledict(indir, args.year)
+        keylist = sorted(filedict.keys())
+        if len(keylist) > 0:
+            for key in keylist:
+                if len(filedict[key]) > 1:
+                    filedict[key].sort()
+                    vrt = makevrtfilename(vrtdir, filedict[key])
+                    members = memberstate(filedict[key])
+                    mkey = '{}/{}'.format(os.path.basename(indir), key) # Output directories may be shared by products
+                    if args.incremental:
+                        build = args.overwrite or not isuptodate(manifest, mkey, vrt, members)
+                        if not build and not mkey in manifest.keys():
+                            manifest[mkey] = {'vrt': vrt, 'members': members}
+                            if not catalog.has(product, key, sceneinfo(filedict[key])[0]):
+                                writetocatalog(catalog, product, vrt, filedict[key], key)
+                    else:
+                        build = args.overwrite or not os.path.isfile(vrt)
+                    if build:
+                        print('Queueing {}, number {} of {}.'.format(os.path.basename(vrt), keylist.index(key) + 1, len(keylist)))
+                        tasks.append({'func': makevrt, 'args': (filedict[key], vrt, nodatavals[os.path.dirname(filedict[key][0])]), 'vrt': vrt, 'vrtdir': vrtdir, 'mkey': mkey, 'members': members, 'catalog': [product, filedict[key], key]})
+                    elif args.incremental:
+                        print('{} is up to date, skipping.'.format(os.path.basename(vrt)))
+                    else:
+                        print('{} exists and no overwrite set, skipping.'.format(os.path.basename(vrt)))
+                else:
+                    print('An insufficient number of scenes for dat {} exist, skipping.'.format(key))
+
+    # Each manifest is written as soon as all VRTs of its directory are done, so that an interrupted
+    # run only repeats the directories still being built
+    remaining = {vrtdir: 0 for vrtdir in manifests.keys()}
+    for task in tasks:
+        remaining[task['vrtdir']] += 1
+    for vrtdir in manifests.keys():
+        if remaining[vrtdir] == 0:
+            writemanifest(vrtdir, manifests[vrtdir])
+
+    print('Building {} VRTs with {} workers.'.format(len(tasks), args.workers))
+    try:
+        with ThreadPoolExecutor(max_workers = max(args.workers or 1, 1)) as executor:
+            futures = {executor.submit(task['func'], *task['args']): task for task in tasks}
+            for future in as_completed(futures):
+                task = futures[future]
+                vrt, mkey = task['vrt'], task['mkey']
+                try:
+                    future.result()
+                    manifest = manifests[task['vrtdir']]
+                    if mkey in manifest.keys() and manifest[mkey]['vrt'] != vrt and os.path.isfile(manifest[mkey]['vrt']):
+                        # The number of member rows is part of the file name, so a new member renames the VRT
+                        print('Removing superseded VRT: {}'.format(os.path.basename(manifest[mkey]['vrt'])))
+                        os.remove(manifest[mkey]['vrt'])
+                    manifest[mkey] = {'vrt': vrt, 'members': task['members']}
+                    if task['catalog']:
+                        product, filelist, key = task['catalog']
+                        writetocatalog(catalog, product, vrt, filelist, key)
+                    built.append(vrt)
+                except Exception as e:
+                    print('Error creating VRT {}: {}'.format(os.path.basename(vrt), e))
+                    ieo.logerror(vrt, e)
+                remaining[task['vrtdir']] -= 1
+                if remaining[task['vrtdir']] == 0:
+                    writemanifest(task['vrtdir'], manifests[task['vrtdir']])
+    finally:
+        for vrtdir in manifests.keys():
+            if remaining[vrtdir] > 0: # Interrupted, with the VRTs completed so far
+                writemanifest(vrtdir, manifests[vrtdir])
+    catalog.commit()
+    if not args.nocsv:
+        for product in catfiles.keys():
+            print('Exporting catalog to: {}'.format(catfiles[product]))
+            catalog.exportcsv(product, catfiles[product], pathrowdict['rows'])
+    if closecatalog:
+        catalog.close()
+    return built
+
+def main(argv = None):
+    built = run(getparser().parse_args(argv))
+    print('Processing complete.')
+    return built
+
+if __name__ == '__main__':
+    main()
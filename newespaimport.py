@@ -12,8 +12,10 @@
 # 4. Calculates NDVI and EVI for clear land pixels
 # 5. Archives tar.gz files after use
 
-import os, sys, glob, datetime, shutil, argparse#, ieo
-from osgeo import ogr
+import os, sys, glob, datetime, shutil, argparse, time, threading, queue, math, inspect#, ieo
+from osgeo import ogr, osr, gdal
+from ingestledger import IngestLedger, findproducts, productdirs, extractarchive
+import vegindex, clearstats, sceneindex, enviheader
 
 try: # This is included as the module may not properly install in Anaconda.
     import ieo
@@ -27,41 +29,68 @@ except:
         print('Error: that is not a valid path for the IEO module. Exiting.')
         sys.exit()
 
-## main
-parser = argparse.ArgumentParser('This script imports ESPA-processed scenes into the local library. It stacks images and converts them to the locally defined projection in IEO, and adds ENVI metadata.')
-parser.add_argument('-i','--indir', default = ieo.ingestdir, type = str, help = 'Input directory to search for files. This will be overridden if --infile is set.')
-parser.add_argument('-if','--infile', type = str, help = 'Input file. This must be contain the full path and filename.')
-parser.add_argument('-f','--fmaskdir', type = str, default = ieo.fmaskdir, help = 'Directory containing FMask cloud masks in local projection.')
-parser.add_argument('-q','--pixelqadir', type = str, default = ieo.pixelqadir, help = 'Directory containing Landsat pixel QA layers in local projection.')
-parser.add_argument('-o', '--outdir', type = str, default = ieo.srdir, help = 'Surface reflectance output directory')
-parser.add_argument('-b', '--btoutdir', type = str, default = ieo.btdir, help = 'Brightness temperature output directory')
-parser.add_argument('-n', '--ndvidir', type = str, default = ieo.ndvidir, help = 'NDVI output directory')
-parser.add_argument('-e', '--evidir', type = str, default = ieo.evidir, help = 'EVI output directory')
-parser.add_argument('-a', '--archdir', type = str, default = ieo.archdir, help = 'Original data archive directory')
-parser.add_argument('--overwrite', type = bool, default = False, help = 'Overwrite existing files.')
-parser.add_argument('-d', '--delay', type = int, default = 0, help = 'Delay execution of script in seconds.')
-parser.add_argument('-r','--remove', type = bool, default = False, help = 'Remove temporary files after ingest.')
-args = parser.parse_args()
-
-if args.delay > 0: # if we want to delay execution for whatever reason
-    from time import sleep
-    print('Delaying execution {} seconds.'.format(args.delay))
-    sleep(args.delay)
-
-
-# Setting a few variables
-archdir = args.archdir
-fmaskdir = args.fmaskdir
-fmasklist = glob.glob(os.path.join(args.fmaskdir, '*.dat'))
-
-reflist = []
-scenedict = {}
-filelist = []
-today = datetime.datetime.today()
-
-# In case there are any errors during script execution
-errorfile = 'newespaimport_errors_{}.csv'.format(today.strftime('%Y%m%d_%H%M%S'))
-ieo.errorfile = errorfile
+args = None # Set by run()
+ledger = None
+proddirs = None
+archdir = None
+numfiles = 0
+statscenes = [] # Scenes with clear statistics calculated during a run
+ingested = [] # Scenes completely ingested during a run
+
+def getparser():
+    parser = argparse.ArgumentParser('This script imports ESPA-processed scenes into the local library. It stacks images and converts them to the locally defined projection in IEO, and adds ENVI metadata.')
+    parser.add_argument('-i','--indir', default = ieo.ingestdir, type = str, help = 'Input directory to search for files. This will be overridden if --infile is set.')
+    parser.add_argument('-if','--infile', type = str, help = 'Input file. This must be contain the full path and filename.')
+    parser.add_argument('--infiles', type = str, nargs = '+', default = None, help = 'Input files, ingested together in one pipeline run. These must contain the full path and filename. This overrides --indir and --infile.')
+    parser.add_argument('-f','--fmaskdir', type = str, default = ieo.fmaskdir, help = 'Directory containing FMask cloud masks in local projection.')
+    parser.add_argument('-q','--pixelqadir', type = str, default = ieo.pixelqadir, help = 'Directory containing Landsat pixel QA layers in local projection.')
+    parser.add_argument('-o', '--outdir', type = str, default = ieo.srdir, help = 'Surface reflectance output directory')
+    parser.add_argument('-b', '--btoutdir', type = str, default = ieo.btdir, help = 'Brightness temperature output directory')
+    parser.add_argument('-n', '--ndvidir', type = str, default = ieo.ndvidir, help = 'NDVI output directory')
+    parser.add_argument('-e', '--evidir', type = str, default = ieo.evidir, help = 'EVI output directory')
+    parser.add_argument('-a', '--archdir', type = str, default = ieo.archdir, help = 'Original data archive directory')
+    parser.add_argument('--overwrite', type = bool, default = False, help = 'Overwrite existing files.')
+    parser.add_argument('-d', '--delay', type = int, default = 0, help = 'Delay execution of script in seconds.')
+    parser.add_argument('-r','--remove', type = bool, default = False, help = 'Have ieo.importespa() remove its temporary files after ingest. Archives extracted by the pipeline are always removed from --scratchdir once their scene has been imported.')
+    parser.add_argument('--scratchdir', type = str, default = os.path.join(ieo.ingestdir, 'scratch'), help = 'Scratch directory for archives extracted by the pipeline.')
+    parser.add_argument('--extractworkers', type = int, default = 1, help = 'Number of archive extraction workers.')
+    parser.add_argument('--workers', type = int, default = 1, help = 'Number of scene import workers (stacking, reprojection, NDVI/EVI).')
+    parser.add_argument('--archiveworkers', type = int, default = 1, help = 'Number of archiving workers.')
+    parser.add_argument('--queuesize', type = int, default = 2, help = 'Maximum number of scenes waiting between pipeline stages. This bounds peak scratch disk and memory use.')
+    parser.add_argument('--warpthreads', type = int, default = None, help = 'Number of threads used by each reprojection (default = number of CPU cores divided by --workers).')
+    parser.add_argument('--warpmem', type = int, default = None, help = 'Warp memory limit in MB per reprojection (default = 256 MB per warp thread, up to 2048 MB).')
+    parser.add_argument('--gdalcache', type = int, default = None, help = 'GDAL block cache size in MB (default = 128 MB per CPU core, minimum 512 MB).')
+    parser.add_argument('--aoi', type = str, default = None, help = 'Area of interest vector file. Products are cropped to the intersection of the scene footprint and the AOI, and scenes that do not overlap it are skipped. Set to "default" to use ieo.NTS. If ieo.importespa() does not accept warp options, products are written at full scene extent and cropped afterwards, so the AOI reduces library storage but not ingest writes.')
+    parser.add_argument('--ledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ingest_ledger.sqlite'), help = 'SQLite ingest ledger recording archive checksums and per-product completion state.')
+    return parser
+
+warpoptions = None # gdal.Warp() keyword options passed to ieo.importespa(), set by run()
+
+def warpdefaults(args):
+    # Fills in unset --warpthreads, --warpmem, and --gdalcache from the number of CPU cores and workers
+    cpucount = os.cpu_count() or 1
+    if not args.warpthreads:
+        args.warpthreads = max(1, cpucount // max(args.workers, 1))
+    if not args.warpmem:
+        args.warpmem = min(2048, 256 * args.warpthreads)
+    if not args.gdalcache:
+        args.gdalcache = max(512, 128 * cpucount)
+    return args
+
+def configurewarp(threads, warpmem, cachemax):
+    # Sets the default number of warper threads and the GDAL block cache size through GDAL's own
+    # configuration, and returns the gdal.Warp() keyword options for multithreaded warping
+    gdal.SetConfigOption('GDAL_NUM_THREADS', str(threads))
+    gdal.SetCacheMax(cachemax * 1024 * 1024)
+    return {'multithread' : True, 'warpMemoryLimit' : warpmem, 'warpOptions' : ['NUM_THREADS={}'.format(threads)]}
+
+def importacceptswarpoptions():
+    # Older versions of ieo.importespa() do not take warp options, and only use GDAL_NUM_THREADS and the cache
+    try:
+        parameters = inspect.signature(ieo.importespa).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'warpoptions' in parameters.keys() or any(x.kind == inspect.Parameter.VAR_KEYWORD for x in parameters.values())
 
 def sceneidfromfilename(filename):
     basename = os.path.basename(filename)
@@ -78,61 +107,352 @@ def sceneidfromfilename(filename):
     return sceneid
 
 
-# Open up ieo.landsatshp and get the existing Product ID, Scene ID, and SR_path status
-driver = ogr.GetDriverByName("ESRI Shapefile")
-data_source = driver.Open(ieo.landsatshp, 0)
-layer = data_source.GetLayer()
-for feature in layer:
-    sceneID = feature.GetField('sceneID')
-    scenedict[sceneID] = {'ProductID' : feature.GetField('LandsatPID'), 'sceneID' : sceneID, 'SR_path' : feature.GetField('SR_path')}
-data_source = None
-
-# This look finds any existing processed data 
-for dir in [args.outdir, os.path.join(args.outdir, 'L1G')]:
-    rlist = glob.glob(os.path.join(args.outdir, '*_ref_{}.dat'.format(ieo.projacronym)))
-    for f in rlist:
-        if not 'ESA' == os.path.basename(f)[16:19]:
-            reflist.append(f)
-
-# Now create the processing list
-if args.infile: # This is in case a specific file has been selected for processing
-    if os.access(args.infile, os.F_OK) and args.infile.endswith('.tar.gz'):
-        print('File has been found, processing.')
-        filelist.append(args.infile)
-    else:
-        print('Error, file not found: {}'.format(args.infile))
-        ieo.logerror(args.infile, 'File not found.')
-else: # find and process what's in the ingest directory
-    for root, dirs, files in os.walk(args.indir, onerror = None): 
-        for name in files:
-            if name.endswith('.tar.gz') or name.endswith('_sr_band7.img'):
-                fname = os.path.join(root, name)
-                ssceneID = sceneidfromfilename(name)
-                if ssceneID:
-                    sslist = [x for x in scenedict.keys() if ssceneID in x]
-                    if len(sslist) > 0:
-                        for sceneID in sslist:
-                            if (args.overwrite or not any(ssceneID in x for x in reflist)) and (not fname in filelist): # any(scenedict[ProductID]['sceneID'][:16] == os.path.basename(x)[:16] for x in reflist)
-                                print('Found unprocessed SceneID {}, adding to processing list.'.format(sceneID))
-                                filelist.append(fname)
-
-# Now process files that are in the list
-numfiles = len(filelist)
-print('There are {} reflectance files and {} scenes to be processed.'.format(len(reflist), numfiles))
-filenum = 1
-for f in filelist:
-    basename = os.path.basename(f)
-    scene = basename[:16]
-    if args.overwrite or not any(scene in x for x in reflist):
+def getaoi(aoifile, targetsrs):
+    # Returns the union of all AOI features, transformed to the projection of the scene footprints
+    data_source = ogr.Open(aoifile, 0)
+    if not data_source:
+        print('Error: unable to open AOI file: {}. Exiting.'.format(aoifile))
+        sys.exit()
+    layer = data_source.GetLayer()
+    srs = layer.GetSpatialRef()
+    aoigeom = ogr.Geometry(ogr.wkbMultiPolygon)
+    for feature in layer:
+        aoigeom = aoigeom.Union(feature.GetGeometryRef())
+    if srs and targetsrs and not srs.IsSame(targetsrs):
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        aoigeom.Transform(osr.CoordinateTransformation(srs, targetsrs))
+    data_source = None
+    return aoigeom
+
+def aoibounds(footprint, aoigeom, pixelsize = 30.0):
+    # Returns output bounds [minX, minY, maxX, maxY] of the footprint/ AOI intersection, snapped
+    # outwards to the pixel grid, or None if they do not overlap
+    if not footprint.Intersects(aoigeom):
+        return None
+    minX, maxX, minY, maxY = footprint.Intersection(aoigeom).GetEnvelope()
+    return [math.floor(minX / pixelsize) * pixelsize, math.floor(minY / pixelsize) * pixelsize, math.ceil(maxX / pixelsize) * pixelsize, math.ceil(maxY / pixelsize) * pixelsize]
+
+def cropproduct(datfile, bounds):
+    # Crops an ingested ENVI product in place to output bounds [minX, minY, maxX, maxY]. Products
+    # already within the bounds, e.g. as ieo.importespa() applied them, are left as they are.
+    # Returns True if the product was cropped.
+    ds = gdal.Open(datfile)
+    if not ds:
+        raise IOError('Unable to open: {}'.format(datfile))
+    geotrans = ds.GetGeoTransform()
+    extent = [geotrans[0], geotrans[3] + geotrans[5] * ds.RasterYSize, geotrans[0] + geotrans[1] * ds.RasterXSize, geotrans[3]]
+    tolerance = abs(geotrans[1]) / 2.0
+    if extent[0] >= bounds[0] - tolerance and extent[1] >= bounds[1] - tolerance and extent[2] <= bounds[2] + tolerance and extent[3] <= bounds[3] + tolerance:
+        ds = None
+        return False
+    projwin = [max(extent[0], bounds[0]), min(extent[3], bounds[3]), min(extent[2], bounds[2]), max(extent[1], bounds[1])] # ulx, uly, lrx, lry
+    if projwin[0] >= projwin[2] or projwin[3] >= projwin[1]:
+        ds = None
+        raise ValueError('{} does not overlap the AOI bounds.'.format(datfile))
+    cropfile = '{}_crop.dat'.format(os.path.splitext(datfile)[0])
+    try:
+        cropds = gdal.Translate(cropfile, ds, format = 'ENVI', projWin = projwin)
+        if not cropds:
+            raise IOError('Unable to crop {}: {}'.format(datfile, gdal.GetLastErrorMsg()))
+        cropds = None
+        ds = None
+        os.replace(enviheader.hdrfilename(cropfile), enviheader.hdrfilename(datfile) or '{}.hdr'.format(os.path.splitext(datfile)[0]))
+        os.replace(cropfile, datfile)
+        return True
+    finally:
+        ds = None
+        for f in [cropfile, '{}_crop.hdr'.format(os.path.splitext(datfile)[0]), '{}.aux.xml'.format(cropfile)]:
+            if os.path.isfile(f):
+                os.remove(f)
+
+# Product ID, Scene ID, SR_path status, and footprints of ieo.landsatshp features. These are
+# cached per process and only re-read once the shapefile has been modified.
+shapefilecache = {}
+
+def readfootprints(shapefile):
+    # Returns [scenedict, dict of 16 character scene ID: footprint, spatial reference]
+    state = sceneindex.shapefilestate(shapefile)
+    if shapefile in shapefilecache.keys() and shapefilecache[shapefile][0] == state:
+        return shapefilecache[shapefile][1:]
+    scenedict = {}
+    footprints = {}
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    data_source = driver.Open(shapefile, 0)
+    layer = data_source.GetLayer()
+    shpsrs = layer.GetSpatialRef()
+    if shpsrs:
+        shpsrs = shpsrs.Clone()
+    for feature in layer:
+        sceneID = feature.GetField('sceneID')
+        scenedict[sceneID] = {'ProductID' : feature.GetField('LandsatPID'), 'sceneID' : sceneID, 'SR_path' : feature.GetField('SR_path')}
+        if feature.GetGeometryRef():
+            footprints[sceneID[:16]] = feature.GetGeometryRef().Clone()
+    data_source = None
+    shapefilecache[shapefile] = [state, scenedict, footprints, shpsrs]
+    return scenedict, footprints, shpsrs
+
+# Ingest pipeline. Each scene passes through three stages connected by bounded queues, so that
+# extraction of one scene overlaps the import of the previous and the archiving of the one before.
+# A stage function returns the job for the next stage, or None to drop it from the pipeline.
+
+def runpipeline(jobs, stages, queuesize):
+    # stages is a list of [name, function, number of workers]
+    queues = [queue.Queue(maxsize = queuesize) for stage in stages]
+    threads = []
+    remaining = [stage[2] for stage in stages]
+    lock = threading.Lock()
+    
+    def worker(i, name, func):
+        try:
+            while True:
+                job = queues[i].get()
+                if job is None:
+                    break
+                starttime = time.time()
+                try:
+                    job = func(job)
+                except SystemExit: # ieo.importespa() and other tools may call sys.exit() on errors
+                    print('Error: {} stage exited for {}.'.format(name, job['archive']))
+                    ieo.logerror(job['archive'], '{} stage exited.'.format(name))
+                    if not ledger.isfinished(job['archive']):
+                        ledger.finisharchive(job['archive'], 'failed')
+                    job = None
+                except Exception as e:
+                    print('Error in {} stage for {}: {}'.format(name, job['archive'], e))
+                    ieo.logerror(job['archive'], e)
+                    job = None
+                if job:
+                    job['timings'][name] = time.time() - starttime
+                    if i + 1 < len(stages):
+                        queues[i + 1].put(job)
+        finally:
+            with lock: # The last worker of a stage shuts down the next stage, whatever ends its workers
+                remaining[i] -= 1
+                if remaining[i] == 0 and i + 1 < len(stages):
+                    for j in range(stages[i + 1][2]):
+                        queues[i + 1].put(None)
+    
+    for i, stage in enumerate(stages):
+        for j in range(stage[2]):
+            t = threading.Thread(target = worker, args = (i, stage[0], stage[1]), name = '{}-{}'.format(stage[0], j + 1))
+            t.start()
+            threads.append(t)
+    for job in jobs:
+        queues[0].put(job)
+    for j in range(stages[0][2]):
+        queues[0].put(None)
+    for t in threads:
+        t.join()
+
+def extractstage(job):
+    f = job['archive']
+    scene = job['scene']
+    ledger.registerarchive(f, scene)
+    found = findproducts(scene, proddirs)
+    ledger.setproducts(scene, found)
+    missing = ledger.missingproducts(scene)
+    if not (args.overwrite or len(missing) > 0):
+        print('Scene {} has already been processed, skipping file number {} of {}.'.format(scene, job['filenum'], numfiles))
+        ledger.finisharchive(f, 'complete')
+        return None
+    if len(found) > 0 and not args.overwrite:
+        print('Scene {} is missing products {}, resuming.'.format(scene, ', '.join(missing)))
+        if all(product in ['NDVI', 'EVI'] for product in missing):
+            # Only the vegetation indices are missing, so these are calculated from the ingested SR and mask data
+            job['vegonly'] = found
+            return job
+    # A partially ingested scene has to be overwritten, as ieo.importespa() skips scenes with existing SR data
+    job['overwrite'] = args.overwrite or len(found) > 0
+    job['infile'] = f
+    if f.endswith('.tar.gz'):
+        job['scratch'] = os.path.join(args.scratchdir, os.path.basename(f)[:-7])
+        print('Extracting archive {} to: {}'.format(os.path.basename(f), job['scratch']))
+        try:
+            extractarchive(f, job['scratch'])
+        except:
+            shutil.rmtree(job['scratch'], ignore_errors = True)
+            raise
+        flist = glob.glob(os.path.join(job['scratch'], '*_sr_band7.img'))
+        if len(flist) > 0:
+            job['infile'] = flist[0]
+    return job
+
+def importstage(job):
+    f = job['archive']
+    scene = job['scene']
+    ledger.startarchive(f)
+    starttime = time.time()
+    try:
+        if 'vegonly' in job.keys():
+            basename = os.path.basename(job['vegonly']['ref'])
+            scenebase = basename[:basename.find('_ref_')]
+            vegindex.calcindices(job['vegonly']['ref'], job['vegonly']['mask'], os.path.join(args.ndvidir, '{}_NDVI.dat'.format(scenebase)), os.path.join(args.evidir, '{}_EVI.dat'.format(scenebase)), overwrite = True)
+        else:
+            print('\nProcessing archive {}, file number {} of {}.\n'.format(f, job['filenum'], numfiles))
+            if warpoptions is not None:
+                options = dict(warpoptions)
+                if job['bounds']: # AOI clipping of this scene
+                    options['outputBounds'] = job['bounds']
+                ieo.importespa(job['infile'], remove = args.remove, overwrite = job['overwrite'], warpoptions = options)
+            else:
+                ieo.importespa(job['infile'], remove = args.remove, overwrite = job['overwrite'])
+        found = findproducts(scene, proddirs)
+        if job['bounds']: # The output extent is checked, as not every ieo.importespa() applies the AOI bounds
+            for product in sorted(found.keys()):
+                if cropproduct(found[product], job['bounds']):
+                    print('The AOI bounds were not applied to {}, cropped to: {}'.format(os.path.basename(found[product]), ', '.join([str(x) for x in job['bounds']])))
+        seconds = time.time() - starttime
+        ledger.setproducts(scene, found)
+        if 'mask' in found.keys():
+            statscenes.append(clearstats.recordstats(ledger, found['mask'], bounds = job['bounds'])) # Within the AOI, if set
+        if len(ledger.missingproducts(scene)) == 0:
+            ledger.finisharchive(f, 'complete', seconds = seconds)
+            return job
+        ledger.finisharchive(f, 'partial', seconds = seconds)
+    except Exception as e:
+        print('There was a problem processing the scene. Adding to error list.')
+        print(e)
+        ieo.logerror(f, e)
+        ledger.setproducts(scene, findproducts(scene, proddirs))
+        ledger.finisharchive(f, 'failed', seconds = time.time() - starttime)
+    finally:
+        # Extracted data are removed whatever the outcome, so that the queues bound scratch disk use
+        if 'scratch' in job.keys():
+            shutil.rmtree(job['scratch'], ignore_errors = True)
+    return None
+
+def archivestage(job):
+    f = job['archive']
+    if f.endswith('.tar.gz') and os.path.isfile(f) and os.path.isdir(archdir) and os.path.dirname(os.path.abspath(f)) != os.path.abspath(archdir):
+        print('Archiving {} to: {}'.format(os.path.basename(f), archdir))
+        shutil.move(f, os.path.join(archdir, os.path.basename(f)))
+    ingested.append(job['scene'])
+    print('Scene {} ingested, stage timings: {}'.format(job['scene'], ', '.join(['{} {:0.1f} s'.format(key, job['timings'][key]) for key in job['timings'].keys()])))
+    return job
+
+def run(runargs):
+    # Ingests the archives selected by parsed arguments runargs, and returns the IDs of the scenes
+    # completely ingested. The scene shapefile is only re-read if it has changed since a previous run
+    # in the same process.
+    global args, ledger, proddirs, archdir, numfiles, warpoptions
+    args = runargs
+    if args.delay > 0: # if we want to delay execution for whatever reason
+        from time import sleep
+        print('Delaying execution {} seconds.'.format(args.delay))
+        sleep(args.delay)
+
+    # GDAL warping and cache settings for the reprojections of SR, BT, Fmask, and pixel QA data made
+    # by ieo.importespa(). GDAL_NUM_THREADS and the cache size apply to every reprojection, and the
+    # multithreading and warp memory options are passed to ieo.importespa() if it accepts them.
+    warpdefaults(args)
+    print('Reprojection settings: {} warp threads, {} MB warp memory, {} MB GDAL cache.'.format(args.warpthreads, args.warpmem, args.gdalcache))
+    warpoptions = configurewarp(args.warpthreads, args.warpmem, args.gdalcache)
+    if not importacceptswarpoptions():
+        print('ieo.importespa() does not accept warp options, so only the warp thread count and GDAL cache size are applied.')
+        warpoptions = None
+
+    # Setting a few variables
+    archdir = args.archdir
+    fmaskdir = args.fmaskdir
+    fmasklist = glob.glob(os.path.join(args.fmaskdir, '*.dat'))
+
+    reflist = []
+    filelist = []
+    today = datetime.datetime.today()
+    ledger = IngestLedger(args.ledger)
+    del statscenes[:]
+    del ingested[:]
+    proddirs = productdirs(ieo, outdir = args.outdir, btdir = args.btoutdir, fmaskdir = args.fmaskdir, pixelqadir = args.pixelqadir, ndvidir = args.ndvidir, evidir = args.evidir)
+
+    # In case there are any errors during script execution
+    errorfile = 'newespaimport_errors_{}.csv'.format(today.strftime('%Y%m%d_%H%M%S'))
+    ieo.errorfile = errorfile
+
+    # Open up ieo.landsatshp and get the existing Product ID, Scene ID, and SR_path status
+    scenedict, footprints, shpsrs = readfootprints(ieo.landsatshp)
+
+    aoigeom = None
+    if args.aoi:
+        if args.aoi.lower() == 'default':
+            args.aoi = ieo.NTS
+        print('Cropping products to area of interest: {}'.format(args.aoi))
+        if warpoptions is None:
+            print('Products are cropped after import, as the AOI bounds cannot be passed to ieo.importespa(). This reduces storage, but not the data written during ingest.')
+        aoigeom = getaoi(args.aoi, shpsrs)
+
+    # This look finds any existing processed data 
+    for dir in [args.outdir, os.path.join(args.outdir, 'L1G')]:
+        rlist = glob.glob(os.path.join(args.outdir, '*_ref_{}.dat'.format(ieo.projacronym)))
+        for f in rlist:
+            if not 'ESA' == os.path.basename(f)[16:19]:
+                reflist.append(f)
+
+    # Now create the processing list
+    if args.infiles or args.infile: # This is in case specific files have been selected for processing
+        for infile in args.infiles or [args.infile]:
+            if os.access(infile, os.F_OK) and infile.endswith('.tar.gz'):
+                print('File has been found, processing: {}'.format(infile))
+                if not infile in filelist:
+                    filelist.append(infile)
+            else:
+                print('Error, file not found: {}'.format(infile))
+                ieo.logerror(infile, 'File not found.')
+    else: # find and process what's in the ingest directory
+        for root, dirs, files in os.walk(args.indir, onerror = None): 
+            for name in files:
+                if name.endswith('.tar.gz') or name.endswith('_sr_band7.img'):
+                    fname = os.path.join(root, name)
+                    ssceneID = sceneidfromfilename(name)
+                    if ssceneID:
+                        sslist = [x for x in scenedict.keys() if ssceneID in x]
+                        if len(sslist) > 0:
+                            for sceneID in sslist:
+                                if (args.overwrite or not ledger.isfinished(fname)) and (not fname in filelist): # any(scenedict[ProductID]['sceneID'][:16] == os.path.basename(x)[:16] for x in reflist)
+                                    print('Found unprocessed SceneID {}, adding to processing list.'.format(sceneID))
+                                    filelist.append(fname)
+
+    # Skip scenes outside of the AOI before they are extracted
+    scenebounds = {}
+    if aoigeom:
+        for fname in filelist[:]:
+            ssceneID = sceneidfromfilename(fname) or os.path.basename(fname)[:16]
+            if ssceneID in footprints.keys():
+                bounds = aoibounds(footprints[ssceneID], aoigeom)
+                if bounds:
+                    scenebounds[fname] = bounds
+                else:
+                    print('Scene {} does not overlap the AOI, skipping.'.format(ssceneID))
+                    filelist.remove(fname)
+
+    # Now process files that are in the list
+    numfiles = len(filelist)
+    print('There are {} reflectance files and {} scenes to be processed.'.format(len(reflist), numfiles))
+    jobs = []
+    for filenum, f in enumerate(filelist, start = 1):
+        jobs.append({'archive' : f, 'scene' : sceneidfromfilename(f) or os.path.basename(f)[:16], 'filenum' : filenum, 'bounds' : scenebounds.get(f), 'timings' : {}})
+    runpipeline(jobs, [['extract', extractstage, max(args.extractworkers, 1)], ['import', importstage, max(args.workers, 1)], ['archive', archivestage, max(args.archiveworkers, 1)]], max(args.queuesize, 1))
+
+    # Clear statistics are written to the shapefile here, as the pipeline threads may not share it.
+    # These only change attribute fields not held in the footprint cache, so a cache that was current
+    # is kept, rather than re-reading every footprint on the next run in this process.
+    if len(statscenes) > 0:
+        print('Writing clear statistics for {} scenes to: {}'.format(len(statscenes), ieo.landsatshp))
         try:
-            print('\nProcessing archive {}, file number {} of {}.\n'.format(f, filenum, numfiles))
-            ieo.importespa(f, remove = args.remove, overwrite = args.overwrite)
+            current = ieo.landsatshp in shapefilecache.keys() and shapefilecache[ieo.landsatshp][0] == sceneindex.shapefilestate(ieo.landsatshp)
+            clearstats.updateshapefile(ieo.landsatshp, ledger.getclearstats(statscenes))
+            if current:
+                shapefilecache[ieo.landsatshp][0] = sceneindex.shapefilestate(ieo.landsatshp)
         except Exception as e:
-            print('There was a problem processing the scene. Adding to error list.')
-            print(e)
-            ieo.logerror(f, e)
-    else:
-        print('Scene {} has already been processed, skipping file number {} of {}.'.format(scene, filenum, numfiles))
-    filenum += 1
+            print('Error writing clear statistics: {}'.format(e))
+            ieo.logerror(ieo.landsatshp, e)
+    ledger.close()
+    return list(ingested)
+
+def main(argv = None):
+    scenes = run(getparser().parse_args(argv))
+    print('Processing complete.')
+    return scenes
 
-print('Processing complete.')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
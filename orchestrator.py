@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script runs the Landsat library workflow as a dependency graph of tasks, rather than as a
+# fixed sequence of tools. Tasks are: the shapefile update, one ingest task per acquisition date of
+# the ESPA archives to be ingested, one VRT task per product and acquisition date, and the ESPA
+# processing list. Each ingest task passes all archives of its date to one newespaimport.py run, so
+# that they go through its extract/import/archive pipeline together and clear statistics are written
+# to the shapefile once per date. A VRT task depends only on the ingest task of its date, so VRTs of
+# dates already in the library are built while ingest continues. Each task has an input signature
+# (e.g. the sizes and modification times of its member files), stored with its status and timings in
+# a SQLite database. Tasks whose signature is unchanged since they last succeeded are skipped.
+
+import os, sys, glob, json, hashlib, sqlite3, datetime, argparse, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+from vrtcatalog import VRTCatalog
+from ingestledger import IngestLedger
+import updateshp, MakeESPAproclist, newespaimport, makevrts, sceneindex
+from ieoworkflow import stageargs
+
+class TaskState(object):
+    # Last successful signature of every task, and the timings of every task run
+    def __init__(self, dbfile):
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile, timeout = 60)
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                name TEXT PRIMARY KEY,
+                signature TEXT,
+                finished TEXT,
+                seconds REAL)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS timings (
+                run TEXT,
+                name TEXT,
+                status TEXT,
+                started TEXT,
+                seconds REAL)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS timings_run ON timings (run)')
+
+    def close(self):
+        self.conn.close()
+
+    def signature(self, name):
+        row = self.conn.execute('SELECT signature FROM tasks WHERE name = ?', (name,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def record(self, run, name, status, started, seconds, signature = None):
+        with self.conn:
+            self.conn.execute('INSERT INTO timings (run, name, status, started, seconds) VALUES (?, ?, ?, ?, ?)', (run, name, status, started, seconds))
+            if status in ['complete', 'skipped'] and signature:
+                self.conn.execute('INSERT OR REPLACE INTO tasks (name, signature, finished, seconds) VALUES (?, ?, ?, ?)', (name, signature, datetime.datetime.now().isoformat(), seconds))
+
+class Task(object):
+    # func runs in a worker thread. signature, if set, is called once all dependencies have finished,
+    # and oncomplete, if set, is called with the result of func in the scheduling thread, so that it
+    # may write to the catalogs. uptodate, if set, is used instead of the signature for tasks that
+    # have not yet been run by the workflow. Tasks with the same resource are limited to its number
+    # of workers. A task waits for its softdeps, but still runs if they fail.
+    def __init__(self, name, func, args = (), deps = None, signature = None, oncomplete = None, resource = None, uptodate = None, softdeps = None):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = deps or []
+        self.softdeps = softdeps or []
+        self.signature = signature
+        self.oncomplete = oncomplete
+        self.resource = resource
+        self.uptodate = uptodate
+        self.status = 'waiting'
+        self.seconds = 0.0
+
+def filesignature(filelist):
+    # Hash of the names, sizes, and modification times of files
+    state = []
+    for f in sorted(filelist):
+        if os.path.isfile(f):
+            stat = os.stat(f)
+            state.append([f, stat.st_size, stat.st_mtime])
+        else:
+            state.append([f, None, None])
+    return hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+
+def runtasks(tasks, state, workers = 4, resources = None, force = False):
+    # Runs a dict of name: Task in dependency order. Returns the dict of task name: status. Tasks
+    # are queued per resource once their dependencies have finished, so that scheduling costs do
+    # not grow with the number of tasks waiting for a busy resource.
+    resources = resources or {}
+    run = datetime.datetime.now().isoformat()
+    dependents = {name: [] for name in tasks.keys()}
+    remaining = {}
+    for task in tasks.values():
+        for dep in task.deps + task.softdeps:
+            if not dep in tasks.keys():
+                raise KeyError('Task {} depends on unknown task: {}'.format(task.name, dep))
+            dependents[dep].append(task.name)
+        remaining[task.name] = len(task.deps) + len(task.softdeps)
+    ready = {} # resource: queue of task names
+    inuse = {}
+    running = {}
+    started = {}
+    signatures = {}
+
+    def queuetask(name):
+        if not tasks[name].resource in ready.keys():
+            ready[tasks[name].resource] = deque()
+        ready[tasks[name].resource].append(name)
+
+    def finish(name, status, starttime = None):
+        # Records a finished task, then queues dependents that are ready or blocks them on failure
+        tasks[name].status = status
+        state.record(run, name, status, starttime, tasks[name].seconds, signatures.get(name))
+        for dep in dependents[name]:
+            if tasks[dep].status != 'waiting':
+                continue
+            if status in ['failed', 'blocked'] and not name in tasks[dep].softdeps:
+                print('Task {} is blocked by a failed dependency: {}'.format(dep, name))
+                finish(dep, 'blocked')
+            else:
+                remaining[dep] -= 1
+                if remaining[dep] == 0:
+                    queuetask(dep)
+
+    for name in tasks.keys():
+        if remaining[name] == 0:
+            queuetask(name)
+    with ThreadPoolExecutor(max_workers = max(workers, 1)) as executor:
+        while True:
+            for resource in list(ready.keys()):
+                while len(ready[resource]) > 0 and (not resource in resources.keys() or inuse.get(resource, 0) < resources[resource]):
+                    task = tasks[ready[resource].popleft()]
+                    if task.signature:
+                        signatures[task.name] = task.signature()
+                        previous = state.signature(task.name)
+                        if not force and signatures[task.name] and (signatures[task.name] == previous or (previous is None and task.uptodate and task.uptodate())):
+                            print('Task {} is up to date, skipping.'.format(task.name))
+                            finish(task.name, 'skipped')
+                            continue
+                    task.status = 'running'
+                    inuse[resource] = inuse.get(resource, 0) + 1
+                    started[task.name] = [datetime.datetime.now().isoformat(), time.time()]
+                    running[executor.submit(task.func, *task.args)] = task
+            if len(running) == 0:
+                if any(len(x) > 0 for x in ready.values()):
+                    continue # tasks queued by skipped tasks of another resource
+                break
+            done, pending = wait(list(running.keys()), return_when = FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                inuse[task.resource] -= 1
+                task.seconds = time.time() - started[task.name][1]
+                try:
+                    result = future.result()
+                    if task.oncomplete:
+                        task.oncomplete(result)
+                    status = 'complete'
+                except SystemExit:
+                    # The tools call sys.exit() on some errors, which would otherwise end the scheduler
+                    print('Error: task {} exited.'.format(task.name))
+                    ieo.logerror(task.name, 'Task exited.')
+                    status = 'failed'
+                except Exception as e:
+                    print('Error in task {}: {}'.format(task.name, e))
+                    ieo.logerror(task.name, e)
+                    status = 'failed'
+                print('Task {} {} in {:0.1f} s.'.format(task.name, status, task.seconds))
+                finish(task.name, status, started[task.name][0])
+    waiting = [name for name in tasks.keys() if tasks[name].status == 'waiting']
+    if len(waiting) > 0:
+        raise RuntimeError('Circular task dependencies: {}'.format(', '.join(waiting)))
+    return {name: tasks[name].status for name in tasks.keys()}
+
+## Library tasks
+
+def scenedate(scene):
+    # Acquisition date in YYYYDDD format of a 16 character scene ID
+    return scene[9:16]
+
+def datefiles(indir, d):
+    # Files of a product directory acquired on date d, as grouped by makevrts.makefiledict()
+    filelist = []
+    for f in glob.glob(os.path.join(indir, 'L*{}*.dat'.format(d))):
+        basename = os.path.basename(f)
+        if len(basename) > 40:
+            fd = basename[10:17]
+        else:
+            fd = basename[9:16]
+        if fd == d:
+            filelist.append(f)
+    return sorted(filelist)
+
+def librarylisting(indir):
+    # Returns a dict of date: files for a product directory, from a single directory listing
+    listing = {}
+    for f in glob.glob(os.path.join(indir, 'L*.dat')):
+        basename = os.path.basename(f)
+        if len(basename) > 40:
+            d = basename[10:17]
+        else:
+            d = basename[9:16]
+        if not d in listing.keys():
+            listing[d] = []
+        listing[d].append(f)
+    for d in listing.keys():
+        listing[d].sort()
+    return listing
+
+def membersource(indir, d, listing, live):
+    # Returns a function listing the members of a date. Dates with ingest tasks are listed when
+    # their VRT task runs, and other dates are taken from the listing made when the workflow started.
+    if live:
+        return lambda: datefiles(indir, d)
+    return lambda: listing.get(d, [])
+
+def findarchives(indir, ledger):
+    # Returns a dict of archive: scene ID for unfinished ESPA archives in the ingest directory
+    archives = {}
+    for root, dirs, files in os.walk(indir):
+        for name in files:
+            if name.endswith('.tar.gz'):
+                f = os.path.join(root, name)
+                scene = newespaimport.sceneidfromfilename(name)
+                if scene and not ledger.isfinished(f):
+                    archives[f] = scene
+    return archives
+
+def ingest(archives, args):
+    # newespaimport uses module level state, so ingest tasks share a resource with one worker
+    return newespaimport.run(stageargs(newespaimport, [], infiles = archives, aoi = args.aoi, workers = args.workers))
+
+def buildvrt(members, vrtdir, nodataval):
+    # Returns [VRT, member files], or None if there are too few members for a VRT
+    filelist = members()
+    if len(filelist) < 2:
+        return None
+    vrt = makevrts.makevrtfilename(vrtdir, filelist)
+    makevrts.makevrt(filelist, vrt, nodataval)
+    return [vrt, filelist]
+
+def vrtcomplete(catalog, manifest, indir, d):
+    # Records a built VRT in the catalog and the makevrts.py manifest, so that makevrts.py
+    # --incremental agrees with the workflow
+    def oncomplete(result):
+        if not result:
+            return
+        vrt, filelist = result
+        mkey = '{}/{}'.format(os.path.basename(indir), d)
+        if mkey in manifest.keys() and manifest[mkey]['vrt'] != vrt and os.path.isfile(manifest[mkey]['vrt']):
+            print('Removing superseded VRT: {}'.format(os.path.basename(manifest[mkey]['vrt'])))
+            os.remove(manifest[mkey]['vrt'])
+        manifest[mkey] = {'vrt': vrt, 'members': makevrts.memberstate(filelist)}
+        makevrts.writetocatalog(catalog, os.path.basename(indir), vrt, filelist, d)
+    return oncomplete
+
+def vrtuptodate(manifest, indir, d, vrtdir, members):
+    # VRTs built by makevrts.py before the workflow was first run are checked against its manifest
+    def uptodate():
+        filelist = members()
+        if len(filelist) < 2:
+            return True
+        return makevrts.isuptodate(manifest, '{}/{}'.format(os.path.basename(indir), d), makevrts.makevrtfilename(vrtdir, filelist), makevrts.memberstate(filelist))
+    return uptodate
+
+def librarysignature(srdir):
+    # Signature of the shapefile and the list of ingested SR files, the inputs of the processing list
+    flist = glob.glob(os.path.join(srdir, 'L*_ref_{}.dat'.format(ieo.projacronym))) + glob.glob(os.path.join(srdir, 'L1G', 'L*_ref_{}.dat'.format(ieo.projacronym)))
+    state = [sceneindex.shapefilestate(ieo.landsatshp), sorted(os.path.basename(f) for f in flist)]
+    return hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+
+def buildtasks(args, catalog, ledger, manifests):
+    tasks = {}
+    selected = [x.strip() for x in args.stages.split(',')]
+    ingestdeps = []
+    if 'update' in selected:
+        # The USGS inventory is queried at most once per day for the same query
+        updateargs = stageargs(updateshp, [], username = args.username, password = args.password, startdate = args.startdate)
+        tasks['update'] = Task('update', updateshp.run, (updateargs,), signature = lambda: '{} {}'.format(datetime.date.today().isoformat(), args.startdate), resource = 'network')
+        ingestdeps = ['update']
+    datetasks = {} # date: ingest task of scenes acquired on that date
+    if 'ingest' in selected:
+        archives = findarchives(args.indir, ledger)
+        datearchives = {}
+        for archive in sorted(archives.keys()):
+            d = scenedate(archives[archive])
+            if not d in datearchives.keys():
+                datearchives[d] = []
+            datearchives[d].append(archive)
+        print('{} archives from {} dates to be ingested.'.format(len(archives), len(datearchives)))
+        for d in sorted(datearchives.keys()):
+            name = 'ingest:{}'.format(d)
+            tasks[name] = Task(name, ingest, (datearchives[d], args), deps = ingestdeps, resource = 'ingest')
+            datetasks[d] = [name]
+    if 'vrt' in selected:
+        makevrts.args = stageargs(makevrts, ['--incremental'])
+        indirs, nodatavals = makevrts.getindirs()
+        for indir in indirs:
+            vrtdir = os.path.join(indir, 'vrt')
+            if not os.path.isdir(vrtdir):
+                os.mkdir(vrtdir)
+            manifests[vrtdir] = makevrts.readmanifest(vrtdir)
+            listing = librarylisting(indir)
+            dates = set(listing.keys()) | set(datetasks.keys())
+            if args.year:
+                dates = set(d for d in dates if d.startswith(str(args.year)))
+            for d in sorted(dates):
+                name = 'vrt:{}:{}'.format(os.path.basename(indir), d)
+                members = membersource(indir, d, listing, d in datetasks.keys())
+                tasks[name] = Task(name, buildvrt, (members, vrtdir, nodatavals[indir]), deps = datetasks.get(d, []),
+                    signature = (lambda members = members: filesignature(members())),
+                    oncomplete = vrtcomplete(catalog, manifests[vrtdir], indir, d), resource = 'vrt',
+                    uptodate = vrtuptodate(manifests[vrtdir], indir, d, vrtdir, members))
+    if 'proclist' in selected:
+        # Processing lists exclude scenes already in the library, so these wait for ingest
+        procargs = stageargs(MakeESPAproclist, [], aoi = args.aoi)
+        if args.startdate:
+            procargs.startdate = args.startdate.replace('-', '/')
+        # A failed ingest does not block the processing list
+        tasks['proclist'] = Task('proclist', MakeESPAproclist.run, (procargs,), deps = ingestdeps, softdeps = [name for name in tasks.keys() if name.startswith('ingest:')], signature = lambda: librarysignature(procargs.srdir))
+    return tasks
+
+def getparser():
+    parser = argparse.ArgumentParser('This script runs the Landsat library workflow as a dependency graph of scene and date tasks, skipping tasks whose inputs have not changed.')
+    parser.add_argument('--stages', type = str, default = 'update,ingest,vrt,proclist', help = 'Comma-delimited stages to include: update, ingest, vrt, proclist (default = all).')
+    parser.add_argument('-u','--username', type = str, default = None, help = 'USGS/EROS Registration System (ERS) username.')
+    parser.add_argument('-p', '--password', type = str, default = None, help = 'USGS/EROS Registration System (ERS) password.')
+    parser.add_argument('--startdate', type = str, default = None, help = 'Start date for the shapefile update and processing lists in YYYY-MM-DD format.')
+    parser.add_argument('-i', '--indir', type = str, default = ieo.ingestdir, help = 'Directory containing ESPA archives to be ingested.')
+    parser.add_argument('-y', '--year', type = int, default = None, help = 'Only create VRTs for a specific year.')
+    parser.add_argument('--aoi', type = str, default = None, help = 'Area of interest vector file, used for the processing lists and ingest.')
+    parser.add_argument('--workers', type = int, default = 1, help = 'Number of scene import workers within each ingest task.')
+    parser.add_argument('--vrtworkers', type = int, default = os.cpu_count(), help = 'Number of VRT tasks run in parallel (default = number of CPU cores).')
+    parser.add_argument('--catalog', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'vrt_catalog.sqlite'), help = 'VRT catalog database.')
+    parser.add_argument('--ledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ingest_ledger.sqlite'), help = 'SQLite ingest ledger.')
+    parser.add_argument('--state', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'workflow_state.sqlite'), help = 'SQLite database of task signatures and timings.')
+    parser.add_argument('--force', action = 'store_true', help = 'Run tasks even if their inputs have not changed.')
+    return parser
+
+def main(argv = None):
+    args = getparser().parse_args(argv)
+    starttime = time.time()
+    catalog = VRTCatalog(args.catalog)
+    ledger = IngestLedger(args.ledger)
+    state = TaskState(args.state)
+    manifests = {}
+    try:
+        tasks = buildtasks(args, catalog, ledger, manifests)
+        print('{} tasks in the workflow.'.format(len(tasks)))
+        # One ingest at a time, as ingest tasks share newespaimport module state; the remaining
+        # workers build VRTs
+        resources = {'network': 1, 'ingest': 1, 'vrt': max(args.vrtworkers or 1, 1)}
+        status = runtasks(tasks, state, workers = resources['vrt'] + 2, resources = resources, force = args.force)
+    finally:
+        for vrtdir in manifests.keys():
+            makevrts.writemanifest(vrtdir, manifests[vrtdir])
+        catalog.close()
+        ledger.close()
+        state.close()
+    counts = {}
+    for name in status.keys():
+        stage = name.split(':')[0]
+        if not stage in counts.keys():
+            counts[stage] = {}
+        counts[stage][status[name]] = counts[stage].get(status[name], 0) + 1
+    for stage in counts.keys():
+        print('{}: {}'.format(stage, ', '.join(['{} {}'.format(counts[stage][x], x) for x in sorted(counts[stage].keys())])))
+    print('Workflow finished in {:0.1f} s.'.format(time.time() - starttime))
+    return status
+
+if __name__ == '__main__':
+    main()
+    print('Processing complete.')
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module keeps a persistent SQLite ledger of scenes ordered from ESPA, built from the
+# processing lists written by MakeESPAproclist.py, so that scenes already ordered but not yet
+# downloaded or ingested are not ordered again. Lists are read once, and only new lists are read
+# on later runs. Orders expire after a number of days, after which a scene that still hasn't
+# been ingested may be ordered again. Run as a script, it imports lists and reports pending orders.
+
+import os, sys, glob, sqlite3, datetime, argparse
+
+def sceneidfromproductid(productid):
+    # Returns the 16 character scene ID of a product ID, e.g. LC08_L1TP_207023_20170101_... to
+    # LC82070232017001, or the first 16 characters of a scene ID
+    if len(productid) >= 40 and productid[4:5] == '_':
+        datestr = datetime.datetime.strptime(productid[17:25], '%Y%m%d').strftime('%Y%j')
+        return '{}{}{}{}'.format(productid[:2], productid[3:4], productid[10:16], datestr)
+    return productid[:16]
+
+def listdate(listfile):
+    # Creation time of a processing list, from its ESPA_list<YYYYmmdd-HHMMSS>.txt file name or its
+    # modification time
+    try:
+        return datetime.datetime.strptime(os.path.basename(listfile)[-19:-4], '%Y%m%d-%H%M%S')
+    except ValueError:
+        return datetime.datetime.fromtimestamp(os.path.getmtime(listfile))
+
+class OrderLedger(object):
+    def __init__(self, dbfile):
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile, timeout = 60)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS orders (
+                sceneid TEXT PRIMARY KEY,
+                productid TEXT,
+                listfile TEXT,
+                ordered TEXT)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS orders_ordered ON orders (ordered)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS lists (
+                listfile TEXT PRIMARY KEY,
+                mtime REAL,
+                scenes INTEGER)''')
+
+    def close(self):
+        self.conn.close()
+
+    def importlist(self, listfile):
+        # Records the scenes of one processing list. A scene keeps the date of its latest order.
+        ordered = listdate(listfile).isoformat()
+        productids = []
+        with open(listfile, 'r') as lines:
+            for line in lines:
+                line = line.strip()
+                if len(line) > 0:
+                    productids.append(line)
+        with self.conn:
+            self.conn.executemany('''INSERT INTO orders (sceneid, productid, listfile, ordered) VALUES (?, ?, ?, ?)
+                ON CONFLICT (sceneid) DO UPDATE SET productid = excluded.productid, listfile = excluded.listfile, ordered = excluded.ordered
+                WHERE excluded.ordered > orders.ordered''', [(sceneidfromproductid(x), x, os.path.basename(listfile), ordered) for x in productids])
+            self.conn.execute('INSERT OR REPLACE INTO lists (listfile, mtime, scenes) VALUES (?, ?, ?)', (os.path.basename(listfile), os.path.getmtime(listfile), len(productids)))
+        return len(productids)
+
+    def importlists(self, listdir):
+        # Reads processing lists in listdir that are new or modified since they were last read
+        known = {row['listfile']: row['mtime'] for row in self.conn.execute('SELECT listfile, mtime FROM lists')}
+        imported = 0
+        for listfile in sorted(glob.glob(os.path.join(listdir, 'ESPA_*list*.txt'))):
+            if known.get(os.path.basename(listfile)) != os.path.getmtime(listfile):
+                self.importlist(listfile)
+                imported += 1
+        return imported
+
+    def pending(self, expiry = 30, ingested = None):
+        # Returns the set of 16 character scene IDs ordered within the last expiry days (all orders
+        # if expiry is 0 or None), excluding those in the set ingested
+        if expiry:
+            since = (datetime.datetime.now() - datetime.timedelta(days = expiry)).isoformat()
+            rows = self.conn.execute('SELECT sceneid FROM orders WHERE ordered >= ?', (since,))
+        else:
+            rows = self.conn.execute('SELECT sceneid FROM orders')
+        scenes = set(row['sceneid'] for row in rows)
+        if ingested:
+            scenes -= set(ingested)
+        return scenes
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+
+if __name__ == '__main__':
+    try: # This is included as the module may not properly install in Anaconda.
+        import ieo
+    except:
+        print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+        ieodir = input('IEO installation path: ')
+        if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+            sys.path.append(r'D:\Data\IEO\ieo')
+            import ieo
+        else:
+            print('Error: that is not a valid path for the IEO module. Exiting.')
+            sys.exit()
+    from ingestledger import IngestLedger
+
+    parser = argparse.ArgumentParser('This script updates the ESPA order ledger from processing lists and reports pending orders.')
+    parser.add_argument('--orderledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'order_ledger.sqlite'), help = 'SQLite ESPA order ledger.')
+    parser.add_argument('--listdir', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ESPA_processing_lists'), help = 'Directory of processing lists written by MakeESPAproclist.py.')
+    parser.add_argument('--ledger', type = str, default = os.path.join(ieo.catdir, 'Landsat', 'ingest_ledger.sqlite'), help = 'SQLite ingest ledger.')
+    parser.add_argument('--expiry', type = int, default = 30, help = 'Days after which an order that has not been ingested expires (0 = never, default = 30).')
+    parser.add_argument('--list', action = 'store_true', help = 'Print the scene IDs of pending orders.')
+    args = parser.parse_args()
+
+    orders = OrderLedger(args.orderledger)
+    print('{} new or modified processing lists imported from: {}'.format(orders.importlists(args.listdir), args.listdir))
+    ledger = IngestLedger(args.ledger)
+    pending = orders.pending(args.expiry, ledger.ingestedscenes())
+    ledger.close()
+    print('{} scenes ordered, {} pending.'.format(orders.count(), len(pending)))
+    if args.list:
+        for sceneid in sorted(pending):
+            print(sceneid)
+    orders.close()
+
+    print('Processing complete.')
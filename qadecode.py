@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module decodes ingested pixel QA and Fmask layers with precomputed lookup tables, so that
+# raw values are mapped to surface classes with a single vectorised gather rather than per-pixel
+# bitwise logic. Pixel QA tables have 65,536 entries, one per possible 16-bit value, and are built
+# once per sensor. Decoded classes use the Fmask class values, so that both mask types decode to
+# the same layer. Any integer array may be decoded, including numpy.memmap arrays of ENVI files.
+
+import numpy as np
+
+# Decoded class values, as used by Fmask
+clear = 0 # clear land
+water = 1
+shadow = 2
+snow = 3
+cloud = 4
+unclassified = 254
+fill = 255
+classes = {'clear': clear, 'water': water, 'shadow': shadow, 'snow': snow, 'cloud': cloud}
+
+tables = {}
+
+def pixelqaclasses(values, landsat):
+    # Bitwise decoding of pixel QA values. Bits: 0 = fill, 1 = clear, 2 = water, 3 = cloud shadow,
+    # 4 = snow, 5 = cloud. Landsat 8 also flags terrain occlusion in bit 10, which is treated as fill.
+    # Where several bits are set, fill takes precedence, then cloud, shadow, snow, water, and clear.
+    values = np.asarray(values).astype(np.uint16)
+    out = np.full(values.shape, unclassified, dtype = np.uint8)
+    for bit, value in [[1, clear], [2, water], [4, snow], [3, shadow], [5, cloud]]:
+        out[(values & (1 << bit)) > 0] = value
+    out[(values & 1) > 0] = fill
+    if landsat == 8:
+        out[(values & 1024) > 0] = fill
+    return out
+
+def fmaskclasses(values):
+    values = np.asarray(values).astype(np.uint16)
+    out = np.full(values.shape, unclassified, dtype = np.uint8)
+    for value in list(classes.values()) + [fill]:
+        out[values == value] = value
+    return out
+
+def table(masktype, landsat = None):
+    # Returns the class lookup table for a mask type and, for pixel QA, a Landsat number
+    if masktype == 'pixel_qa':
+        if landsat == 8:
+            key = 'pixel_qa_L8'
+        else:
+            key = 'pixel_qa_L47'
+            landsat = 7
+    else:
+        key = 'cfmask'
+    if not key in tables.keys():
+        values = np.arange(65536, dtype = np.uint32)
+        if masktype == 'pixel_qa':
+            tables[key] = pixelqaclasses(values, landsat)
+        else:
+            tables[key] = fmaskclasses(values)
+        tables[key].setflags(write = False)
+    return tables[key]
+
+def cleartable(masktype, landsat = None):
+    # Boolean lookup table of clear land pixels
+    key = 'clear_{}_{}'.format(masktype, landsat == 8)
+    if not key in tables.keys():
+        tables[key] = table(masktype, landsat) == clear
+        tables[key].setflags(write = False)
+    return tables[key]
+
+def asindex(mask):
+    # Signed and wider integer types are reinterpreted or cast to uint16 for indexing
+    mask = np.asarray(mask)
+    if mask.dtype == np.uint8 or mask.dtype == np.uint16:
+        return mask
+    if mask.dtype == np.int16:
+        return mask.view(np.uint16)
+    return mask.astype(np.uint16)
+
+def decode(mask, masktype, landsat = None, out = None):
+    # Returns an array of class values for a block of pixel QA or Fmask data
+    return np.take(table(masktype, landsat), asindex(mask), out = out)
+
+def clearland(mask, masktype, landsat = None):
+    # Returns a boolean array of clear land pixels
+    return np.take(cleartable(masktype, landsat), asindex(mask))
+
+def classcounts(mask, masktype, landsat = None):
+    # Returns [dict of class name: pixel count, number of non-fill pixels]
+    counts = np.bincount(decode(mask, masktype, landsat).ravel(), minlength = 256)
+    return {name: int(counts[classes[name]]) for name in classes.keys()}, int(counts.sum() - counts[fill])
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module keeps a persistent spatial index of the scene footprints in ieo.landsatshp, in an
+# SQLite database with an R*Tree of footprint bounding boxes. Point, bounding box, and polygon
+# queries, combined with date and cloud cover filters, test only the footprints whose bounding
+# boxes intersect the query, rather than every polygon in the shapefile. updateshp.py adds new
+# footprints to the index as they are written. Run as a script, it syncs or queries the index.
+
+import os, sys, sqlite3, datetime, argparse
+from osgeo import ogr, osr
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+def defaultindex():
+    return os.path.join(ieo.catdir, 'Landsat', 'scene_index.sqlite')
+
+def shapefilestate(shapefile):
+    # Modification time of the shapefile, taken from its geometry and attribute files
+    mtimes = [os.path.getmtime(f) for f in [shapefile, os.path.splitext(shapefile)[0] + '.dbf'] if os.path.isfile(f)]
+    if len(mtimes) == 0:
+        return None
+    return max(mtimes)
+
+def aoigeometry(aoifile):
+    # Returns the union of all geometries in a vector file, in the local projection
+    data_source = ogr.Open(aoifile, 0)
+    if not data_source:
+        raise IOError('Unable to open AOI file: {}'.format(aoifile))
+    layer = data_source.GetLayer()
+    srs = layer.GetSpatialRef()
+    transform = None
+    if srs and not srs.IsSame(ieo.prj):
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(srs, ieo.prj)
+    geom = None
+    for feature in layer:
+        g = feature.GetGeometryRef().Clone()
+        if transform:
+            g.Transform(transform)
+        if geom:
+            geom = geom.Union(g)
+        else:
+            geom = g
+    data_source = None
+    return geom
+
+class SceneIndex(object):
+    def __init__(self, dbfile = None):
+        if not dbfile:
+            dbfile = defaultindex()
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile, timeout = 60)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS scenes (
+                id INTEGER PRIMARY KEY,
+                sceneid TEXT UNIQUE,
+                productid TEXT,
+                acqdate TEXT,
+                path INTEGER,
+                row INTEGER,
+                cc REAL,
+                ccland REAL,
+                geom BLOB)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS scenes_acqdate ON scenes (acqdate)')
+            self.conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree (id, minx, maxx, miny, maxy)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def upsert(self, sceneid, productid, acqdate, path, row, cc, ccland, geom):
+        # acqdate is a string in YYYY-MM-DD format, geom an OGR geometry in the local projection
+        existing = self.conn.execute('SELECT id FROM scenes WHERE sceneid = ?', (sceneid,)).fetchone()
+        if existing:
+            self.conn.execute('UPDATE scenes SET productid = ?, acqdate = ?, path = ?, row = ?, cc = ?, ccland = ?, geom = ? WHERE id = ?',
+                (productid, acqdate, path, row, cc, ccland, bytes(geom.ExportToWkb()), existing['id']))
+            rowid = existing['id']
+            self.conn.execute('DELETE FROM footprints WHERE id = ?', (rowid,))
+        else:
+            rowid = self.conn.execute('INSERT INTO scenes (sceneid, productid, acqdate, path, row, cc, ccland, geom) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (sceneid, productid, acqdate, path, row, cc, ccland, bytes(geom.ExportToWkb()))).lastrowid
+        minX, maxX, minY, maxY = geom.GetEnvelope()
+        self.conn.execute('INSERT INTO footprints (id, minx, maxx, miny, maxy) VALUES (?, ?, ?, ?, ?)', (rowid, minX, maxX, minY, maxY))
+
+    def addfeature(self, feature):
+        # Adds or updates a footprint from an ieo.landsatshp feature. Returns the scene ID.
+        sceneID = feature.GetField('sceneID')
+        geom = feature.GetGeometryRef()
+        if not sceneID or not geom:
+            return None
+        acqdate = feature.GetField('acqDate')
+        if acqdate:
+            acqdate = acqdate.replace('/', '-')
+        else:
+            acqdate = datetime.datetime.strptime(sceneID[9:16], '%Y%j').strftime('%Y-%m-%d')
+        self.upsert(sceneID, feature.GetField('LandsatPID'), acqdate, feature.GetField('path'), feature.GetField('row'),
+                    feature.GetField('CCFull'), feature.GetField('CCLand'), geom)
+        return sceneID
+
+    def insync(self, shapefile):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if not row:
+            return False
+        source = row['value'].split('|')
+        return source[0] == os.path.abspath(shapefile) and source[1] == str(shapefilestate(shapefile))
+
+    def setsource(self, shapefile):
+        # Records the shapefile the index is in sync with
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)", ('{}|{}'.format(os.path.abspath(shapefile), shapefilestate(shapefile)),))
+
+    def rebuild(self, layer):
+        # Replaces the contents of the index with the features of an open layer
+        layer.ResetReading()
+        with self.conn:
+            self.conn.execute('DELETE FROM scenes')
+            self.conn.execute('DELETE FROM footprints')
+            for feature in layer:
+                self.addfeature(feature)
+        layer.ResetReading()
+
+    def sync(self, shapefile, force = False):
+        # Rebuilds the index if the shapefile has been modified since the index was last synced
+        if not force and self.insync(shapefile):
+            return False
+        print('Updating scene index from: {}'.format(shapefile))
+        data_source = ogr.Open(shapefile, 0)
+        if not data_source:
+            raise IOError('Unable to open: {}'.format(shapefile))
+        self.rebuild(data_source.GetLayer())
+        data_source = None
+        self.setsource(shapefile)
+        return True
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM scenes').fetchone()[0]
+
+    def query(self, geom = None, bbox = None, point = None, startdate = None, enddate = None, maxcc = None, maxccland = None):
+        # Returns a list of scene IDs. geom is an OGR geometry, bbox [minX, minY, maxX, maxY], and
+        # point [X, Y], all in the local projection. Dates are strings in YYYY-MM-DD format.
+        if point:
+            geom = ogr.Geometry(ogr.wkbPoint)
+            geom.AddPoint(point[0], point[1])
+        elif bbox:
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            for x, y in [[bbox[0], bbox[1]], [bbox[0], bbox[3]], [bbox[2], bbox[3]], [bbox[2], bbox[1]], [bbox[0], bbox[1]]]:
+                ring.AddPoint(x, y)
+            geom = ogr.Geometry(ogr.wkbPolygon)
+            geom.AddGeometry(ring)
+        sql = 'SELECT s.sceneid, s.geom FROM scenes s'
+        conditions = []
+        values = []
+        if geom:
+            minX, maxX, minY, maxY = geom.GetEnvelope()
+            sql += ' JOIN footprints f ON f.id = s.id'
+            conditions.extend(['f.maxx >= ?', 'f.minx <= ?', 'f.maxy >= ?', 'f.miny <= ?'])
+            values.extend([minX, maxX, minY, maxY])
+        for condition, value in [['s.acqdate >= ?', startdate], ['s.acqdate <= ?', enddate], ['s.cc <= ?', maxcc], ['s.ccland <= ?', maxccland]]:
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+        if len(conditions) > 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY s.acqdate, s.sceneid'
+        sceneIDs = []
+        for row in self.conn.execute(sql, values):
+            # Bounding box matches are confirmed against the footprint polygon
+            if geom and not ogr.CreateGeometryFromWkb(row['geom']).Intersects(geom):
+                continue
+            sceneIDs.append(row['sceneid'])
+        return sceneIDs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script syncs or queries the spatial index of Landsat scene footprints.')
+    parser.add_argument('--index', type = str, default = None, help = 'Scene index database (default = scene_index.sqlite in the Landsat catalog directory).')
+    parser.add_argument('--shp', type = str, default = ieo.landsatshp, help = 'Scene footprint shapefile (default = ieo.landsatshp).')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'Rebuild the index even if it is in sync with the shapefile.')
+    parser.add_argument('--aoi', type = str, default = None, help = 'Return scenes intersecting the features of this vector file.')
+    parser.add_argument('--bbox', type = str, default = None, help = 'Return scenes intersecting a bounding box in the local projection: minX,minY,maxX,maxY')
+    parser.add_argument('--point', type = str, default = None, help = 'Return scenes containing a point in the local projection: X,Y')
+    parser.add_argument('--startdate', type = str, default = None, help = 'Starting date, YYYY/MM/DD')
+    parser.add_argument('--enddate', type = str, default = None, help = 'Ending date, YYYY/MM/DD')
+    parser.add_argument('--maxcc', type = float, default = None, help = 'Maximum scene cloud cover in percent.')
+    parser.add_argument('--maxccland', type = float, default = None, help = 'Maximum land cloud cover in percent.')
+    args = parser.parse_args()
+
+    index = SceneIndex(args.index)
+    index.sync(args.shp, force = args.rebuild)
+    print('{} scenes in index: {}'.format(index.count(), index.dbfile))
+    geom, bbox, point = None, None, None
+    if args.aoi:
+        geom = aoigeometry(args.aoi)
+    elif args.bbox:
+        bbox = [float(x) for x in args.bbox.split(',')]
+    elif args.point:
+        point = [float(x) for x in args.point.split(',')]
+    startdate, enddate = None, None
+    if args.startdate:
+        startdate = datetime.datetime.strptime(args.startdate, '%Y/%m/%d').strftime('%Y-%m-%d')
+    if args.enddate:
+        enddate = datetime.datetime.strptime(args.enddate, '%Y/%m/%d').strftime('%Y-%m-%d')
+    if geom or bbox or point or startdate or enddate or args.maxcc is not None or args.maxccland is not None:
+        for sceneID in index.query(geom = geom, bbox = bbox, point = point, startdate = startdate, enddate = enddate, maxcc = args.maxcc, maxccland = args.maxccland):
+            print(sceneID)
+    index.close()
@@ -26,6 +26,8 @@ except:
         print('Error: that is not a valid path for the IEO module. Exiting.')
         sys.exit()
 
+import sceneindex
+
 if sys.version_info[0] == 2:
     import ConfigParser as configparser
     from urllib import urlretrieve
@@ -44,27 +46,26 @@ config.read(config_location) # config_path
 pathrowvals = config['DEFAULT']['pathrowvals'] # this is a comma-delimited string containing multiples of four values: start path, end path, start row, end row. It is designed to query rectangular path/row combinations, in order to avoid scenes that don't touch landmasses or are not of interest. 
 useWRS2 = config['DEFAULT']['useWRS2'] # Setting this parameter to "Yes" in updateshp.ini will query WRS-2 Path/ Row field values from ieo.WRS2, and may result in a great increase in the number of queries to USGS servers
 
-parser = argparse.ArgumentParser('This script imports LEDAPS-processed scenes into the local library. It stacks images and converts them to the locally defined projection in IEO, and adds ENVI metadata.')
-#parser.add_argument('-x','--xml', type = bool, default = False, help = 'Use downloaded XML files from USGS.')
-#parser.add_argument('-j','--json', type = bool, default = True, help = 'Use JSON query (Default = True).')
-parser.add_argument('-u','--username', type = str, default = None, help = 'USGS/EROS Registration System (ERS) username.')
-parser.add_argument('-p', '--password', type = str, default = None, help = 'USGS/EROS Registration System (ERS) password.')
-parser.add_argument('-c', '--catalogID', type = str, default = 'EE', help = 'USGS/EROS Catalog ID (default = "EE").')
-parser.add_argument('-v', '--version', type = str, default = "1.4.0", help = 'JSON version, default = 1.4.0.')
-parser.add_argument('--startdate', type = str, default = "1982-01-01", help = 'Start date for query in YYYY-MM-DD format. (Default = 1982-01-01).')
-parser.add_argument('--enddate', type = str, default = None, help = "End date for query in YYYY-MM-DD format. (Default = today's date).")
-parser.add_argument('-m', '--MBR', type = str, default = None, help = 'Minimum Bounding Rectangle (MBR) coordinates in decimal degrees in the following format (comma delimited, no spaces): lower left latitude, lower left longitude, upper right latitude, upper right longitude. If not supplied, these will be determined from WRS-2 Paths and Rows in updateshp.ini.')
-parser.add_argument('-b', '--baseURL', type = str, default = 'https://earthexplorer.usgs.gov/inventory/json/v/', help = 'Base URL to use excluding JSON version (Default = "https://earthexplorer.usgs.gov/inventory/json/v/").')
-parser.add_argument('--maxResults', type = int, default = 50000, help = 'Maximum number of results to return (1 - 50000, default = 50000).')
-parser.add_argument('--overwrite', type = bool, default = False, help = 'Overwrite existing files.')
-parser.add_argument('--thumbnails', type = bool, default = True, help = 'Download thumbnails (default = True).')
-args = parser.parse_args()
-
-if not (args.username and args.password):
-    if not args.username:
-        args.username = input('USGS/ERS username: ')
-    if not args.password:
-        args.password = getpass.getpass('USGS/ERS password: ')
+args = None # Set by run()
+today = datetime.datetime.today()
+dlurl = None
+
+def getparser():
+    parser = argparse.ArgumentParser('This script imports LEDAPS-processed scenes into the local library. It stacks images and converts them to the locally defined projection in IEO, and adds ENVI metadata.')
+    #parser.add_argument('-x','--xml', type = bool, default = False, help = 'Use downloaded XML files from USGS.')
+    #parser.add_argument('-j','--json', type = bool, default = True, help = 'Use JSON query (Default = True).')
+    parser.add_argument('-u','--username', type = str, default = None, help = 'USGS/EROS Registration System (ERS) username.')
+    parser.add_argument('-p', '--password', type = str, default = None, help = 'USGS/EROS Registration System (ERS) password.')
+    parser.add_argument('-c', '--catalogID', type = str, default = 'EE', help = 'USGS/EROS Catalog ID (default = "EE").')
+    parser.add_argument('-v', '--version', type = str, default = "1.4.0", help = 'JSON version, default = 1.4.0.')
+    parser.add_argument('--startdate', type = str, default = "1982-01-01", help = 'Start date for query in YYYY-MM-DD format. (Default = 1982-01-01).')
+    parser.add_argument('--enddate', type = str, default = None, help = "End date for query in YYYY-MM-DD format. (Default = today's date).")
+    parser.add_argument('-m', '--MBR', type = str, default = None, help = 'Minimum Bounding Rectangle (MBR) coordinates in decimal degrees in the following format (comma delimited, no spaces): lower left latitude, lower left longitude, upper right latitude, upper right longitude. If not supplied, these will be determined from WRS-2 Paths and Rows in updateshp.ini.')
+    parser.add_argument('-b', '--baseURL', type = str, default = 'https://earthexplorer.usgs.gov/inventory/json/v/', help = 'Base URL to use excluding JSON version (Default = "https://earthexplorer.usgs.gov/inventory/json/v/").')
+    parser.add_argument('--maxResults', type = int, default = 50000, help = 'Maximum number of results to return (1 - 50000, default = 50000).')
+    parser.add_argument('--overwrite', type = bool, default = False, help = 'Overwrite existing files.')
+    parser.add_argument('--thumbnails', type = bool, default = True, help = 'Download thumbnails (default = True).')
+    return parser
 
 #pathrows = []
 subpathrow = []
@@ -80,11 +81,6 @@ shapefile = ieo.landsatshp
 layername = os.path.basename(shapefile)[:-4] # assumes a shapefile ending in '.shp'
 addfields = ['MaskType', 'Thumb_JPG', 'SR_path', 'BT', 'Fmask', 'Pixel_QA', 'NDVI', 'EVI']
 errorlist = []
-scenelist = []
-if not args.enddate:
-    today = datetime.datetime.today()
-    args.enddate = today.strftime('%Y-%m-%d')
-
 errorfile = os.path.join(logdir, 'Landsat_inventory_download_errors.csv')
 errorsfound = False
 
@@ -98,44 +94,48 @@ pathrowstrs = [] # list of strings containing WRS-2 Path/ Row combinations
 paths = [] # list containing WRS-2 Paths
 rows = [] # List containing WRS-2 Rows
 
-if useWRS2.lower() == 'yes':
-#   gdb, wrs = os.path.split(ieo.WRS2)
-    print('Getting WRS-2 Path/Row combinations from shapefile: {}'.format(ieo.WRS2))
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    print('WRS-2 = {}'.format(ieo.WRS2))
-    ds = driver.Open(ieo.WRS2, 0)
-    layer = ds.GetLayer()
-    for feature in layer:
-        path = feature.GetField('PATH')
-        if not path in paths:
-            paths.append(path)
-        row = feature.GetField('ROW')
-        if not row in rows:
-            rows.append(row)
-        pathrowstrs.append('{:03d}{:03d}'.format(path, row))    
-#            pathrows.append([path, path, row, row])
-    ds = None
-else:
-    print('Using WRS-2 Path/Row combinations from INI file.')
-    pathrowvals = pathrowvals.split(',')
-#    print(pathrowvals)
-    iterations = int(len(pathrowvals) / 4)
-#    print('Iterations = {}'.format(iterations))
-    for i in range(iterations): 
-        for j in range(int(pathrowvals[i * 4]), int(pathrowvals[i * 4 + 1]) + 1):
-#            print('j = {}'.format(j))
-            if not j in paths:
-                paths.append(j)
-            for k in range(int(pathrowvals[i * 4 + 2]), int(pathrowvals[i * 4 + 3]) + 1): 
-#                print('k = {}'.format(k))
-                pathrowstrs.append('{:03d}{:03d}'.format(j, k))
-                if not k in rows:
-                    rows.append(k)
-
-#print('Paths')
-#print(paths)
-#print('Rows')
-#print(rows)
+def loadpathrows():
+    # Fills paths, rows, and pathrowstrs from ieo.WRS2 or updateshp.ini, once per process
+    if len(pathrowstrs) > 0:
+        return
+    if useWRS2.lower() == 'yes':
+    #   gdb, wrs = os.path.split(ieo.WRS2)
+        print('Getting WRS-2 Path/Row combinations from shapefile: {}'.format(ieo.WRS2))
+        driver = ogr.GetDriverByName("ESRI Shapefile")
+        print('WRS-2 = {}'.format(ieo.WRS2))
+        ds = driver.Open(ieo.WRS2, 0)
+        layer = ds.GetLayer()
+        for feature in layer:
+            path = feature.GetField('PATH')
+            if not path in paths:
+                paths.append(path)
+            row = feature.GetField('ROW')
+            if not row in rows:
+                rows.append(row)
+            pathrowstrs.append('{:03d}{:03d}'.format(path, row))    
+    #            pathrows.append([path, path, row, row])
+        ds = None
+    else:
+        print('Using WRS-2 Path/Row combinations from INI file.')
+        vals = pathrowvals.split(',')
+    #    print(pathrowvals)
+        iterations = int(len(vals) / 4)
+    #    print('Iterations = {}'.format(iterations))
+        for i in range(iterations): 
+            for j in range(int(vals[i * 4]), int(vals[i * 4 + 1]) + 1):
+    #            print('j = {}'.format(j))
+                if not j in paths:
+                    paths.append(j)
+                for k in range(int(vals[i * 4 + 2]), int(vals[i * 4 + 3]) + 1): 
+    #                print('k = {}'.format(k))
+                    pathrowstrs.append('{:03d}{:03d}'.format(j, k))
+                    if not k in rows:
+                        rows.append(k)
+
+    #print('Paths')
+    #print(paths)
+    #print('Rows')
+    #print(rows)
 
 #if not localxmls and len(xmls) == 0:
 #    if useWRS2.lower() == 'yes':
@@ -150,13 +150,13 @@ else:
 #            xmls.append('Metadata_{}{:03d}.xml'.format(path, row))
 #        ds = None
 #    else:
-#        pathrowvals = pathrowvals.split(',')
-#        numxmls = len(pathrowvals) / 4
+#        vals = pathrowvals.split(',')
+#        numxmls = len(vals) / 4
 #        xmlnum = 1
 #        i = 0
 #        if numxmls > 0:
 #            while xmlnum <= numxmls:
-#                subpathrow.append(int(pathrowvals[i]))
+#                subpathrow.append(int(vals[i]))
 #                i += 1
 #                if i % 4 == 0:
 #                    xmls.append('Metadata_{}.xml'.format(xmlnum))
@@ -459,31 +459,6 @@ def reporthook(blocknum, blocksize, totalsize):
             sys.stderr.write("\n")
     else: # total size is unknown
         sys.stderr.write("read %d\n" % (readsofar,))
-
-if args.MBR: # define MBR for scene queries
-    args.MBR = args.MBR.split(',')
-    if len(args.MBR) != 4:
-        ieo.logerror('--MBR', 'Total number of coordinates does not equal four.', errorfile = errorfile)
-        print('Error: Improper number of coordinates for --MBR set (must be four). Either remove this option (will use default values) or fix. Exiting.')
-        sys.exit()
-else:
-    args.MBR = getMBR()
-
-# This section borrowed from https://pcjericks.github.io/py-gdalogr-cookbook/projection.html
-# Lat/ Lon WGS-84 to local projection transformation
-source = osr.SpatialReference() # Lat/Lon WGS-64
-source.ImportFromEPSG(4326)
-
-#target = osr.SpatialReference()
-#i = ieo.prjstr.find(':') + 1
-#target.ImportFromEPSG(int(ieo.prjstr[i:])) # EPSG code set in ieo.ini 
-target = ieo.prj
-
-transform = osr.CoordinateTransformation(source, target)
-
-# Create Shapefile
-driver = ogr.GetDriverByName("ESRI Shapefile")
-
 polycoords = ['UL Corner Lat dec', 'UL Corner Long ec', 'UR Corner Lat dec', 'UR Corner Long dec', 'LL Corner Lat dec', 'LL Corner Long dec', 'LR Corner Lat dec', 'LR Corner Long dec']
 
 # fieldvaluelist element format: [shapefile fieldname, XML tag, JSON fieldname, OGR type, field length]
@@ -604,238 +579,297 @@ for element in fieldvaluelist:
 #    tagvals.append([element[1], element[3], element[4]])
 #    tags.append(element[1])
 
-if not os.access(shapefile, os.F_OK):
+def run(runargs):
+    # Adds new scenes found by the USGS query for parsed arguments runargs to ieo.landsatshp, and
+    # returns their scene IDs. WRS-2 Paths and Rows are only read once per process.
+    global args, errorsfound, today, dlurl
+    args = runargs
+    errorsfound = False
+    scenelist = []
+    added = []
+    if not (args.username and args.password):
+        if not args.username:
+            args.username = input('USGS/ERS username: ')
+        if not args.password:
+            args.password = getpass.getpass('USGS/ERS password: ')
+
+    today = datetime.datetime.today()
+    if not args.enddate:
+        args.enddate = today.strftime('%Y-%m-%d')
+
+    loadpathrows()
+    if isinstance(args.MBR, str): # define MBR for scene queries
+        args.MBR = args.MBR.split(',')
+        if len(args.MBR) != 4:
+            ieo.logerror('--MBR', 'Total number of coordinates does not equal four.', errorfile = errorfile)
+            print('Error: Improper number of coordinates for --MBR set (must be four). Either remove this option (will use default values) or fix. Exiting.')
+            sys.exit()
+    elif not args.MBR:
+        args.MBR = getMBR()
+
+    source = osr.SpatialReference() # Lat/Lon WGS-64
+    source.ImportFromEPSG(4326)
+
+    #target = osr.SpatialReference()
+    #i = ieo.prjstr.find(':') + 1
+    #target.ImportFromEPSG(int(ieo.prjstr[i:])) # EPSG code set in ieo.ini 
+    target = ieo.prj
+
+    transform = osr.CoordinateTransformation(source, target)
+
     # Create Shapefile
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+
+    if not os.access(shapefile, os.F_OK):
+        # Create Shapefile
     
-    data_source = driver.CreateDataSource(shapefile)
-    layer = data_source.CreateLayer(layername, target, ogr.wkbPolygon)
-    for element in fieldvaluelist:
-        field_name = ogr.FieldDefn(element[0], element[3])
-        if element[4] > 0:
-            field_name.SetWidth(element[4])
-        layer.CreateField(field_name)
+        data_source = driver.CreateDataSource(shapefile)
+        layer = data_source.CreateLayer(layername, target, ogr.wkbPolygon)
+        for element in fieldvaluelist:
+            field_name = ogr.FieldDefn(element[0], element[3])
+            if element[4] > 0:
+                field_name.SetWidth(element[4])
+            layer.CreateField(field_name)
         
-    layer.CreateField(ogr.FieldDefn('MaskType', ogr.OFTString)) # 'Fmask' or 'Pixel_QA'
-    layer.CreateField(ogr.FieldDefn('Thumb_JPG', ogr.OFTString))
-    layer.CreateField(ogr.FieldDefn('SR_path', ogr.OFTString))
-    layer.CreateField(ogr.FieldDefn('BT_path', ogr.OFTString))
-    layer.CreateField(ogr.FieldDefn('Fmask_path', ogr.OFTString))
-    layer.CreateField(ogr.FieldDefn('PixQA_path', ogr.OFTString))
-    layer.CreateField(ogr.FieldDefn('NDVI_path', ogr.OFTString))
-    layer.CreateField(ogr.FieldDefn('EVI_path', ogr.OFTString))
-    spatialRef = ieo.prj
-    spatialRef.MorphToESRI()
-    with open(shapefile.replace('.shp', '.prj'), 'w') as output:
-        output.write(spatialRef.ExportToWkt())
+        layer.CreateField(ogr.FieldDefn('MaskType', ogr.OFTString)) # 'Fmask' or 'Pixel_QA'
+        layer.CreateField(ogr.FieldDefn('Thumb_JPG', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('SR_path', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('BT_path', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('Fmask_path', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('PixQA_path', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('NDVI_path', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('EVI_path', ogr.OFTString))
+        spatialRef = ieo.prj
+        spatialRef.MorphToESRI()
+        with open(shapefile.replace('.shp', '.prj'), 'w') as output:
+            output.write(spatialRef.ExportToWkt())
 
     
-else:
-    shpfnames = []
-    # Open existing shapefile with write access
-    data_source = driver.Open(shapefile, 1)
-    layer = data_source.GetLayer()
-    layerDefinition = layer.GetLayerDefn()
-    # Get list of field names 
-    for i in range(layerDefinition.GetFieldCount()):
-        shpfnames.append(layerDefinition.GetFieldDefn(i).GetName())
-    # Find missing fields and create them
-    for fname in fnames:
-        if not fname in shpfnames:
-            i = fnames.index(fname)
-            field_name = ogr.FieldDefn(fnames[i], fieldvaluelist[i][3])
-            if fieldvaluelist[i][4] > 0:
-                field_name.SetWidth(fieldvaluelist[i][4])
-            layer.CreateField(field_name)
+    else:
+        shpfnames = []
+        # Open existing shapefile with write access
+        data_source = driver.Open(shapefile, 1)
+        layer = data_source.GetLayer()
+        layerDefinition = layer.GetLayerDefn()
+        # Get list of field names 
+        for i in range(layerDefinition.GetFieldCount()):
+            shpfnames.append(layerDefinition.GetFieldDefn(i).GetName())
+        # Find missing fields and create them
+        for fname in fnames:
+            if not fname in shpfnames:
+                i = fnames.index(fname)
+                field_name = ogr.FieldDefn(fnames[i], fieldvaluelist[i][3])
+                if fieldvaluelist[i][4] > 0:
+                    field_name.SetWidth(fieldvaluelist[i][4])
+                layer.CreateField(field_name)
+
+        # Iterate through features and fetch sceneID values
+        for feature in layer:
+            scenelist.append(feature.GetField("sceneID"))
+
+    # The spatial index of footprints is rebuilt if the shapefile has been modified elsewhere since it
+    # was last synced, and new footprints are added to it as they are written.
+    index = sceneindex.SceneIndex()
+    if not index.insync(shapefile):
+        print('Updating scene index: {}'.format(index.dbfile))
+        index.rebuild(layer)
+
+    fielddict = {'BT_path' : {'ext' : '_BT_{}.dat'.format(ieo.projacronym), 'dirname' : ieo.btdir}, 
+                'Fmask_path' : {'ext' : '_cfmask.dat', 'dirname' : ieo.fmaskdir},
+                'PixQA_path' : {'ext' : '_pixel_qa.dat', 'dirname' : ieo.pixelqadir},
+                'NDVI_path' : {'ext' : '_NDVI.dat', 'dirname' : ieo.ndvidir},
+                'EVI_path' : {'ext' : '_EVI.dat', 'dirname' : ieo.evidir}}
+
+    thumbnails = []
+    scenes = []
+    filenum = 1
+
+    # get apiKey for USGS EarthExplorer query
+    apiKey = getapiKey()
+
+    # run query
+
+    scenedict = scenesearch(apiKey, scenelist)
+    sceneIDs = scenedict.keys()
+    print('Total scenes to be added to shapefile: {}'.format(len(sceneIDs)))
 
-    # Iterate through features and fetch sceneID values
-    for feature in layer:
-        scenelist.append(feature.GetField("sceneID"))
-
-fielddict = {'BT_path' : {'ext' : '_BT_{}.dat'.format(ieo.projacronym), 'dirname' : ieo.btdir}, 
-            'Fmask_path' : {'ext' : '_cfmask.dat', 'dirname' : ieo.fmaskdir},
-            'PixQA_path' : {'ext' : '_pixel_qa.dat', 'dirname' : ieo.pixelqadir},
-            'NDVI_path' : {'ext' : '_NDVI.dat', 'dirname' : ieo.ndvidir},
-            'EVI_path' : {'ext' : '_EVI.dat', 'dirname' : ieo.evidir}}
-
-thumbnails = []
-scenes = []
-filenum = 1
-
-# get apiKey for USGS EarthExplorer query
-apiKey = getapiKey()
-
-# run query
-
-scenedict = scenesearch(apiKey, scenelist)
-sceneIDs = scenedict.keys()
-print('Total scenes to be added to shapefile: {}'.format(len(sceneIDs)))
-
-#numfiles = len(xmls)
-#xmldict = {}
-
-# Download XML files from USGS/EROS
-#if not localxmls:
-#    print(dlxmls(args.startdate, args.enddate, xmls, ingestdir))
-
-# Parse XML files
-#for xml in xmls:
-#    print('Processing {}, file number {} of {}.'.format(xml, filenum, numfiles))
-#    xmlfile = os.path.join(ingestdir, xml)
-#    tree = ET.parse(xmlfile)
-#    root = tree.getroot()
-##    headervals = []
-##    for i in range(len(root[1])):
-##        j = root[1][i].tag.find('}') + 1
-##        if not root[1][i].tag[j:] in polycoords:
-##            headervals.append(root[1][i].tag[j:])
-#    
-#    numnodes = len(root)
-#    for i in range(numnodes):
-#        tdict = {} # Version 1.1.1: Now uses a dict rather than absolute position in XML node for fields and values
-#        for j in range(len(root[i])):
-#            k = root[i][j].tag.find('}') + 1
-#            tagname = root[i][j].tag[k:]
-#            if not tagname in polycoords:
-#                fname = fnames[tags.index(tagname)]
-#                tdict[fname] = root[i][j].text
-#            elif tagname in polycoords:
-#                tdict[tagname] = root[i][j].text
-#            else:
-#                print('ERROR: Discovered previously unused XML tag {}, logging to error file: '.format(tagname, errorfile))
-#                ieo.logerror(xml, 'Unused XML tag: {}'.format(tagname), errorfile = errorfile)
-#                errorsfound = True
-#        
-#        sys.stderr.write('\rProcessing node {} of {}.'.format(i + 1, numnodes))
-#        if len(root[i]) > 10:
-#            sceneID = tdict['sceneID']
-#            xmldict[sceneID] = tdict
-#            
-#            # Add thumbnail URL to download list
-#            if not sceneID in scenelist:
-if len(sceneIDs) > 0:
-    for sceneID in sceneIDs:
-        print('Processing {}, scene number {} of {}.'.format(sceneID, filenum, len(sceneIDs)))
-        scenedict = findlocalfiles(sceneID, fielddict, scenedict)
-        if scenedict[sceneID]['browseUrl'].endswith('.jpg'):
-            dlurl = scenedict[sceneID]['browseUrl']
-            thumbnails.append(scenedict[sceneID]['browseUrl'])
+    #numfiles = len(xmls)
+    #xmldict = {}
+
+    # Download XML files from USGS/EROS
+    #if not localxmls:
+    #    print(dlxmls(args.startdate, args.enddate, xmls, ingestdir))
+
+    # Parse XML files
+    #for xml in xmls:
+    #    print('Processing {}, file number {} of {}.'.format(xml, filenum, numfiles))
+    #    xmlfile = os.path.join(ingestdir, xml)
+    #    tree = ET.parse(xmlfile)
+    #    root = tree.getroot()
+    ##    headervals = []
+    ##    for i in range(len(root[1])):
+    ##        j = root[1][i].tag.find('}') + 1
+    ##        if not root[1][i].tag[j:] in polycoords:
+    ##            headervals.append(root[1][i].tag[j:])
+    #    
+    #    numnodes = len(root)
+    #    for i in range(numnodes):
+    #        tdict = {} # Version 1.1.1: Now uses a dict rather than absolute position in XML node for fields and values
+    #        for j in range(len(root[i])):
+    #            k = root[i][j].tag.find('}') + 1
+    #            tagname = root[i][j].tag[k:]
+    #            if not tagname in polycoords:
+    #                fname = fnames[tags.index(tagname)]
+    #                tdict[fname] = root[i][j].text
+    #            elif tagname in polycoords:
+    #                tdict[tagname] = root[i][j].text
+    #            else:
+    #                print('ERROR: Discovered previously unused XML tag {}, logging to error file: '.format(tagname, errorfile))
+    #                ieo.logerror(xml, 'Unused XML tag: {}'.format(tagname), errorfile = errorfile)
+    #                errorsfound = True
+    #        
+    #        sys.stderr.write('\rProcessing node {} of {}.'.format(i + 1, numnodes))
+    #        if len(root[i]) > 10:
+    #            sceneID = tdict['sceneID']
+    #            xmldict[sceneID] = tdict
+    #            
+    #            # Add thumbnail URL to download list
+    #            if not sceneID in scenelist:
+    if len(sceneIDs) > 0:
+        for sceneID in sceneIDs:
+            print('Processing {}, scene number {} of {}.'.format(sceneID, filenum, len(sceneIDs)))
+            scenedict = findlocalfiles(sceneID, fielddict, scenedict)
+            if scenedict[sceneID]['browseUrl'].endswith('.jpg'):
+                dlurl = scenedict[sceneID]['browseUrl']
+                thumbnails.append(scenedict[sceneID]['browseUrl'])
         
-        print('\nAdding {} to shapefile.'.format(sceneID))
-        scenelist.append(sceneID)
-        # Determine polygon coordinates in Lat/ Lon WGS-84
-        coords = scenedict[sceneID]['coords']
-        '''[
+            print('\nAdding {} to shapefile.'.format(sceneID))
+            scenelist.append(sceneID)
+            added.append(sceneID)
+            # Determine polygon coordinates in Lat/ Lon WGS-84
+            coords = scenedict[sceneID]['coords']
+            '''[
 [float(tdict['upperLeftCornerLongitude']), float(tdict['upperLeftCornerLatitude'])], 
 [float(tdict['upperRightCornerLongitude']), float(tdict['upperRightCornerLatitude'])], 
 [float(tdict['lowerRightCornerLongitude']), float(tdict['lowerRightCornerLatitude'])], 
 [float(tdict['lowerLeftCornerLongitude']), float(tdict['lowerLeftCornerLatitude'])], [float(tdict['upperLeftCornerLongitude']), float(tdict['upperLeftCornerLatitude'])]] '''
-        # create the feature
-        feature = ogr.Feature(layer.GetLayerDefn())
-        # Add field attributes from XML
-#                for k in range(len(root[i])):
-#                    if root[i][k].tag[j:] in headervals:
-#                        m = tags.index(root[i][k].tag[j:])
-#                        feature.SetField(root[i][k].tag[j:], root[i][k].text)
-        feature.SetField('sceneID', sceneID)
-        for key in scenedict[sceneID].keys():
+            # create the feature
+            feature = ogr.Feature(layer.GetLayerDefn())
+            # Add field attributes from XML
+    #                for k in range(len(root[i])):
+    #                    if root[i][k].tag[j:] in headervals:
+    #                        m = tags.index(root[i][k].tag[j:])
+    #                        feature.SetField(root[i][k].tag[j:], root[i][k].text)
+            feature.SetField('sceneID', sceneID)
+            for key in scenedict[sceneID].keys():
             
-#            print('key = {}, type = {}, value = '.format(key, type(scenedict[sceneID][key])))
-#            print(scenedict[sceneID][key])
-            if (scenedict[sceneID][key]) and key in queryfieldnames:
-                #print('key = {}, type = {}.'.format(key, type(scenedict[sceneID][key])))
+    #            print('key = {}, type = {}, value = '.format(key, type(scenedict[sceneID][key])))
+    #            print(scenedict[sceneID][key])
+                if (scenedict[sceneID][key]) and key in queryfieldnames:
+                    #print('key = {}, type = {}.'.format(key, type(scenedict[sceneID][key])))
+                    try:
+                        if fieldvaluelist[queryfieldnames.index(key)][3] == ogr.OFTDate:
+                            feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key].year, scenedict[sceneID][key].month, scenedict[sceneID][key].day, scenedict[sceneID][key].hour, scenedict[sceneID][key].minute, scenedict[sceneID][key].second, 100)
+                        else:
+                            feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key])
+                    except Exception as e:
+                        print('Error with SceneID {}, fieldname = {}, value = {}: {}'.format(sceneID, fnames[queryfieldnames.index(key)], scenedict[sceneID][key], e))
+                        ieo.logerror(key, e, errorfile = errorfile)
+            basename = os.path.basename(dlurl)
+            jpg = os.path.join(jpgdir, basename)
+        
+        
+            if not os.access(jpg, os.F_OK) and args.thumbnails:
                 try:
-                    if fieldvaluelist[queryfieldnames.index(key)][3] == ogr.OFTDate:
-                        feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key].year, scenedict[sceneID][key].month, scenedict[sceneID][key].day, scenedict[sceneID][key].hour, scenedict[sceneID][key].minute, scenedict[sceneID][key].second, 100)
+                    response = dlthumb(dlurl, jpgdir)
+                    if response == 'Success!':
+                        geom = feature.GetGeometryRef()
+                        print('Creating world file.')
+                        makeworldfile(jpg, geom)
+                        print('Migrating world and projection files to new directory.')
+                        jpw = jpg.replace('.jpg', '.jpw')
+                        prj = jpg.replace('.jpg', '.prj')
                     else:
-                        feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key])
+                        print('Error with sceneID or filename, adding to error list.')
+                        ieo.logerror(sceneID, response, errorfile = errorfile)
+                        errorsfound = True
+                    if os.access(jpg, os.F_OK):
+                        feature.SetField('Thumb_JPG', jpg)
+    #                for key in scenedict[sceneID].keys():
+    #                    if scenedict[sceneID][key]:
+    #                        feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key])
+                        
+                    layer.SetFeature(feature)
                 except Exception as e:
-                    print('Error with SceneID {}, fieldname = {}, value = {}: {}'.format(sceneID, fnames[queryfieldnames.index(key)], scenedict[sceneID][key], e))
-                    ieo.logerror(key, e, errorfile = errorfile)
-        basename = os.path.basename(dlurl)
-        jpg = os.path.join(jpgdir, basename)
-        
-        
-        if not os.access(jpg, os.F_OK) and args.thumbnails:
-            try:
-                response = dlthumb(dlurl, jpgdir)
-                if response == 'Success!':
-                    geom = feature.GetGeometryRef()
-                    print('Creating world file.')
-                    makeworldfile(jpg, geom)
-                    print('Migrating world and projection files to new directory.')
-                    jpw = jpg.replace('.jpg', '.jpw')
-                    prj = jpg.replace('.jpg', '.prj')
-                else:
-                    print('Error with sceneID or filename, adding to error list.')
-                    ieo.logerror(sceneID, response, errorfile = errorfile)
+                    print(e)
+                    ieo.logerror(os.path.basename(jpg), e, errorfile = errorfile)
                     errorsfound = True
-                if os.access(jpg, os.F_OK):
-                    feature.SetField('Thumb_JPG', jpg)
-#                for key in scenedict[sceneID].keys():
-#                    if scenedict[sceneID][key]:
-#                        feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key])
-                        
-                layer.SetFeature(feature)
-            except Exception as e:
-                print(e)
-                ieo.logerror(os.path.basename(jpg), e, errorfile = errorfile)
-                errorsfound = True
-        # Create ring
-        ring = ogr.Geometry(ogr.wkbLinearRing)
-        for coord in coords:
-            ring.AddPoint(coord[0], coord[1])
-        # Create polygon
-        poly = ogr.Geometry(ogr.wkbPolygon)
+            # Create ring
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            for coord in coords:
+                ring.AddPoint(coord[0], coord[1])
+            # Create polygon
+            poly = ogr.Geometry(ogr.wkbPolygon)
         
-        poly.AddGeometry(ring)  
-        poly.Transform(transform)   # Convert to local projection
-        feature.SetGeometry(poly)  
-        layer.CreateFeature(feature)
-        feature.Destroy()
-        print('\n')
-        filenum += 1
-
-# Update metadata in shapefile
-#layer_defn = layer.GetLayerDefn()
-#field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
-#
-#for field in addfields: #Add any missing fields
-#    if not field in field_names:
-#        new_field = ogr.FieldDefn(field, ogr.OFTString)
-#        layer.CreateField(new_field)
-
-#for feature in layer:
-##    updatingfeature = False
-#    sceneID = feature.GetField("sceneID")
-#    scenedict = findlocalfiles(sceneID, fielddict, scenedict)
-#    dlurl = feature.GetField("browseURL")
-#    if dlurl:
-#        print('Processing scene {}.'.format(sceneID))
-#        basename = os.path.basename(dlurl)
-#        jpg = os.path.join(jpgdir, basename)
-##        for fname in fnames:
-##            if feature.GetField(fname) != xmldict[sceneID][fname]:
-##                print('Updating metadata for sceneID {}, field {}: {}'.format(sceneID, fname, xmldict[sceneID][fname]))
-##                feature.Setfield(fname, xmldict[sceneID][fname])
-#       
-#        if os.path.isfile(jpg) and jpg != feature.GetField(addfields[0]):
-#            print('Updating metadata for sceneID {}, field {}: {}'.format(sceneID, jpg, addfields[0]))
-#            feature.SetField(jpg, addfields[0])
-#            updatingfeature = True
+            poly.AddGeometry(ring)  
+            poly.Transform(transform)   # Convert to local projection
+            feature.SetGeometry(poly)  
+            layer.CreateFeature(feature)
+            index.addfeature(feature)
+            feature.Destroy()
+            print('\n')
+            filenum += 1
+
+    # Update metadata in shapefile
+    #layer_defn = layer.GetLayerDefn()
+    #field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+    #
+    #for field in addfields: #Add any missing fields
+    #    if not field in field_names:
+    #        new_field = ogr.FieldDefn(field, ogr.OFTString)
+    #        layer.CreateField(new_field)
+
+    #for feature in layer:
+    ##    updatingfeature = False
+    #    sceneID = feature.GetField("sceneID")
+    #    scenedict = findlocalfiles(sceneID, fielddict, scenedict)
+    #    dlurl = feature.GetField("browseURL")
+    #    if dlurl:
+    #        print('Processing scene {}.'.format(sceneID))
+    #        basename = os.path.basename(dlurl)
+    #        jpg = os.path.join(jpgdir, basename)
+    ##        for fname in fnames:
+    ##            if feature.GetField(fname) != xmldict[sceneID][fname]:
+    ##                print('Updating metadata for sceneID {}, field {}: {}'.format(sceneID, fname, xmldict[sceneID][fname]))
+    ##                feature.Setfield(fname, xmldict[sceneID][fname])
+    #       
+    #        if os.path.isfile(jpg) and jpg != feature.GetField(addfields[0]):
+    #            print('Updating metadata for sceneID {}, field {}: {}'.format(sceneID, jpg, addfields[0]))
+    #            feature.SetField(jpg, addfields[0])
+    #            updatingfeature = True
                 
-#    for key in scenedict[sceneID].keys():
-#        if scenedict[sceneID][key] and scenedict[sceneID][key] != feature.GetField(fnames[queryfieldnames.index(key)]):
-#            feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key])
-#            updatingfeature = True
-#    if updatingfeature:
-#        layer.SetFeature(feature)
+    #    for key in scenedict[sceneID].keys():
+    #        if scenedict[sceneID][key] and scenedict[sceneID][key] != feature.GetField(fnames[queryfieldnames.index(key)]):
+    #            feature.SetField(fnames[queryfieldnames.index(key)], scenedict[sceneID][key])
+    #            updatingfeature = True
+    #    if updatingfeature:
+    #        layer.SetFeature(feature)
+
+    data_source = None
+    index.setsource(shapefile)
+    index.close()
 
-data_source = None
+    if errorsfound:
+        print('Errors were found during script execution. please see the error log file for details: {}'.format(errorfile))
+    return added
 
-if errorsfound:
-    print('Errors were found during script execution. please see the error log file for details: {}'.format(errorfile))
+def main(argv = None):
+    scenes = run(getparser().parse_args(argv))
+    print('Processing complete.')
+    return scenes
 
-print('Processing complete.')
+if __name__ == '__main__':
+    main()
 
 '''
 old code
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This script calculates NDVI and EVI for clear land pixels from ingested surface reflectance (SR)
+# data. SR stacks and Fmask/ pixel QA layers are read in blocks of lines, indices are calculated
+# with NumPy across a thread pool, and results are written to ENVI files as each block completes,
+# so that memory use is bounded by block size rather than scene size. It can be run on a single
+# scene or on the whole library, in which case scenes with up to date outputs are skipped.
+
+import os, sys, glob, argparse, threading, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from osgeo import gdal
+import qadecode
+
+try: # This is included as the module may not properly install in Anaconda.
+    import ieo
+except:
+    print('Error: IEO failed to load. Please input the location of the directory containing the IEO installation files.')
+    ieodir = input('IEO installation path: ')
+    if os.path.isfile(os.path.join(ieodir, 'ieo.py')):
+        sys.path.append(r'D:\Data\IEO\ieo')
+        import ieo
+    else:
+        print('Error: that is not a valid path for the IEO module. Exiting.')
+        sys.exit()
+
+# SR stack band numbers by band name. Landsat 4-7 stacks contain bands 1-5 and 7, Landsat 8 stacks
+# contain bands 1-7.
+bandnumbers = {'L8': {'blue': 2, 'green': 3, 'red': 4, 'nir': 5, 'swir1': 6, 'swir2': 7},
+               'L47': {'blue': 1, 'green': 2, 'red': 3, 'nir': 4, 'swir1': 5, 'swir2': 6}}
+srscale = 0.0001
+srnodata = -9999
+vinodata = 0
+
+def landsatnumber(filename):
+    # Works for both scene ID (LC8...) and product ID (LC08_...) based file names
+    basename = os.path.basename(filename)
+    if basename[2:3] == '0':
+        return int(basename[3:4])
+    return int(basename[2:3])
+
+def clearland(mask, masktype, landsat = None):
+    # Returns a boolean array of clear land pixels, decoded with the lookup tables in qadecode
+    return qadecode.clearland(mask, masktype, landsat)
+
+def masktypefromfilename(maskfile):
+    if maskfile.endswith('_pixel_qa.dat'):
+        return 'pixel_qa'
+    return 'cfmask'
+
+def calcblock(blue, red, nir, clear):
+    # Calculates NDVI and EVI for a block of SR data, setting non-clear land pixels to vinodata
+    valid = clear & (blue != srnodata) & (red != srnodata) & (nir != srnodata)
+    blue = blue.astype(np.float32) * srscale
+    red = red.astype(np.float32) * srscale
+    nir = nir.astype(np.float32) * srscale
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ndvi = (nir - red) / (nir + red)
+        evi = 2.5 * (nir - red) / (nir + 6.0 * red - 7.5 * blue + 1.0)
+    ndvi = np.where(valid & np.isfinite(ndvi), ndvi, vinodata).astype(np.float32)
+    evi = np.where(valid & np.isfinite(evi), evi, vinodata).astype(np.float32)
+    return ndvi, evi
+
+def uptodate(outputs, inputs):
+    # True if all outputs exist and are newer than all inputs
+    if not all(os.path.isfile(f) for f in outputs):
+        return False
+    return min(os.path.getmtime(f) for f in outputs) >= max(os.path.getmtime(f) for f in inputs)
+
+def createoutput(filename, template, description):
+    driver = gdal.GetDriverByName('ENVI')
+    if os.path.isfile(filename):
+        driver.Delete(filename)
+    ds = driver.Create(filename, template.RasterXSize, template.RasterYSize, 1, gdal.GDT_Float32)
+    ds.SetGeoTransform(template.GetGeoTransform())
+    ds.SetProjection(template.GetProjection())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(vinodata)
+    band.SetDescription(description)
+    return ds
+
+def calcindices(srfile, maskfile, ndvifile, evifile, threads = None, blocklines = 256, overwrite = False):
+    # Calculates NDVI and EVI for one scene. Returns True if outputs were written.
+    if not overwrite and uptodate([ndvifile, evifile], [srfile, maskfile]):
+        print('NDVI and EVI for {} are up to date, skipping.'.format(os.path.basename(srfile)))
+        return False
+    if not threads:
+        threads = os.cpu_count() or 1
+    landsat = landsatnumber(srfile)
+    if landsat == 8:
+        bands = bandnumbers['L8']
+    else:
+        bands = bandnumbers['L47']
+    masktype = masktypefromfilename(maskfile)
+    starttime = time.time()
+    src = gdal.Open(srfile)
+    if not src:
+        raise IOError('Unable to open SR file: {}'.format(srfile))
+    xsize, ysize = src.RasterXSize, src.RasterYSize
+    print('Calculating NDVI and EVI for {} ({} x {} pixels, {} threads).'.format(os.path.basename(srfile), xsize, ysize, threads))
+    outputs = [createoutput(ndvifile, src, 'NDVI'), createoutput(evifile, src, 'EVI')]
+    src = None
+    local = threading.local()
+
+    def readblock(yoff):
+        # Each thread keeps its own dataset handles, as GDAL datasets may not be shared between threads
+        if not hasattr(local, 'sr'):
+            local.sr = gdal.Open(srfile)
+            local.mask = gdal.Open(maskfile)
+        lines = min(blocklines, ysize - yoff)
+        blue = local.sr.GetRasterBand(bands['blue']).ReadAsArray(0, yoff, xsize, lines)
+        red = local.sr.GetRasterBand(bands['red']).ReadAsArray(0, yoff, xsize, lines)
+        nir = local.sr.GetRasterBand(bands['nir']).ReadAsArray(0, yoff, xsize, lines)
+        clear = clearland(local.mask.GetRasterBand(1).ReadAsArray(0, yoff, xsize, lines), masktype, landsat)
+        return yoff, calcblock(blue, red, nir, clear)
+
+    # Blocks are written by this thread as soon as they complete. The number of blocks in flight
+    # is limited to twice the number of threads, which bounds memory use.
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        pending = set()
+        for yoff in range(0, ysize, blocklines):
+            pending.add(executor.submit(readblock, yoff))
+            if len(pending) >= threads * 2:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    writeblock(outputs, *future.result())
+        for future in pending:
+            writeblock(outputs, *future.result())
+    for ds in outputs:
+        ds.FlushCache()
+    outputs = None
+    print('NDVI and EVI for {} written in {:0.1f} s.'.format(os.path.basename(srfile), time.time() - starttime))
+    return True
+
+def writeblock(outputs, yoff, results):
+    for ds, data in zip(outputs, results):
+        ds.GetRasterBand(1).WriteArray(data, 0, yoff)
+
+def findmask(scenebase, pixelqadir, fmaskdir):
+    # Pixel QA layers are preferred over Fmask where both exist
+    for dirname, ext in [(pixelqadir, '_pixel_qa.dat'), (fmaskdir, '_cfmask.dat')]:
+        maskfile = os.path.join(dirname, '{}{}'.format(scenebase, ext))
+        if os.path.isfile(maskfile):
+            return maskfile
+    return None
+
+def findscenes(srdir, pixelqadir, fmaskdir, ndvidir, evidir, year = None):
+    # Returns a list of [SR, mask, NDVI, EVI] file names for every scene in the library
+    scenes = []
+    if year:
+        flist = glob.glob(os.path.join(srdir, 'L*{}*_ref_{}.dat'.format(year, ieo.projacronym)))
+    else:
+        flist = glob.glob(os.path.join(srdir, 'L*_ref_{}.dat'.format(ieo.projacronym)))
+    for srfile in sorted(flist):
+        basename = os.path.basename(srfile)
+        scenebase = basename[:basename.find('_ref_')]
+        maskfile = findmask(scenebase, pixelqadir, fmaskdir)
+        if not maskfile:
+            print('Error: no Fmask or pixel QA layer found for {}, skipping.'.format(scenebase))
+            continue
+        scenes.append([srfile, maskfile, os.path.join(ndvidir, '{}_NDVI.dat'.format(scenebase)), os.path.join(evidir, '{}_EVI.dat'.format(scenebase))])
+    return scenes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script calculates NDVI and EVI for clear land pixels from ingested surface reflectance data.')
+    parser.add_argument('-if', '--infile', type = str, default = None, help = 'Single SR file to process. If not set, the whole library will be processed.')
+    parser.add_argument('-i', '--srdir', type = str, default = ieo.srdir, help = 'Surface reflectance directory')
+    parser.add_argument('-f', '--fmaskdir', type = str, default = ieo.fmaskdir, help = 'Fmask directory')
+    parser.add_argument('-q', '--pixelqadir', type = str, default = ieo.pixelqadir, help = 'Pixel QA directory')
+    parser.add_argument('-n', '--ndvidir', type = str, default = ieo.ndvidir, help = 'NDVI output directory')
+    parser.add_argument('-e', '--evidir', type = str, default = ieo.evidir, help = 'EVI output directory')
+    parser.add_argument('-y', '--year', type = int, default = None, help = 'Process scenes only for a specific year.')
+    parser.add_argument('-t', '--threads', type = int, default = os.cpu_count(), help = 'Number of threads (default = number of CPU cores).')
+    parser.add_argument('--blocklines', type = int, default = 256, help = 'Number of lines read per block. Memory use scales with this value.')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'Recalculate indices even if outputs are newer than inputs.')
+    args = parser.parse_args()
+
+    if args.infile:
+        basename = os.path.basename(args.infile)
+        scenebase = basename[:basename.find('_ref_')]
+        maskfile = findmask(scenebase, args.pixelqadir, args.fmaskdir)
+        if maskfile:
+            scenes = [[args.infile, maskfile, os.path.join(args.ndvidir, '{}_NDVI.dat'.format(scenebase)), os.path.join(args.evidir, '{}_EVI.dat'.format(scenebase))]]
+        else:
+            print('Error: no Fmask or pixel QA layer found for {}. Exiting.'.format(args.infile))
+            sys.exit()
+    else:
+        scenes = findscenes(args.srdir, args.pixelqadir, args.fmaskdir, args.ndvidir, args.evidir, year = args.year)
+
+    numscenes = len(scenes)
+    print('{} scenes found.'.format(numscenes))
+    for i, scene in enumerate(scenes, start = 1):
+        print('Scene {} of {}.'.format(i, numscenes))
+        try:
+            calcindices(*scene, threads = args.threads, blocklines = args.blocklines, overwrite = args.overwrite)
+        except Exception as e:
+            print('Error processing {}: {}'.format(os.path.basename(scene[0]), e))
+            ieo.logerror(scene[0], e)
+
+    print('Processing complete.')
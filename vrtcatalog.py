@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module stores the catalog of VRTs created by makevrts.py in an indexed SQLite database.
+# Rows are keyed by product, date, and WRS-2 Path, so that rebuilt VRTs replace their previous
+# entries. Writes are buffered in transactions, and the catalog can be exported to the CSV format
+# previously written by makevrts.py. Run as a script, it queries or exports the catalog.
+
+import os, sys, json, sqlite3, datetime, argparse
+
+class VRTCatalog(object):
+    def __init__(self, dbfile, buffersize = 500):
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.dbfile = dbfile
+        self.buffersize = buffersize
+        self.pending = 0
+        self.conn = sqlite3.connect(dbfile, timeout = 60)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS vrts (
+                product TEXT,
+                date TEXT,
+                year INTEGER,
+                doy INTEGER,
+                path INTEGER,
+                vrt TEXT,
+                scenes TEXT,
+                updated TEXT,
+                PRIMARY KEY (product, date, path))''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS vrts_date ON vrts (date)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS vrts_path_year ON vrts (path, year)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS members (
+                product TEXT,
+                date TEXT,
+                path INTEGER,
+                row INTEGER,
+                sceneid TEXT,
+                PRIMARY KEY (product, date, path, row))''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS members_sceneid ON members (sceneid)')
+
+    def upsert(self, product, d, path, vrt, scenes):
+        # d is a date string in YYYYDDD format, scenes a dict of WRS-2 Row: scene or product ID
+        datetuple = datetime.datetime.strptime(d, '%Y%j')
+        datestr = datetuple.strftime('%Y-%m-%d')
+        self.conn.execute('''INSERT OR REPLACE INTO vrts (product, date, year, doy, path, vrt, scenes, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (product, datestr, datetuple.year, int(datetuple.strftime('%j')), int(path), vrt, json.dumps({str(row): scenes[row] for row in scenes.keys()}), datetime.datetime.now().isoformat()))
+        self.conn.execute('DELETE FROM members WHERE product = ? AND date = ? AND path = ?', (product, datestr, int(path)))
+        self.conn.executemany('INSERT INTO members (product, date, path, row, sceneid) VALUES (?, ?, ?, ?, ?)',
+            [(product, datestr, int(path), int(row), scenes[row]) for row in scenes.keys()])
+        self.pending += 1
+        if self.pending >= self.buffersize:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def has(self, product, d, path):
+        datestr = datetime.datetime.strptime(d, '%Y%j').strftime('%Y-%m-%d')
+        return self.conn.execute('SELECT 1 FROM vrts WHERE product = ? AND date = ? AND path = ?', (product, datestr, int(path))).fetchone() is not None
+
+    def query(self, product = None, path = None, year = None, startdate = None, enddate = None, sceneid = None):
+        # Dates are strings in YYYY-MM-DD format. All conditions are optional.
+        sql = 'SELECT * FROM vrts'
+        conditions = []
+        values = []
+        for column, value in [['product', product], ['path', path], ['year', year]]:
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                values.append(value)
+        if startdate:
+            conditions.append('date >= ?')
+            values.append(startdate)
+        if enddate:
+            conditions.append('date <= ?')
+            values.append(enddate)
+        if sceneid:
+            conditions.append('EXISTS (SELECT 1 FROM members m WHERE m.product = vrts.product AND m.date = vrts.date AND m.path = vrts.path AND m.sceneid LIKE ?)')
+            values.append('{}%'.format(sceneid))
+        if len(conditions) > 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY product, date, path'
+        return self.conn.execute(sql, values).fetchall()
+
+    def products(self):
+        return [row['product'] for row in self.conn.execute('SELECT DISTINCT product FROM vrts ORDER BY product')]
+
+    def exportcsv(self, product, catfile, rows):
+        # Writes all catalog entries of a product to CSV. rows is the list of WRS-2 Rows for the header.
+        rows = sorted(rows)
+        header = 'Date,Year,DOY,Path'
+        for x in rows:
+            header += ',R{:03d}'.format(x)
+        header += ',VRT'
+        tmp = '{}.tmp'.format(catfile)
+        with open(tmp, 'w') as output:
+            output.write('{}\n'.format(header))
+            for entry in self.query(product = product):
+                scenes = json.loads(entry['scenes'])
+                outline = '{},{},{:03d},{:03d}'.format(entry['date'], entry['year'], entry['doy'], entry['path'])
+                for x in rows:
+                    outline += ',{}'.format(scenes.get(str(x), 'None'))
+                outline += ',{}'.format(entry['vrt'])
+                output.write('{}\n'.format(outline))
+        os.replace(tmp, catfile)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('This script queries or exports the VRT catalog created by makevrts.py.')
+    parser.add_argument('catalog', type = str, help = 'VRT catalog database.')
+    parser.add_argument('--product', type = str, default = None, help = 'Product directory name, e.g. SR, Fmask, NDVI.')
+    parser.add_argument('--path', type = int, default = None, help = 'WRS-2 Path')
+    parser.add_argument('--year', type = int, default = None, help = 'Year')
+    parser.add_argument('--startdate', type = str, default = None, help = 'Starting date, YYYY-MM-DD')
+    parser.add_argument('--enddate', type = str, default = None, help = 'Ending date, YYYY-MM-DD')
+    parser.add_argument('--sceneid', type = str, default = None, help = 'Return VRTs containing this scene ID (or its prefix).')
+    parser.add_argument('--exportcsv', type = str, default = None, help = 'Export all entries of --product to this CSV file.')
+    parser.add_argument('--rows', type = str, default = None, help = 'Comma-delimited WRS-2 Rows for CSV export (default = all rows in the catalog).')
+    args = parser.parse_args()
+
+    catalog = VRTCatalog(args.catalog)
+    if args.exportcsv:
+        if not args.product:
+            print('Error: --product must be set with --exportcsv. Exiting.')
+            sys.exit()
+        if args.rows:
+            rows = [int(x) for x in args.rows.split(',')]
+        else:
+            rows = [row[0] for row in catalog.conn.execute('SELECT DISTINCT row FROM members WHERE product = ?', (args.product,))]
+        catalog.exportcsv(args.product, args.exportcsv, rows)
+        print('Catalog exported to: {}'.format(args.exportcsv))
+    else:
+        for entry in catalog.query(product = args.product, path = args.path, year = args.year, startdate = args.startdate, enddate = args.enddate, sceneid = args.sceneid):
+            print('{},{},{:03d},{}'.format(entry['product'], entry['date'], entry['path'], entry['vrt']))
+    catalog.close()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# By Guy Serbin, Environment, Soils, and Land Use Dept., CELUP, Teagasc,
+# Johnstown Castle, Co. Wexford Y35 TC97, Ireland
+# email: guy <dot> serbin <at> teagasc <dot> ie
+
+# version 1.1.2
+
+# This module writes mosaic VRT XML directly from the ENVI headers of the member rasters, so that
+# the members themselves are never opened. The output follows what gdalbuildvrt produces with
+# -srcnodata for rasters sharing one projection and pixel size.
+
+import os
+from xml.sax.saxutils import escape
+import enviheader
+
+def fmt(value):
+    return '{:.15g}'.format(value)
+
+def memberinfo(filelist):
+    # Reads size, data type, and geotransform of each member from its header
+    members = []
+    for f in filelist:
+        header = enviheader.readheader(f)
+        xsize, ysize, bands = enviheader.rastersize(header)
+        members.append({'filename': os.path.abspath(f), 'xsize': xsize, 'ysize': ysize, 'bands': bands,
+                        'datatype': enviheader.datatype(header), 'geotransform': enviheader.geotransform(header),
+                        'projection': enviheader.projection(header), 'bandnames': enviheader.bandnames(header)})
+    return members
+
+def mosaicgrid(members):
+    # Returns the union extent and pixel size of the members, as gdalbuildvrt -resolution average
+    minx = min(m['geotransform'][0] for m in members)
+    maxy = max(m['geotransform'][3] for m in members)
+    maxx = max(m['geotransform'][0] + m['xsize'] * m['geotransform'][1] for m in members)
+    miny = min(m['geotransform'][3] + m['ysize'] * m['geotransform'][5] for m in members)
+    xres = sum(m['geotransform'][1] for m in members) / len(members)
+    yres = sum(-m['geotransform'][5] for m in members) / len(members)
+    xsize = int(0.5 + (maxx - minx) / xres)
+    ysize = int(0.5 + (maxy - miny) / yres)
+    return [minx, maxy, xres, yres, xsize, ysize]
+
+def sourcexml(member, band, minx, maxy, xres, yres, nodataval):
+    gt = member['geotransform']
+    xoff = (gt[0] - minx) / xres
+    yoff = (maxy - gt[3]) / yres
+    xsize = member['xsize'] * gt[1] / xres
+    ysize = member['ysize'] * -gt[5] / yres
+    lines = ['    <ComplexSource>',
+             '      <SourceFilename relativeToVRT="0">{}</SourceFilename>'.format(escape(member['filename'])),
+             '      <SourceBand>{}</SourceBand>'.format(band),
+             '      <SourceProperties RasterXSize="{0}" RasterYSize="{1}" DataType="{2}" BlockXSize="{0}" BlockYSize="1" />'.format(member['xsize'], member['ysize'], member['datatype']),
+             '      <SrcRect xOff="0" yOff="0" xSize="{}" ySize="{}" />'.format(member['xsize'], member['ysize']),
+             '      <DstRect xOff="{}" yOff="{}" xSize="{}" ySize="{}" />'.format(fmt(xoff), fmt(yoff), fmt(xsize), fmt(ysize))]
+    if nodataval is not None:
+        lines.append('      <NODATA>{}</NODATA>'.format(nodataval))
+    lines.append('    </ComplexSource>')
+    return lines
+
+def writexml(vrt, xsize, ysize, projection, geotrans, bands):
+    # bands is a list of [data type, nodata value, description, list of source XML lines]
+    # Headers without a WKT only describe the projection in 'map info', which is left to GDAL to interpret
+    if not projection:
+        raise KeyError('coordinate system string')
+    lines = ['<VRTDataset rasterXSize="{}" rasterYSize="{}">'.format(xsize, ysize)]
+    lines.append('  <SRS>{}</SRS>'.format(escape(projection)))
+    lines.append('  <GeoTransform> {} </GeoTransform>'.format(', '.join([fmt(x) for x in geotrans])))
+    for i, band in enumerate(bands, start = 1):
+        datatype, nodataval, description, sources = band
+        lines.append('  <VRTRasterBand dataType="{}" band="{}">'.format(datatype, i))
+        if description:
+            lines.append('    <Description>{}</Description>'.format(escape(description)))
+        if nodataval is not None:
+            lines.append('    <NoDataValue>{}</NoDataValue>'.format(nodataval))
+        lines.extend(sources)
+        lines.append('  </VRTRasterBand>')
+    lines.append('</VRTDataset>')
+    # Written to a temporary file first, so that readers never see a partial VRT
+    tmp = '{}.tmp'.format(vrt)
+    with open(tmp, 'w') as output:
+        output.write('\n'.join(lines) + '\n')
+    os.replace(tmp, vrt)
+    return vrt
+
+def writemosaicvrt(vrt, filelist, nodataval = None):
+    # Writes a mosaic of all bands of the members, equivalent to 'gdalbuildvrt -srcnodata nodataval'
+    members = memberinfo([f for f in filelist if f])
+    if len(set(m['bands'] for m in members)) > 1:
+        raise ValueError('Members of {} have differing numbers of bands.'.format(os.path.basename(vrt)))
+    minx, maxy, xres, yres, xsize, ysize = mosaicgrid(members)
+    bands = []
+    for b in range(1, members[0]['bands'] + 1):
+        sources = []
+        for member in members:
+            sources.extend(sourcexml(member, b, minx, maxy, xres, yres, nodataval))
+        bands.append([members[0]['datatype'], nodataval, None, sources])
+    return writexml(vrt, xsize, ysize, members[0]['projection'], [minx, xres, 0.0, maxy, 0.0, -yres], bands)
+
+def writetimeseriesvrt(vrt, filelist, band = 1, nodataval = None, descriptions = None):
+    # Writes a stack with one band per member, taken from band 'band' of each member, in the
+    # order given. Members may have differing extents, and are placed on their union.
+    members = memberinfo(filelist)
+    minx, maxy, xres, yres, xsize, ysize = mosaicgrid(members)
+    bands = []
+    for i, member in enumerate(members):
+        if band > member['bands']:
+            raise ValueError('{} has no band {}.'.format(os.path.basename(member['filename']), band))
+        if descriptions:
+            description = descriptions[i]
+        else:
+            description = None
+        bands.append([member['datatype'], nodataval, description, sourcexml(member, band, minx, maxy, xres, yres, nodataval)])
+    return writexml(vrt, xsize, ysize, members[0]['projection'], [minx, xres, 0.0, maxy, 0.0, -yres], bands)